@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the scene generation.
+"""
+import io
+import os
+import sys
+import time
+import math
+import json
+import random
+import getopt
+import tempfile
+import contextlib
+import numpy
+
+import qsr
+import compiled_model
+import scene_generator
+from scene_generator import BBox, LinearIndex, GridIndex, SceneGenerator, \
+    Stats, MAX_NUM_OF_SAMPLES, GRID_MIN_OBJECTS, bbox_bounds
+from geometry import transform_to_obj_frame, calc_global_bbox
+from simulation import Connection, ModelCache
+
+# Average footprint (side length) of a synthetic object
+OBJECT_SIZE = 0.15
+
+# Fraction of the supporting plane covered by synthetic objects
+DENSITY = 0.5
+
+# Dimensions (x, y, z) of the objects of the fake simulation
+OBJECT_DIMENSIONS = {'Table':    [0.8, 1.6, 0.75],
+                     'Monitor':  [0.2, 0.5, 0.4],
+                     'Keyboard': [0.15, 0.45, 0.03],
+                     'Mouse':    [0.1, 0.06, 0.03],
+                     'Cup':      [0.08, 0.08, 0.1],
+                     'PC':       [0.4, 0.2, 0.4],
+                     'Laptop':   [0.3, 0.35, 0.02]}
+
+# Synthetic QSR models: name -> maximal number of instances per type
+MODELS = [('sparse', 1), ('medium', 2), ('dense', 3)]
+
+
+def random_bbox(rnd, width, depth):
+    """ Returns an axis-aligned box with a random size at a random position
+    on a width x depth plane.
+    """
+    dx = rnd.uniform(0.5, 1.5) * OBJECT_SIZE / 2
+    dy = rnd.uniform(0.5, 1.5) * OBJECT_SIZE / 2
+    x = rnd.uniform(0, width)
+    y = rnd.uniform(0, depth)
+    return BBox([[x + sx * dx, y + sy * dy, z]
+                 for sx in [-1, 1] for sy in [-1, 1] for z in [0.0, 0.1]])
+
+def bench_collision(num_of_objects, num_of_queries, seed=0):
+    """ Times collision tests of random candidates against a dense synthetic
+    scene with the linear scan, the grid and the GridIndex used by the
+    generation (which scans below GRID_MIN_OBJECTS boxes). As in the
+    generation, the candidates are tested in batches of MAX_NUM_OF_SAMPLES
+    and a box is inserted after every batch. Returns the time per query
+    (candidate) in seconds for the three.
+    """
+    rnd = random.Random(seed)
+    side = math.sqrt(num_of_objects * OBJECT_SIZE * OBJECT_SIZE / DENSITY)
+
+    indexes = [LinearIndex(), GridIndex(min_objects=0), GridIndex()]
+    boxes = [random_bbox(rnd, side, side) for i in range(num_of_objects)]
+    queries = numpy.array([bbox_bounds(random_bbox(rnd, side, side))
+                           for i in range(num_of_queries)])
+    batches = [queries[k:k + MAX_NUM_OF_SAMPLES]
+               for k in range(0, num_of_queries, MAX_NUM_OF_SAMPLES)]
+    accepted = [random_bbox(rnd, side, side) for b in batches]
+
+    times = list()
+    results = list()
+    for index in indexes:
+        for i, bbox in enumerate(boxes):
+            index.insert('obj%i' % i, bbox)
+        res = list()
+        start = time.perf_counter()
+        for i, b in enumerate(batches):
+            res.append(index.collisions(b))
+            index.insert('new%i' % i, accepted[i])
+        times.append((time.perf_counter() - start) / num_of_queries)
+        results.append(res)
+
+    for res in results[1:]:
+        if not all(numpy.array_equal(l, g) for l, g in zip(results[0], res)):
+            raise AssertionError('grid index and linear scan disagree')
+
+    return times
+
+def run_collision(opts):
+    num_of_queries = int(opts.get('--queries', 2000))
+    print('%8s %12s %12s %12s %6s %8s' % ('objects', 'linear [us]',
+                                         'grid [us]', 'index [us]', 'path',
+                                         'speedup'))
+    for n in [10, 50, 100, 150, 200, 250, 300, 400, 500, 1000, 3000]:
+        [linear, grid, index] = bench_collision(n, num_of_queries)
+        print('%8i %12.2f %12.2f %12.2f %6s %8.1f' % (
+            n, linear * 1e6, grid * 1e6, index * 1e6,
+            'grid' if n >= GRID_MIN_OBJECTS else 'scan', linear / index))
+
+
+class FakeSimulation():
+    """ In-process stand-in for the services of the MORSE 'simulation'
+    component that are used by the scene generation. Every call takes
+    latency seconds. Like a pymorse client, it only offers rpc and close.
+    """
+    def __init__(self, objects, latency=0.0):
+        # name -> {'type': ..., 'bbox': local bbox, 'pose': [pos, ori]}
+        self.objects = objects
+        self.latency = latency
+
+    def call(self, method, args):
+        obj = self.objects[args[0]]
+        if method == 'get_object_bbox':
+            return json.dumps(obj['bbox'])
+        elif method == 'get_object_global_bbox':
+            return json.dumps(calc_global_bbox(obj['pose'], obj['bbox']))
+        elif method == 'get_object_pose':
+            return json.dumps(obj['pose'])
+        elif method == 'get_object_type':
+            return json.dumps(obj['type'])
+        elif method == 'transform_to_obj_frame':
+            return transform_to_obj_frame(obj['pose'], json.loads(args[1]))
+        elif method == 'set_object_pose':
+            obj['pose'] = [json.loads(args[1]), json.loads(args[2])]
+            return None
+        raise ValueError('unknown service: ' + method)
+
+    def rpc(self, component, method, *args):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self.call(method, args)
+
+    def close(self):
+        pass
+
+def box(dims):
+    """ Returns the corners of a box with the given dimensions that is
+    centered in x and y and stands on z = 0.
+    """
+    [dx, dy, dz] = [d / 2 for d in dims]
+    return [[sx * dx, sy * dy, z] for sx in [-1, 1] for sy in [-1, 1]
+            for z in [0.0, 2 * dz]]
+
+def fake_world(max_objects):
+    """ Returns the objects of a fake simulation: a table and max_objects
+    instances of every other type, named as in the blend files (cup,
+    cup.001, ...).
+    """
+    objects = {'table': {'type': 'Table',
+                         'bbox': box(OBJECT_DIMENSIONS['Table']),
+                         'pose': [[2.0, 1.0, 0.0], [1.0, 0.0, 0.0, 0.0]]}}
+    for t in OBJECT_DIMENSIONS:
+        if t == 'Table':
+            continue
+        for j in range(max_objects):
+            name = t.lower() if j == 0 else t.lower() + '.00' + str(j)
+            objects[name] = {'type': t, 'bbox': box(OBJECT_DIMENSIONS[t]),
+                             'pose': [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0, 0.0]]}
+    return objects
+
+def synthetic_model(max_objects):
+    """ Returns a QSR model in which every type occurs up to max_objects
+    times.
+    """
+    types = [t for t in OBJECT_DIMENSIONS if t != 'Table']
+    landmarks = ['Monitor', 'Laptop', 'Keyboard']
+    return {'types': types,
+            'landmarks': landmarks,
+            'presence': dict((t, [1] * (max_objects + 1)) for t in types),
+            'anchors': dict((t, [1, 6, 1, 1, 3, 1, 0, 1, 0])
+                            for t in landmarks),
+            'qsr': dict((l, dict((t, [3, 2, 4, 1, 3, 4]) for t in types))
+                        for l in landmarks)}
+
+def bench_generation(max_objects, num_of_scenes, latency, seed=0):
+    """ Generates scenes with a synthetic model against a fake simulation.
+    Returns scenes per second, objects, simulator calls and trials per
+    scene.
+    """
+    sim = FakeSimulation(fake_world(max_objects), latency)
+    model = compiled_model.CompiledModel(synthetic_model(max_objects))
+
+    # a cache without model is kept in memory only
+    scene_generator.cache = ModelCache()
+    scene_generator.stats = stats = Stats()
+    connection = Connection(calls=stats.rpc, factory=lambda: sim)
+    generator = SceneGenerator(model, seed=seed, connection=connection)
+
+    num_of_objects = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for no in range(1, num_of_scenes + 1):
+            scene = generator.generate(no)
+            num_of_objects = num_of_objects + len(scene[1]['objects'])
+    elapsed = time.perf_counter() - start
+
+    num_of_calls = sum(c for c, s in stats.rpc.values())
+    return [num_of_scenes / elapsed, num_of_objects / num_of_scenes,
+            num_of_calls / num_of_scenes, stats.trials / num_of_scenes]
+
+def run_generation(opts):
+    num_of_scenes = int(opts.get('--scenes', 20))
+    latencies = [float(l) for l in opts.get('--latency', '0,1').split(',')]
+    print('%8s %8s %13s %10s %12s %13s' % ('model', 'objects', 'latency [ms]',
+                                          'scenes/s', 'calls/scene',
+                                          'trials/scene'))
+    for [name, max_objects] in MODELS:
+        for latency in latencies:
+            [rate, objects, calls, trials] = \
+                bench_generation(max_objects, num_of_scenes, latency / 1000)
+            print('%8s %8.1f %13.1f %10.1f %12.1f %13.1f' % (name, objects,
+                                                            latency, rate,
+                                                            calls, trials))
+
+def bench_parallel(num_of_workers, max_objects, num_of_scenes, latency,
+                   seed=0):
+    """ Generates and labels scenes with generate_parallel and
+    num_of_workers processes, each against its own fake simulation (as with
+    one simulator instance per worker). Returns scenes per second.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        model_file = os.path.join(tmp, 'model.json')
+        with open(model_file, 'w') as qsr_file:
+            json.dump(synthetic_model(max_objects), qsr_file)
+        factory = lambda: FakeSimulation(fake_world(max_objects), latency)
+        workers = [{'host': 'localhost', 'port': 4000 + i, 'table': 'table',
+                    'offset': 0, 'factory': factory}
+                   for i in range(num_of_workers)]
+
+        scene_generator.stats = Stats()
+        start = time.perf_counter()
+        with open(os.path.join(tmp, 'scenes.jsonl'), 'w') as outfile, \
+             contextlib.redirect_stdout(io.StringIO()):
+            scene_generator.generate_parallel(workers, model_file, None, None,
+                                              seed, 1, num_of_scenes, outfile)
+        elapsed = time.perf_counter() - start
+    return num_of_scenes / elapsed
+
+def run_parallel(opts):
+    num_of_scenes = int(opts.get('--scenes', 20))
+    latency = float(opts.get('--latency', '1').split(',')[0])
+    counts = [int(n) for n in opts.get('--workers', '1,2,4,8').split(',')]
+    print('cpus: %i, latency [ms]: %.1f' % (os.cpu_count(), latency))
+    print('%8s %8s %10s %8s' % ('model', 'workers', 'scenes/s', 'speedup'))
+    for [name, max_objects] in MODELS:
+        base = None
+        for n in counts:
+            rate = bench_parallel(n, max_objects, num_of_scenes,
+                                  latency / 1000)
+            base = rate if base is None else base
+            print('%8s %8i %10.1f %8.1f' % (name, n, rate, rate / base))
+
+
+def bench_partition(num_of_triples, partitions, num_of_scalar, seed=0):
+    """ Classifies the relative angles of random (camera, landmark, object)
+    triples into partitions by evaluating the densities of all partitions
+    and by the bin lookup, in batches and one by one (for num_of_scalar
+    triples). Returns the time per triple in seconds for all four.
+    """
+    rnd = numpy.random.RandomState(seed)
+    [camera, landmark, obj] = rnd.uniform(-3, 3, (3, num_of_triples, 3))
+    angles = qsr.relative_angle_batch(camera, landmark, obj)
+
+    times = list()
+    results = list()
+    for f in [qsr.argmax_partition_exact_batch, qsr.argmax_partition_batch]:
+        start = time.perf_counter()
+        results.append(f(angles, partitions))
+        times.append((time.perf_counter() - start) / num_of_triples)
+
+    scalar = angles[:num_of_scalar].tolist()
+    for f in [qsr.argmax_partition_exact, qsr.argmax_partition]:
+        start = time.perf_counter()
+        results.append(numpy.array([f(a, partitions) for a in scalar]))
+        times.append((time.perf_counter() - start) / len(scalar))
+
+    if not ((results[0] == results[1]).all() and
+            (results[2] == results[3]).all() and
+            (results[0][:num_of_scalar] == results[2]).all()):
+        raise AssertionError('bin lookup and densities disagree')
+
+    return times
+
+def run_partition(opts):
+    num_of_triples = int(opts.get('--triples', 1000000))
+    num_of_scalar = min(num_of_triples, 100000)
+    print('%10s %10s %26s %26s' % ('', '', 'batch [ns/triple]',
+                                   'scalar [ns/triple]'))
+    print('%10s %10s %8s %8s %8s %8s %8s %8s' % ('partitions', 'triples',
+                                                 'exact', 'lookup', 'speedup',
+                                                 'exact', 'lookup', 'speedup'))
+    for partitions in [4, qsr.NUMBER_OF_PARTITIONS, 16]:
+        [batch_exact, batch_lookup, scalar_exact, scalar_lookup] = \
+            bench_partition(num_of_triples, partitions, num_of_scalar)
+        print('%10i %10i %8.1f %8.1f %8.1f %8.1f %8.1f %8.1f' % (
+            partitions, num_of_triples, batch_exact * 1e9, batch_lookup * 1e9,
+            batch_exact / batch_lookup, scalar_exact * 1e9,
+            scalar_lookup * 1e9, scalar_exact / scalar_lookup))
+
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def help_msg():
+    return """
+  Usage: benchmark.py [-h] [--queries=<n>] [--scenes=<n>] [--latency=<ms>] [--workers=<n>] [--triples=<n>] collision|generation|parallel|partition
+
+    collision       collision tests: linear scan vs. grid on dense
+                    synthetic scenes; index is the GridIndex of the
+                    generation and path the test it used
+    generation      scene generation with synthetic QSR models against an
+                    in-process fake of the simulator
+    parallel        throughput of the parallel generation (and labelling)
+                    by number of worker processes, each with its own fake
+                    simulator; the speedup is relative to the first count
+    partition       QSR partitions of random triples: evaluating the
+                    densities of all partitions vs. the bin lookup
+
+    --queries=<n>   number of collision queries per scene (default: 2000)
+    --scenes=<n>    number of scenes per model and latency (default: 20)
+    --latency=<ms>  comma separated latencies of a simulator call in
+                    milliseconds (default: 0,1; parallel uses the first
+                    given, default 1)
+    --workers=<n>   comma separated numbers of worker processes
+                    (default: 1,2,4,8)
+    --triples=<n>   number of triples per number of partitions
+                    (default: 1000000, at most 100000 one by one)
+
+    -h, --help for seeing this msg
+"""
+
+if __name__ == "__main__":
+    argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "h", ["help", "queries=",
+                                                       "scenes=", "latency=",
+                                                       "workers=", "triples="])
+        except getopt.error as msg:
+            raise Usage(msg)
+
+        if ('-h','') in opts or ('--help', '') in opts or len(args) != 1:
+            raise Usage(help_msg())
+
+        if args[0] == 'collision':
+            run_collision(dict(opts))
+        elif args[0] == 'generation':
+            run_generation(dict(opts))
+        elif args[0] == 'parallel':
+            run_parallel(dict(opts))
+        elif args[0] == 'partition':
+            run_partition(dict(opts))
+        else:
+            raise Usage(help_msg())
+
+    except Usage as err:
+        print(err.msg)
+        print("for help use --help")
@@ -0,0 +1,192 @@
+"""
+Compiled QSR models for the scene generation. The counts of a QSR model
+(presence, anchors and qsr) are turned into normalized categorical
+distributions with alias tables, so every draw takes constant time
+regardless of the raw counts. The compiled form is cached next to the
+source JSON file.
+"""
+import os
+import json
+import random
+
+from contextlib import contextmanager
+
+@contextmanager
+def ignored(*exceptions):
+    try:
+        yield
+    except exceptions:
+        pass
+
+# Version of the compiled format, bump when it changes
+VERSION = 1
+
+# Anchors on the supporting plane in the order of the 'anchors' counts
+ANCHOR_NAMES = ['north_west','north','north_east',
+                'west','center','east',
+                'south_west','south','south_east']
+
+
+class AliasSampler():
+    """ Samples from a categorical distribution in O(1) with Vose's alias
+    method. Drawing a value is equivalent to random.sample(population, 1)[0]
+    on a population that contains every value as often as its weight.
+    """
+    def __init__(self, values, weights):
+        self.values = list(values)
+        self.probs = list()
+        total = float(sum(weights))
+        if total > 0:
+            self.probs = [w / total for w in weights]
+        self.build()
+
+    def build(self):
+        n = len(self.probs)
+        self.prob = [p * n for p in self.probs]
+        self.alias = list(range(n))
+        small = [i for i in range(n) if self.prob[i] < 1.0]
+        large = [i for i in range(n) if self.prob[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self.alias[s] = l
+            self.prob[l] = self.prob[l] + self.prob[s] - 1.0
+            if self.prob[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # numerical leftovers
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self):
+        if not self.probs:
+            raise ValueError('sample from an empty distribution')
+        i = random.randrange(len(self.values))
+        if random.random() < self.prob[i]:
+            return self.values[i]
+        return self.values[self.alias[i]]
+
+    def to_json(self):
+        return {'values': self.values, 'probs': self.probs,
+                'prob': self.prob, 'alias': self.alias}
+
+    @classmethod
+    def from_json(cls, data):
+        sampler = cls.__new__(cls)
+        sampler.values = data['values']
+        sampler.probs = data['probs']
+        sampler.prob = data['prob']
+        sampler.alias = data['alias']
+        return sampler
+
+    def __repr__(self):
+        return str(dict(zip(self.values, [round(p, 3) for p in self.probs])))
+
+
+class CompiledModel():
+    """ A QSR model as a set of samplers:
+
+      presence[type]                  number of instances of a type
+      anchors[landmark]               anchor of a landmark on the table
+      lrc[landmark][type]             left/right/center relation
+      fbc[landmark][type]             front/back/center relation
+      cd[landmark][type]              close/distant relation
+    """
+    def __init__(self, qsr_model=None):
+        if qsr_model is None:
+            return
+        self.types = qsr_model['types']
+        self.landmarks = qsr_model['landmarks']
+
+        self.presence = dict()
+        for t in self.types:
+            counts = qsr_model['presence'][t]
+            self.presence[t] = AliasSampler(range(len(counts)), counts)
+
+        self.anchors = dict()
+        for t in self.landmarks:
+            counts = qsr_model['anchors'][t]
+            self.anchors[t] = AliasSampler(ANCHOR_NAMES[:len(counts)], counts)
+
+        self.lrc = dict()
+        self.fbc = dict()
+        self.cd = dict()
+        for t1 in self.landmarks:
+            self.lrc[t1] = dict()
+            self.fbc[t1] = dict()
+            self.cd[t1] = dict()
+            for t2 in self.types:
+                qsr_val = qsr_model['qsr'][t1][t2]
+
+                lr_center = max((qsr_val[4] + qsr_val[5]) - (qsr_val[0] + qsr_val[1]),0)
+                self.lrc[t1][t2] = AliasSampler(['left','right','center'],
+                                                [qsr_val[0], qsr_val[1], lr_center])
+
+                fb_center = max((qsr_val[4] + qsr_val[5]) - (qsr_val[2] + qsr_val[3]),0)
+                self.fbc[t1][t2] = AliasSampler(['front','back','center'],
+                                                [qsr_val[2], qsr_val[3], fb_center])
+
+                self.cd[t1][t2] = AliasSampler(['close','distant'],
+                                               [qsr_val[4], qsr_val[5]])
+
+    def to_json(self):
+        def samplers(d):
+            return dict((k, v.to_json()) for k, v in d.items())
+        return {'version':   VERSION,
+                'types':     self.types,
+                'landmarks': self.landmarks,
+                'presence':  samplers(self.presence),
+                'anchors':   samplers(self.anchors),
+                'lrc': dict((t, samplers(self.lrc[t])) for t in self.lrc),
+                'fbc': dict((t, samplers(self.fbc[t])) for t in self.fbc),
+                'cd':  dict((t, samplers(self.cd[t])) for t in self.cd)}
+
+    @classmethod
+    def from_json(cls, data):
+        def samplers(d):
+            return dict((k, AliasSampler.from_json(v)) for k, v in d.items())
+        model = cls()
+        model.types = data['types']
+        model.landmarks = data['landmarks']
+        model.presence = samplers(data['presence'])
+        model.anchors = samplers(data['anchors'])
+        model.lrc = dict((t, samplers(data['lrc'][t])) for t in data['lrc'])
+        model.fbc = dict((t, samplers(data['fbc'][t])) for t in data['fbc'])
+        model.cd = dict((t, samplers(data['cd'][t])) for t in data['cd'])
+        return model
+
+
+def compiled_filename(filename):
+    """ Returns the name of the cached compiled model of a QSR model file,
+    e.g. model.json -> model.compiled.json
+    """
+    [root, ext] = os.path.splitext(filename)
+    return root + '.compiled' + (ext or '.json')
+
+def load(filename):
+    """ Loads a QSR model file. The compiled form is read from the cache next
+    to the file if it is up to date, otherwise the model is compiled and the
+    cache is (re)written.
+    """
+    stat = os.stat(filename)
+    stamp = [stat.st_mtime, stat.st_size]
+    cache_file = compiled_filename(filename)
+
+    with ignored(IOError, ValueError, KeyError):
+        with open(cache_file) as compiled_file:
+            data = json.load(compiled_file)
+        if data['version'] == VERSION and data['source'] == stamp:
+            return CompiledModel.from_json(data)
+
+    with open(filename) as qsr_file:
+        model = CompiledModel(json.load(qsr_file))
+
+    data = model.to_json()
+    data['source'] = stamp
+    with ignored(IOError):
+        tmp_file = '%s.%i.tmp' % (cache_file, os.getpid())
+        with open(tmp_file, 'w') as compiled_file:
+            json.dump(data, compiled_file)
+        os.replace(tmp_file, cache_file)
+    return model
@@ -0,0 +1,149 @@
+"""
+Convergence of generated scenes towards a QSR model. The relations between
+landmarks and objects (left/right/center, front/back/center and
+close/distant) in the QSR labels of the generated scenes and the number of
+objects per type are counted and compared with the distributions of the
+compiled model.
+"""
+
+# Families of distributions and the attribute of the compiled model that holds
+# their samplers
+FAMILIES = ['presence', 'lrc', 'fbc', 'cd']
+
+# Number of observations a distribution needs before it is considered
+# sampled sufficiently
+MIN_OBSERVATIONS = 30
+
+
+def total_variation(p, q):
+    """ Returns the total variation distance between two distributions over
+    the same values (0: equal, 1: disjoint).
+    """
+    return 0.5 * sum(abs(a - b) for a, b in zip(p, q))
+
+def relation_values(rel):
+    """ Maps a QSR label, e.g. ['front', 'left', 'close'], to the values of
+    the lrc, fbc and cd distributions.
+    """
+    if 'left' in rel:
+        lrc = 'left'
+    elif 'right' in rel:
+        lrc = 'right'
+    else:
+        lrc = 'center'
+
+    if 'front' in rel:
+        fbc = 'front'
+    elif 'behind' in rel:
+        fbc = 'back'
+    else:
+        fbc = 'center'
+
+    return {'lrc': lrc, 'fbc': fbc, 'cd': rel[-1]}
+
+
+class Convergence():
+    """ Histograms of the generated relations and presence counts.
+    Distributions are identified by (family, type) for presence and by
+    (family, landmark type, object type) for relations.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.counts = dict()
+
+    def sampler(self, key):
+        if key[0] == 'presence':
+            return self.model.presence[key[1]]
+        return getattr(self.model, key[0])[key[1]][key[2]]
+
+    def count(self, key, value):
+        values = self.sampler(key).values
+        if value not in values:
+            return
+        counts = self.counts.setdefault(key, [0] * len(values))
+        counts[values.index(value)] += 1
+
+    def add_scene(self, scn):
+        """ Counts the objects and the QSR labels (scn['qsr']) of a scene.
+        """
+        types = scn['type']
+        for t in self.model.types:
+            self.count(('presence', t),
+                       len([o for o in scn['objects'] if types[o] == t]))
+
+        for o1 in scn['objects']:
+            if types[o1] not in self.model.landmarks:
+                continue
+            for o2, rel in scn['qsr'][o1].items():
+                if types[o2] not in self.model.types:
+                    continue
+                values = relation_values(rel)
+                for family in ['lrc', 'fbc', 'cd']:
+                    self.count((family, types[o1], types[o2]), values[family])
+
+    def keys(self):
+        """ Returns the keys of all distributions of the model that have data.
+        """
+        keys = [('presence', t) for t in self.model.types]
+        for family in ['lrc', 'fbc', 'cd']:
+            samplers = getattr(self.model, family)
+            for t1 in samplers:
+                for t2 in samplers[t1]:
+                    keys.append((family, t1, t2))
+        return [k for k in keys if self.sampler(k).probs]
+
+    def distances(self):
+        """ Returns key -> [total variation distance, observations] for all
+        distributions of the model with data. The distance is None for
+        distributions that have not been observed yet.
+        """
+        result = dict()
+        for key in self.keys():
+            counts = self.counts.get(key, [])
+            n = sum(counts)
+            if n == 0:
+                result[key] = [None, 0]
+            else:
+                result[key] = [total_variation([c / n for c in counts],
+                                               self.sampler(key).probs), n]
+        return result
+
+    def divergence(self):
+        """ Returns family -> [distance, observations], the mean distance of
+        the distributions of every family weighted by their observations.
+        """
+        result = dict((f, [0.0, 0]) for f in FAMILIES)
+        for key, [distance, n] in self.distances().items():
+            if n > 0:
+                result[key[0]][0] += distance * n
+                result[key[0]][1] += n
+        for f in FAMILIES:
+            if result[f][1] > 0:
+                result[f][0] = result[f][0] / result[f][1]
+        return result
+
+    def converged(self, threshold):
+        """ Tests whether the divergence of every family is below threshold.
+        """
+        for f, [distance, n] in self.divergence().items():
+            if n < MIN_OBSERVATIONS or distance >= threshold:
+                return False
+        return True
+
+    def report(self, threshold):
+        """ Returns the divergence per family and the distributions that are
+        under-sampled (fewer than MIN_OBSERVATIONS) or diverge by more than
+        threshold, the least observed first.
+        """
+        lacking = list()
+        for key, [distance, n] in self.distances().items():
+            if n < MIN_OBSERVATIONS or distance >= threshold:
+                lacking.append({'distribution': ' '.join(key),
+                                'observations': n,
+                                'distance': distance if distance is None
+                                else round(distance, 3)})
+        lacking.sort(key=lambda d: d['observations'])
+        return {'converged': self.converged(threshold),
+                'divergence': dict((f, round(d, 3)) for f, [d, n]
+                                   in self.divergence().items()),
+                'under_sampled': lacking}
@@ -0,0 +1,68 @@
+"""
+Index of the QSR signatures of generated scenes for rejecting scenes whose
+qualitative layout (nearly) repeats an earlier scene.
+"""
+
+def qsr_signature(scn):
+    """ Returns the signature of a labeled scene: the sorted set of
+    (type1, type2, relation) triples of its QSR labels, e.g.
+    ('Monitor', 'Keyboard', 'front_close').
+    """
+    triples = set()
+    for o1 in scn['qsr']:
+        for o2, rel in scn['qsr'][o1].items():
+            triples.add((scn['type'][o1], scn['type'][o2], '_'.join(rel)))
+    return tuple(sorted(triples))
+
+
+class SignatureIndex():
+    """ Inverted index from triples to the signatures that contain them.
+    The similarity of two signatures is their Jaccard index; a signature is
+    distinct if its similarity to every indexed signature is below
+    1 - diversity, i.e. with diversity 0 only exact duplicates are rejected.
+    """
+    def __init__(self, diversity=0.0):
+        self.diversity = diversity
+        self.signatures = list()
+        self.postings = dict()
+        self.rejected = 0
+
+    def similarity(self, signature):
+        """ Returns the highest similarity of signature to an indexed one.
+        """
+        overlap = dict()
+        for t in signature:
+            for i in self.postings.get(t, ()):
+                overlap[i] = overlap.get(i, 0) + 1
+
+        best = 0.0
+        if not signature and () in self.postings:
+            best = 1.0
+        for i, n in overlap.items():
+            union = len(signature) + len(self.signatures[i]) - n
+            best = max(best, float(n) / union)
+        return best
+
+    def add(self, signature):
+        i = len(self.signatures)
+        self.signatures.append(signature)
+        for t in signature:
+            self.postings.setdefault(t, list()).append(i)
+        if not signature:
+            # scenes without relations all share the empty signature
+            self.postings.setdefault((), list()).append(i)
+
+    def add_if_distinct(self, signature):
+        """ Adds signature to the index if it is distinct. Returns False
+        (and counts the rejection) otherwise.
+        """
+        if self.similarity(signature) >= 1.0 - self.diversity:
+            self.rejected = self.rejected + 1
+            return False
+        self.add(signature)
+        return True
+
+    def report(self):
+        return {'diversity': self.diversity,
+                'distinct_scenes': len(self.signatures),
+                'rejected_scenes': self.rejected}
@@ -0,0 +1,113 @@
+"""
+Vectorized geometry for poses of objects: quaternions (w, x, y, z), frame
+transforms and bounding boxes. The functions take single values or arrays
+of them in the leading dimensions, e.g. N quaternions (N x 4) and N points
+(N x 3), so transforming many objects is one call.
+"""
+import math
+import numpy
+
+# epsilon for testing whether a number is close to zero
+_EPS = numpy.finfo(float).eps * 4.0
+
+def quaternion_about_axis(angle, axis):
+    """Return quaternion for rotation about axis. angle may be an array of
+    N angles (and axis N x 3), the result is then N x 4.
+
+    >>> q = quaternion_about_axis(0.123, [1, 0, 0])
+    >>> numpy.allclose(quaternion_about_axis([0.123, 1.0], [0, 0, 1])[1], [math.cos(0.5), 0, 0, math.sin(0.5)])
+    True
+    """
+    angle = numpy.asarray(angle, dtype=numpy.float64)
+    axis = numpy.asarray(axis, dtype=numpy.float64)
+    shape = numpy.broadcast_shapes(angle.shape, axis.shape[:-1])
+    q = numpy.zeros(shape + (4,))
+    q[...,1:] = axis
+    qlen = numpy.sqrt(numpy.sum(q[...,1:] * q[...,1:], axis=-1))
+    scale = numpy.where(qlen > _EPS, numpy.sin(angle/2.0) /
+                        numpy.where(qlen > _EPS, qlen, 1.0), 1.0)
+    q[...,1:] *= numpy.reshape(scale, shape + (1,))
+    q[...,0] = numpy.cos(angle/2.0)
+    # no negative zeros for the axes that are not rotated about
+    return q + 0.0
+
+def quaternion_multiply(q1, q2):
+    """Return the product q1 * q2 of quaternions (or arrays of them).
+
+    >>> numpy.allclose(quaternion_multiply([4, 1, -2, 3], [8, -5, 6, 7]), [28, -44, -14, 48])
+    True
+    """
+    w1, x1, y1, z1 = numpy.moveaxis(numpy.asarray(q1, dtype=numpy.float64), -1, 0)
+    w2, x2, y2, z2 = numpy.moveaxis(numpy.asarray(q2, dtype=numpy.float64), -1, 0)
+    return numpy.stack([w1*w2 - x1*x2 - y1*y2 - z1*z2,
+                        w1*x2 + x1*w2 + y1*z2 - z1*y2,
+                        w1*y2 - x1*z2 + y1*w2 + z1*x2,
+                        w1*z2 + x1*y2 - y1*x2 + z1*w2], axis=-1)
+
+def quaternion_conjugate(q):
+    """Return the conjugate of quaternion q, the inverse of a unit quaternion.
+
+    >>> numpy.allclose(quaternion_conjugate([4, 1, -2, 3]), [4, -1, 2, -3])
+    True
+    """
+    return numpy.asarray(q, dtype=numpy.float64) * [1.0, -1.0, -1.0, -1.0]
+
+def quaternion_rotate(q, v):
+    """Return vectors v rotated by the unit quaternions q = [w, x, y, z].
+
+    >>> numpy.allclose(quaternion_rotate([math.cos(math.pi/4), 0, 0, math.sin(math.pi/4)], [1, 0, 0]), [0, 1, 0])
+    True
+    """
+    w, x, y, z = numpy.moveaxis(numpy.asarray(q, dtype=numpy.float64), -1, 0)
+    v0, v1, v2 = numpy.moveaxis(numpy.asarray(v, dtype=numpy.float64), -1, 0)
+    # t = 2 * (q_xyz x v)
+    tx = 2.0 * (y * v2 - z * v1)
+    ty = 2.0 * (z * v0 - x * v2)
+    tz = 2.0 * (x * v1 - y * v0)
+    return numpy.stack([v0 + w * tx + (y * tz - z * ty),
+                        v1 + w * ty + (z * tx - x * tz),
+                        v2 + w * tz + (x * ty - y * tx)], axis=-1)
+
+def quaternion_to_matrix(q):
+    """Return the 3x3 rotation matrix of the unit quaternion q = [w, x, y, z]
+    (N x 3 x 3 for N quaternions).
+    """
+    w, x, y, z = numpy.moveaxis(numpy.asarray(q, dtype=numpy.float64), -1, 0)
+    return numpy.stack([numpy.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)], axis=-1),
+                        numpy.stack([2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=-1),
+                        numpy.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)], axis=-1)],
+                       axis=-2)
+
+def transform_points(position, orientation, points):
+    """Returns the global coordinates of points given in the frame of an
+    object at position with orientation. Takes one pose and N x 3 points,
+    N poses and N points, or N poses and N x M x 3 points (e.g. the
+    corners of N bounding boxes).
+    """
+    position = numpy.asarray(position, dtype=numpy.float64)
+    orientation = numpy.asarray(orientation, dtype=numpy.float64)
+    points = numpy.asarray(points, dtype=numpy.float64)
+    if 1 < position.ndim < points.ndim:
+        position = position[...,None,:]
+        orientation = orientation[...,None,:]
+    return position + quaternion_rotate(orientation, points)
+
+def transform_to_obj_frame(pose, point):
+    """Local equivalent of the 'transform_to_obj_frame' service. Returns the
+    global coordinates of a point given in the frame of an object with the
+    given pose ([position, orientation]).
+    """
+    return transform_points(pose[0], pose[1], point).tolist()
+
+def calc_global_bbox(pose, local_bbox):
+    """Local equivalent of the 'get_object_global_bbox' service. Returns the
+    eight corners of the local bounding box transformed by the given pose.
+    """
+    return transform_points(pose[0], pose[1], local_bbox).tolist()
+
+def bbox_from_corners(corners):
+    """Returns the minimal and maximal coordinates (x, y, z) of the corners
+    of bounding boxes (8 x 3, or N x 8 x 3 for N boxes).
+    """
+    corners = numpy.asarray(corners, dtype=numpy.float64)
+    return [corners.min(axis=-2), corners.max(axis=-2)]
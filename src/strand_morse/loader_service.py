@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Long-running scene loader. Preloads scene data sets, keeps the connection
+to the simulator open and loads, switches and clears scenes on request, so
+an evaluation can cycle through many scenes without starting a process per
+scene.
+
+Requests and responses are JSON objects, one per line, over a local TCP
+socket:
+
+  {"cmd": "load", "dataset": "eval", "scene": 12, "target": "table.001"}
+  {"cmd": "clear", "target": "table.001"}
+  {"cmd": "status"}
+
+A scene is given by its position in the data set or by its id ("scene13").
+Loading a scene onto a target that holds a scene already switches between
+them (see scene_loader.py switch). Responses are {"ok": true, ...} or
+{"ok": false, "error": "..."}.
+"""
+import os
+import sys
+import json
+import socket
+import collections
+import getopt
+import socketserver
+
+import scene_loader
+from simulation import Connection
+from scene_archive import open_scenes
+
+# Default port of the service
+PORT = 4100
+
+# Number of scenes that are kept decoded in memory
+SCENE_CACHE_SIZE = 1000
+
+
+class LoaderService():
+    """ The data sets and the scenes that are loaded on the targets. The data
+    sets (name -> scenes file, archive or store) are opened once and kept
+    open; the scenes read from them are cached.
+    """
+    def __init__(self, datasets, connection):
+        self.datasets = dict((name, open_scenes(filename))
+                             for name, filename in datasets.items())
+        self.connection = connection
+        # (target, offset) -> [dataset, scene key, scene]
+        self.loaded = dict()
+        self.ids = dict()
+        # (dataset, scene key) -> scene, least recently used first
+        self.scenes = collections.OrderedDict()
+
+    def get_scene(self, dataset, key):
+        if (dataset, key) in self.scenes:
+            self.scenes.move_to_end((dataset, key))
+            return self.scenes[(dataset, key)]
+        scenes = self.datasets[dataset]
+        index = key
+        if isinstance(key, str) and isinstance(scenes, list):
+            # scenes files are plain lists
+            if dataset not in self.ids:
+                self.ids[dataset] = dict((s[0], i) for i, s in enumerate(scenes))
+            index = self.ids[dataset][key]
+        scn = scenes[index][1]
+        self.scenes[(dataset, key)] = scn
+        if len(self.scenes) > SCENE_CACHE_SIZE:
+            self.scenes.popitem(last=False)
+        return scn
+
+    def load(self, dataset, scene, target, offset=0):
+        scn = self.get_scene(dataset, scene)
+        current = self.loaded.get((target, offset))
+        if current is not None and current[0] is None:
+            # a request failed half way: park all objects it may have moved
+            scene_loader.delete_scene(current[2], offset)
+            del self.loaded[(target, offset)]
+            current = None
+
+        objs = list(scn['objects'])
+        if current is not None:
+            objs += [o for o in current[2]['objects'] if o not in objs]
+        # until the request succeeds, it is unknown which of them moved
+        self.loaded[(target, offset)] = [None, None, {'objects': objs}]
+        if current is None:
+            scene_loader.load_scene(scn, target, offset)
+            moved = len(scn['objects'])
+        else:
+            moved = scene_loader.switch_scene(current[2], scn, target, offset)
+        self.loaded[(target, offset)] = [dataset, scene, scn]
+        return {'moved': moved, 'objects': scn['objects']}
+
+    def clear(self, target, offset=0):
+        current = self.loaded.get((target, offset))
+        if current is None:
+            return {'moved': 0}
+        scene_loader.delete_scene(current[2], offset)
+        del self.loaded[(target, offset)]
+        cmd = 'rosparam delete /qsr_landmark/id%i/pose' % (offset + 1)
+        print('Run:', cmd)
+        os.system(cmd)
+        return {'moved': len(current[2]['objects'])}
+
+    def close(self):
+        for scenes in self.datasets.values():
+            if hasattr(scenes, 'close'):
+                scenes.close()
+
+    def status(self):
+        return {'datasets': dict((d, len(s)) for d, s in self.datasets.items()),
+                'loaded': [{'target': t, 'offset': o, 'dataset': d, 'scene': s}
+                           for (t, o), [d, s, scn] in self.loaded.items()]}
+
+    def handle(self, request):
+        """ Executes a request, returns the response.
+        """
+        if not isinstance(request, dict):
+            return {'ok': False, 'error': 'invalid request: not an object'}
+        try:
+            cmd = request.get('cmd')
+            offset = int(request.get('offset', 0))
+            if cmd == 'load' or cmd == 'switch':
+                result = self.load(request['dataset'], request['scene'],
+                                   request['target'], offset)
+            elif cmd == 'clear':
+                result = self.clear(request['target'], offset)
+            elif cmd == 'status':
+                result = self.status()
+            else:
+                raise ValueError('unknown command: %s' % cmd)
+        except (KeyError, IndexError, ValueError, TypeError, IOError) as err:
+            if isinstance(err, IOError):
+                # the connection is reestablished with the next request
+                self.connection.reset()
+            return {'ok': False, 'error': '%s: %s' % (type(err).__name__, err)}
+        result['ok'] = True
+        return result
+
+
+class LoaderServer(socketserver.TCPServer):
+    allow_reuse_address = True
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line.decode())
+            except ValueError as err:
+                response = {'ok': False, 'error': 'invalid request: %s' % err}
+            else:
+                response = self.server.service.handle(request)
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+
+class LoaderClient():
+    """ Client of the service, e.g. LoaderClient().load('eval', 12, 'table').
+    """
+    def __init__(self, host='localhost', port=PORT):
+        self.sock = socket.create_connection((host, port))
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, **request):
+        self.file.write((json.dumps(request) + '\n').encode())
+        self.file.flush()
+        response = json.loads(self.file.readline().decode())
+        if not response.pop('ok'):
+            raise RuntimeError(response['error'])
+        return response
+
+    def load(self, dataset, scene, target, offset=0):
+        return self.request(cmd='load', dataset=dataset, scene=scene,
+                            target=target, offset=offset)
+
+    def clear(self, target, offset=0):
+        return self.request(cmd='clear', target=target, offset=offset)
+
+    def status(self):
+        return self.request(cmd='status')
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def help_msg():
+    return """
+  Usage: loader_service.py [-h] [--port=<port>] [--morse=<host>:<port>] <name>=<scenes_file> ...
+
+    name=scenes_file   data set (file, archive or store) that is preloaded
+                       under the given name
+
+    --port=<port>      port of the service on localhost (default: %i)
+    --morse=<host>:<port>
+                       address of the simulator (default: localhost:4000)
+
+    -h, --help for seeing this msg
+""" % PORT
+
+if __name__ == "__main__":
+    argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "h", ["help", "port=",
+                                                       "morse="])
+        except getopt.error as msg:
+            raise Usage(msg)
+
+        if ('-h','') in opts or ('--help', '') in opts or len(args) == 0:
+            raise Usage(help_msg())
+
+        datasets = dict()
+        for spec in args:
+            if '=' not in spec:
+                raise Usage(help_msg())
+            [name, filename] = spec.split('=', 1)
+            datasets[name] = filename
+
+        [host, port] = dict(opts).get('--morse', 'localhost:4000').split(':')
+        with Connection(host, int(port)) as connection:
+            scene_loader.morse = connection
+            server = LoaderServer(
+                ('localhost', int(dict(opts).get('--port', PORT))),
+                RequestHandler)
+            server.service = LoaderService(datasets, connection)
+            for name, scenes in server.service.datasets.items():
+                print('Loaded', len(scenes), 'scene(s) of', name)
+            print('Serving on port', server.server_address[1])
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                server.server_close()
+                server.service.close()
+
+    except Usage as err:
+        print(err.msg)
+        print("for help use --help")
@@ -1,8 +1,17 @@
 import sys
 import math
+import bisect
+import numpy
 
+# Number of partitions of the relative angle. The functions below take the
+# number as an argument; if it is not given, this value is used at the time
+# of the call.
 NUMBER_OF_PARTITIONS = 8
-PARTITION_SIZE = (2.0 * math.pi) / NUMBER_OF_PARTITIONS  
+
+# Names of the partitions for NUMBER_OF_PARTITIONS = 8, starting at the
+# relative angle 0 and going counterclockwise
+PARTITION_NAMES = [['behind'], ['behind','left'], ['left'], ['front','left'],
+                   ['front'], ['front','right'], ['right'], ['behind','right']]
 
 def relative_radius(a, b, c):
     # compute relative radius r (close/distant)
@@ -34,61 +43,101 @@ def relative_angle(a, b, c):
 def normal_dist(x, mean, var):
     return (1.0 / math.sqrt( var * 2.0* math.pi)) * math.exp(-0.5 *(math.pow(x - mean,2)/var));
   
-def mean(partition):
-    return partition * PARTITION_SIZE
+def number_of_partitions(partitions=None):
+    if partitions is None:
+        return NUMBER_OF_PARTITIONS
+    return partitions
+
+def partition_size(partitions=None):
+    return (2.0 * math.pi) / number_of_partitions(partitions)
+
+def mean(partition, partitions=None):
+    return partition * partition_size(partitions)
   
-def var(partition):
-    return PARTITION_SIZE / 2
+def var(partition, partitions=None):
+    return partition_size(partitions) / 2
   
-def partition_value(p, angle):
-    
+def partition_value(p, angle, partitions=None):
+    partitions = number_of_partitions(partitions)
+
     val = sys.float_info.min
     val_cycle = sys.float_info.min
     
-    val = normal_dist(angle, mean(p), var(p))
+    val = normal_dist(angle, mean(p, partitions), var(p, partitions))
     
     # NOTE: handling cycle [0,2*M_PI] 
     if (p == 0): # first partition
         
-        val_cycle = normal_dist(angle, mean(NUMBER_OF_PARTITIONS), var(NUMBER_OF_PARTITIONS))
+        val_cycle = normal_dist(angle, mean(partitions, partitions), var(partitions, partitions))
    
-    elif (p == (NUMBER_OF_PARTITIONS - 1)): # last partition
-        val_cycle = normal_dist(angle, mean(-1), var(-1));
+    elif (p == (partitions - 1)): # last partition
+        val_cycle = normal_dist(angle, mean(-1, partitions), var(-1, partitions));
       
 
     if (val_cycle > val):
         return val_cycle
     return val
 
-def argmax_partition(angle):
-    
+def argmax_partition_exact(angle, partitions=None):
+    """ Returns the partition whose Gaussian has the highest density at
+    angle by evaluating all of them.
+    """
+    partitions = number_of_partitions(partitions)
     argmax = -1
     max_val = sys.float_info.min
     
-    for i in range(0,NUMBER_OF_PARTITIONS):
-        val = partition_value(i, angle)
+    for i in range(0,partitions):
+        val = partition_value(i, angle, partitions)
         if val > max_val:
             max_val = val;
             argmax = i;
     return argmax;
 
-def partition_name(p):
-    if p == 0:
-        return ['behind']
-    elif p == 1:
-        return ['behind','left']
-    elif p == 2:
-        return ['left']
-    elif p == 3:
-        return ['front','left']
-    elif p == 4:
-        return ['front']
-    elif p == 5:
-        return ['front','right']
-    elif p == 6:
-        return ['right']
-    else: # p ==7
-        return ['behind','right']
+# The Gaussians of the partitions have equal variances, so the one with the
+# highest density at an angle is the one with the closest mean, and the
+# partitions are bins between the midpoints of neighbouring means. Angles
+# closer than BIN_MARGIN to a midpoint, where the rounding of the densities
+# decides, are classified by evaluating the densities as before.
+BIN_MARGIN = 1e-9
+
+_bins = dict()
+
+def partition_bins(partitions=None):
+    """ Returns the midpoints between the means of neighbouring partitions
+    in [0, 2*pi]; the last one separates the last partition from the
+    first one (mean 2*pi).
+    """
+    partitions = number_of_partitions(partitions)
+    if partitions not in _bins:
+        _bins[partitions] = [(p + 0.5) * partition_size(partitions)
+                             for p in range(partitions)]
+    return _bins[partitions]
+
+def argmax_partition(angle, partitions=None):
+    """ Returns the partition of an angle in [0, 2*pi] by a lookup in
+    partition_bins(). The result is that of argmax_partition_exact.
+    """
+    partitions = number_of_partitions(partitions)
+    bins = partition_bins(partitions)
+    if not 0.0 <= angle <= 2 * math.pi:
+        return argmax_partition_exact(angle, partitions)
+    k = bisect.bisect_left(bins, angle)
+    if (k > 0 and angle - bins[k - 1] < BIN_MARGIN) or \
+       (k < partitions and bins[k] - angle < BIN_MARGIN):
+        return argmax_partition_exact(angle, partitions)
+    return k % partitions
+
+def partition_name(p, partitions=None):
+    """ Returns the names of partition p, e.g. ['front','left']. Only the
+    partitions whose means are one of the eight directions of
+    PARTITION_NAMES have names, i.e. all for 1, 2, 4 or 8 partitions;
+    for the others a ValueError is raised.
+    """
+    partitions = number_of_partitions(partitions)
+    [direction, rest] = divmod(p * len(PARTITION_NAMES), partitions)
+    if rest != 0:
+        raise ValueError('partition %i of %i has no name' % (p, partitions))
+    return list(PARTITION_NAMES[direction % len(PARTITION_NAMES)])
 
 def distance(dist):
     if 0.0 <= dist and dist < 0.3:
@@ -96,15 +145,15 @@ def distance(dist):
     return 'distant'
   
 
-def calc_QSR(camera, landmark, obj):
+def calc_QSR(camera, landmark, obj, partitions=None):
 
     reld = relative_radius(camera,landmark,obj)
     rela = relative_angle(camera,landmark,obj)
 
     #print(reld,rela)
 
-    part = argmax_partition(rela)
-    part_qsr = partition_name(part)
+    part = argmax_partition(rela, partitions)
+    part_qsr = partition_name(part, partitions)
 
     dist_qsr = distance(reld)
 
@@ -115,3 +164,92 @@ def calc_QSR(camera, landmark, obj):
     
     return qsr_lst
 
+
+
+# Batch versions of the functions above. Positions are given as arrays
+# (N x 3, or a single position that is used for all N triples).
+
+def relative_radius_batch(a, b, c):
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    c = numpy.asarray(c, dtype=numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.sqrt(((c - b)**2).sum(axis=-1)) / \
+            numpy.sqrt(((b - a)**2).sum(axis=-1))
+
+def relative_angle_batch(a, b, c):
+    a = numpy.asarray(a, dtype=numpy.float64)
+    b = numpy.asarray(b, dtype=numpy.float64)
+    c = numpy.asarray(c, dtype=numpy.float64)
+
+    angle_BA = numpy.arctan2(b[...,1] - a[...,1], b[...,0] - a[...,0])
+    angle_BA = numpy.where(angle_BA < 0, angle_BA + 2 * math.pi, angle_BA)
+
+    angle_CB = numpy.arctan2(c[...,1] - b[...,1], c[...,0] - b[...,0])
+    angle_CB = numpy.where(angle_CB < 0, angle_CB + 2 * math.pi, angle_CB)
+
+    angle_rel = angle_CB - angle_BA
+    return numpy.where(angle_rel < 0, angle_rel + 2 * math.pi, angle_rel)
+
+def normal_dist_batch(x, mean, var):
+    return (1.0 / math.sqrt( var * 2.0* math.pi)) * numpy.exp(-0.5 *((x - mean)**2/var))
+
+def argmax_partition_exact_batch(angles, partitions=None):
+    partitions = number_of_partitions(partitions)
+    angles = numpy.asarray(angles, dtype=numpy.float64)[...,None]
+    means = numpy.array([mean(p, partitions) for p in range(partitions)])
+    vals = normal_dist_batch(angles, means, var(0, partitions))
+
+    # NOTE: handling cycle [0,2*M_PI]
+    vals[...,0] = numpy.maximum(vals[...,0],
+                                normal_dist_batch(angles[...,0], mean(partitions, partitions), var(0, partitions)))
+    vals[...,-1] = numpy.maximum(vals[...,-1],
+                                 normal_dist_batch(angles[...,0], mean(-1, partitions), var(0, partitions)))
+
+    # as in argmax_partition_exact, -1 where no density is above the smallest
+    # float, e.g. for NaN
+    with numpy.errstate(invalid='ignore'):
+        found = numpy.max(vals, axis=-1) > sys.float_info.min
+    return numpy.where(found, numpy.argmax(vals, axis=-1), -1)
+
+def argmax_partition_batch(angles, partitions=None):
+    """ Batch version of argmax_partition, the result is that of
+    argmax_partition_exact_batch.
+    """
+    partitions = number_of_partitions(partitions)
+    angles = numpy.asarray(angles, dtype=numpy.float64)
+    bins = numpy.array(partition_bins(partitions))
+    k = numpy.searchsorted(bins, angles)
+    lower = bins[numpy.maximum(k - 1, 0)]
+    upper = bins[numpy.minimum(k, partitions - 1)]
+    with numpy.errstate(invalid='ignore'):
+        exact = ~((angles >= 0.0) & (angles <= 2 * math.pi)) | \
+            ((k > 0) & (angles - lower < BIN_MARGIN)) | \
+            ((k < partitions) & (upper - angles < BIN_MARGIN))
+    part = k % partitions
+    if exact.any():
+        part[exact] = argmax_partition_exact_batch(angles[exact], partitions)
+    return part
+
+def calc_QSR_batch(camera, landmark, obj, partitions=None):
+    """ Calculates the QSRs of many (camera, landmark, object) triples at
+    once. Returns an array of partitions (see partition_name) and a boolean
+    array that is True where the object is close to the landmark.
+    """
+    reld = relative_radius_batch(camera, landmark, obj)
+    rela = relative_angle_batch(camera, landmark, obj)
+
+    part = argmax_partition_batch(rela, partitions)
+    close = (0.0 <= reld) & (reld < 0.3)
+
+    return [part, close]
+
+def qsr_list(part, close, partitions=None):
+    """ Returns the QSR list of calc_QSR for a partition and distance label.
+    """
+    qsr_lst = partition_name(int(part), partitions)
+    if close:
+        qsr_lst.append('close')
+    else:
+        qsr_lst.append('distant')
+    return qsr_lst
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Streaming QSR labels for a running simulation. The node follows the poses of
+the objects (the /semcam output of the semantic camera and the topics of Pose
+sensors) and of the camera, and recomputes only the relations of the
+objects that moved. Changes are published as JSON events at sensor rate:
+
+  [{"landmark": "monitor", "object": "cup",
+    "qsr": ["front", "left", "close"], "previous": ["front", "distant"]}, ...]
+
+"qsr" is null if a relation disappeared and "previous" is null if it is new.
+
+Positions are in the world frame: the semantic camera must not report
+positions relative to itself (its 'relative' property is off by default)
+and the camera position is taken from a Pose sensor on the camera.
+
+ROS parameters:
+  ~semcam     topic of the semantic camera (default: /semcam)
+  ~camera     topic of the Pose sensor of the camera (required)
+  ~poses      list of "<object>=<topic>" of objects with Pose sensors
+  ~out        topic of the events (default: /qsr/changes)
+  ~tolerance  distance an object (or the camera) has to move before its
+              relations are recomputed (default: 0.01)
+"""
+import sys
+import json
+import threading
+import numpy
+
+import qsr
+
+try:
+    import rospy
+    from std_msgs.msg import String
+    from geometry_msgs.msg import PoseStamped
+except ImportError:
+    rospy = None
+
+# Distance an object or the camera has to move before its relations are
+# recomputed
+MOVE_TOLERANCE = 0.01
+
+class QSRStream():
+    """ QSR labels between all pairs of tracked objects, as in
+    scene_generator.label_scene(). The labels are updated incrementally:
+    only pairs that involve a moved object are recomputed, all pairs if
+    the camera moved. No labels are computed before the camera position is
+    known.
+    """
+    def __init__(self, camera=None, tolerance=MOVE_TOLERANCE):
+        self.camera = camera
+        if camera is not None:
+            self.camera = numpy.asarray(camera, dtype=numpy.float64)
+        self.tolerance = tolerance
+        self.positions = dict()
+        # (landmark, object) -> QSR list
+        self.labels = dict()
+        # object -> labeled pairs that involve it
+        self.pairs = dict()
+
+    def moved(self, old, new):
+        return old is None or \
+            numpy.sum((old - new) ** 2) > self.tolerance * self.tolerance
+
+    def update(self, poses=None, camera=None, removed=()):
+        """ Applies new positions (object -> [x, y, z]), a new camera
+        position and removes objects. Returns the changed relations as
+        events (see above).
+        """
+        changed = set()
+        for o in removed:
+            if self.positions.pop(o, None) is not None:
+                changed.add(o)
+
+        if camera is not None:
+            camera = numpy.asarray(camera, dtype=numpy.float64)
+            if self.moved(self.camera, camera):
+                self.camera = camera
+                changed.update(self.positions)
+
+        for o, pos in (poses or dict()).items():
+            pos = numpy.asarray(pos, dtype=numpy.float64)
+            if self.moved(self.positions.get(o), pos):
+                self.positions[o] = pos
+                changed.add(o)
+
+        if not changed or self.camera is None:
+            return list()
+
+        # pairs of the changed objects with all objects, each pair once
+        pairs = list()
+        for o1 in changed:
+            if o1 not in self.positions:
+                continue
+            for o2 in self.positions:
+                if o2 != o1:
+                    pairs.append((o1, o2))
+                    if o2 not in changed:
+                        pairs.append((o2, o1))
+        labels = dict()
+        if pairs:
+            [part, close] = qsr.calc_QSR_batch(
+                self.camera,
+                numpy.array([self.positions[o1] for o1, o2 in pairs]),
+                numpy.array([self.positions[o2] for o1, o2 in pairs]))
+            for k, pair in enumerate(pairs):
+                labels[pair] = qsr.qsr_list(part[k], close[k])
+
+        # relations of removed objects disappear
+        for o in changed:
+            for pair in self.pairs.get(o, ()):
+                labels.setdefault(pair, None)
+
+        events = list()
+        for pair, label in labels.items():
+            previous = self.labels.get(pair)
+            if label == previous:
+                continue
+            if label is None:
+                del self.labels[pair]
+                for o in pair:
+                    self.pairs[o].discard(pair)
+                    if not self.pairs[o]:
+                        del self.pairs[o]
+            else:
+                self.labels[pair] = label
+                for o in pair:
+                    self.pairs.setdefault(o, set()).add(pair)
+            events.append({'landmark': pair[0], 'object': pair[1],
+                           'qsr': label, 'previous': previous})
+        return events
+
+
+def position(msg):
+    p = msg.pose.position
+    return [p.x, p.y, p.z]
+
+if __name__ == "__main__":
+    if rospy is None:
+        print('Error: qsr_stream.py needs ROS (rospy, std_msgs and '
+              'geometry_msgs)', file=sys.stderr)
+        sys.exit(1)
+    rospy.init_node('qsr_stream')
+    if not rospy.has_param('~camera'):
+        rospy.logfatal('~camera (topic of the Pose sensor of the camera) '
+                       'is required')
+        sys.exit(1)
+    stream = QSRStream(tolerance=rospy.get_param('~tolerance', MOVE_TOLERANCE))
+    pub = rospy.Publisher(rospy.get_param('~out', '/qsr/changes'), String,
+                          queue_size=10)
+    # callbacks of different topics run in different threads
+    lock = threading.Lock()
+    seen = set()
+
+    def update(**kwargs):
+        with lock:
+            events = stream.update(**kwargs)
+        if events:
+            pub.publish(String(json.dumps(events)))
+
+    def on_semcam(msg):
+        objs = json.loads(msg.data)
+        names = set(o['name'] for o in objs)
+        # objects that left the field of view
+        removed = seen - names
+        seen.clear()
+        seen.update(names)
+        update(poses=dict((o['name'], o['position']) for o in objs),
+               removed=removed)
+
+    def on_pose(name):
+        return lambda msg: update(poses={name: position(msg)})
+
+    rospy.Subscriber(rospy.get_param('~semcam', '/semcam'), String, on_semcam)
+    rospy.Subscriber(rospy.get_param('~camera'), PoseStamped,
+                     lambda msg: update(camera=position(msg)))
+    for spec in rospy.get_param('~poses', []):
+        [name, topic] = spec.split('=')
+        rospy.Subscriber(topic, PoseStamped, on_pose(name))
+
+    rospy.spin()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Sharded scene archive with random access by scene id.
+
+An archive is a directory of JSON-lines shards, one ["sceneN", {...}] scene
+per line as written by scene_generator.py --batch, and a small index that
+maps every scene id to its shard, byte offset and length:
+
+  scenes.archive/index.json
+  scenes.archive/shard-00000.jsonl
+  scenes.archive/shard-00001.jsonl
+  ...
+
+A single scene is read with one seek without parsing the rest of the data
+set. The script converts scenes files (a JSON list of scenes or JSON lines)
+into archives.
+"""
+import os
+import sys
+import json
+import getopt
+import operator
+
+from scene_store import SceneStore, is_store
+
+# Version of the archive format, bump when it changes
+VERSION = 1
+
+# Number of scenes per shard
+SHARD_SIZE = 1000
+
+INDEX_FILE = 'index.json'
+
+
+def shard_filename(path, shard):
+    return os.path.join(path, 'shard-%05i.jsonl' % shard)
+
+def is_archive(filename):
+    return os.path.isfile(os.path.join(filename, INDEX_FILE))
+
+
+class ArchiveWriter():
+    """ Writes scenes to a new archive. The index is written by close(), so
+    an archive without index is incomplete.
+    """
+    def __init__(self, path, shard_size=SHARD_SIZE):
+        self.path = path
+        self.shard_size = shard_size
+        self.ids = list()
+        self.offsets = dict()
+        self.shard = None
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, scene):
+        """ Appends a scene ["sceneN", {...}] to the archive.
+        """
+        if scene[0] in self.offsets:
+            raise ValueError('duplicate scene id: ' + scene[0])
+        if len(self.ids) % self.shard_size == 0:
+            if self.shard is not None:
+                self.shard.close()
+            self.shard = open(shard_filename(self.path,
+                                             len(self.ids) // self.shard_size),
+                              'wb')
+        line = (json.dumps(scene) + '\n').encode()
+        self.offsets[scene[0]] = [len(self.ids) // self.shard_size,
+                                  self.shard.tell(), len(line)]
+        self.ids.append(scene[0])
+        self.shard.write(line)
+
+    def close(self):
+        if self.shard is not None:
+            self.shard.close()
+            self.shard = None
+        index = {'version': VERSION,
+                 'shard_size': self.shard_size,
+                 'ids': self.ids,
+                 'offsets': self.offsets}
+        index_file = os.path.join(self.path, INDEX_FILE)
+        tmp_file = '%s.%i.tmp' % (index_file, os.getpid())
+        with open(tmp_file, 'w') as out_file:
+            json.dump(index, out_file)
+        os.replace(tmp_file, index_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SceneArchive():
+    """ Read access to an archive. Scenes are looked up by id,
+    archive['scene42'], or by position like in a list of scenes,
+    archive[41]. Iterating yields the scenes in order.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as index_file:
+            index = json.load(index_file)
+        if index['version'] != VERSION:
+            raise ValueError('unsupported archive version: %s'
+                             % index['version'])
+        self.ids = index['ids']
+        self.offsets = index['offsets']
+        self.shards = dict()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, scene_id):
+        return scene_id in self.offsets
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            i = operator.index(key)
+            if i < 0:
+                i = i + len(self)
+            if not 0 <= i < len(self):
+                raise IndexError('scene index out of range')
+            key = self.ids[i]
+        [shard, offset, length] = self.offsets[key]
+        if shard not in self.shards:
+            self.shards[shard] = open(shard_filename(self.path, shard), 'rb')
+        shard_file = self.shards[shard]
+        shard_file.seek(offset)
+        return json.loads(shard_file.read(length).decode())
+
+    def __iter__(self):
+        for scene_id in self.ids:
+            yield self[scene_id]
+
+    def close(self):
+        for shard_file in self.shards.values():
+            shard_file.close()
+        self.shards = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_scenes(filename):
+    """ Yields the scenes of a scenes file, either a JSON list of scenes or
+    JSON lines (one scene per line).
+    """
+    with open(filename) as scn_file:
+        first = scn_file.readline()
+        try:
+            scene = json.loads(first)
+        except ValueError:
+            # pretty printed JSON list
+            scn_file.seek(0)
+            for scene in json.load(scn_file):
+                yield scene
+            return
+        if scene and isinstance(scene[0], str):
+            yield scene
+            for line in scn_file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            # JSON list in a single line
+            for scene in scene:
+                yield scene
+
+def open_scenes(filename):
+    """ Returns the scenes of an archive, a store or a scenes file as a
+    sequence of ["sceneN", {...}] that can be indexed by position. Only
+    archives and stores are read lazily.
+    """
+    if is_archive(filename):
+        return SceneArchive(filename)
+    if is_store(filename):
+        return SceneStore(filename)
+    return list(read_scenes(filename))
+
+def convert(filename, path, shard_size=SHARD_SIZE):
+    """ Converts a scenes file into an archive. Returns the number of scenes.
+    """
+    with ArchiveWriter(path, shard_size) as writer:
+        for scene in read_scenes(filename):
+            writer.add(scene)
+    return len(writer.ids)
+
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def help_msg():
+    return """
+  Usage: scene_archive.py [-h] [--shard-size=<n>] <scenes_file> <archive>
+
+    scenes_file        scenes to be converted, a JSON list of scenes or
+                       JSON lines (scene_generator.py --batch)
+    archive            directory of the archive to be written
+
+    --shard-size=<n>   number of scenes per shard (default: %i)
+
+    -h, --help for seeing this msg
+""" % SHARD_SIZE
+
+if __name__ == "__main__":
+    argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "h", ["help", "shard-size="])
+        except getopt.error as msg:
+            raise Usage(msg)
+
+        if ('-h','') in opts or ('--help', '') in opts or len(args) != 2:
+            raise Usage(help_msg())
+
+        shard_size = int(dict(opts).get('--shard-size', SHARD_SIZE))
+        n = convert(args[0], args[1], shard_size)
+        print("Done. Archived", n, "scene(s).")
+
+    except Usage as err:
+        print(err.msg)
+        print("for help use --help")
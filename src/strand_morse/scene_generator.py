@@ -3,7 +3,6 @@
 Simple API for placing objects on tables according to directional spatial
 relations.
 """
-import pymorse
 import sys
 import random
 import json
@@ -11,8 +10,20 @@ import math
 import numpy
 import errno 
 import getopt
+import os
+import time
+import statistics
+import queue
+import multiprocessing
 from operator import itemgetter
 import qsr
+import compiled_model
+from geometry import quaternion_about_axis, bbox_from_corners, \
+    quaternion_multiply, quaternion_conjugate, transform_points
+from convergence import Convergence
+from diversity import SignatureIndex, qsr_signature
+from simulation import set_object_poses, Connection, ModelCache, CACHE_FILE, obj_name, \
+    NUM_OF_RECONNECTS
 
 from contextlib import contextmanager
 
@@ -41,65 +52,152 @@ DIRECTION_SIGMA = math.pi/16
 OBJECT_SCALE = 1.00
 
 # Number of samples used to place an object
-# If more samples would be needed for one object the overall scene is discarded 
 MAX_NUM_OF_SAMPLES = 100
 
+# Number of times a direction is redrawn if no distance along it is on the
+# supporting plane
+MAX_NUM_OF_REDRAWS = 10
+
+# Number of times a placed object may be taken back in order to place a
+# later object. If more would be needed the overall scene is discarded
+MAX_NUM_OF_BACKTRACKS = 20
+
+# Number of candidates of a scene that may be rejected (see --diversity).
+# If all of them are, the generation stops
+MAX_NUM_OF_REJECTIONS = 50
+
+# Cell size of the grid used for collision tests, about twice the footprint
+# of a desk object (see benchmark.py collision)
+GRID_CELL_SIZE = 0.3
+
+# Number of placed objects from which the grid is used for testing batches
+# of candidates. Scanning fewer objects is faster; measured with
+# benchmark.py collision, the grid wins from about 270 objects
+GRID_MIN_OBJECTS = 300
+
+# Seconds between two reports in the statistics stream (--stats)
+STATS_INTERVAL = 10.0
+
 # Distance of the camera with respect to the center of the table
 CAMERA_DISTANCE = 2.5 
 
 # epsilon for testing whether a number is close to zero
 _EPS = numpy.finfo(float).eps * 4.0
 
-def vector_norm(data, axis=None, out=None):
-    """Return length, i.e. Euclidean norm, of ndarray along axis.
-
-    >>> v = numpy.random.random(3)
-    >>> n = vector_norm(v)
-    >>> numpy.allclose(n, numpy.linalg.norm(v))
-    True
-    >>> v = numpy.random.rand(6, 5, 3)
-    >>> n = vector_norm(v, axis=-1)
-    >>> numpy.allclose(n, numpy.sqrt(numpy.sum(v*v, axis=2)))
-    True
-    >>> n = vector_norm(v, axis=1)
-    >>> numpy.allclose(n, numpy.sqrt(numpy.sum(v*v, axis=1)))
-    True
-    >>> v = numpy.random.rand(5, 4, 3)
-    >>> n = numpy.empty((5, 3))
-    >>> vector_norm(v, axis=1, out=n)
-    >>> numpy.allclose(n, numpy.sqrt(numpy.sum(v*v, axis=1)))
-    True
-    >>> vector_norm([])
-    0.0
-    >>> vector_norm([1])
-    1.0
-
+# Wichura's algorithm AS 241 for the inverse of the normal CDF, as used by
+# statistics.NormalDist.inv_cdf (coefficients of the highest power first)
+_INV_CDF_CENTRAL = [
+    [2.5090809287301226727e+3, 3.3430575583588128105e+4,
+     6.7265770927008700853e+4, 4.5921953931549871457e+4,
+     1.3731693765509461125e+4, 1.9715909503065514427e+3,
+     1.3314166789178437745e+2, 3.3871328727963666080e+0],
+    [5.2264952788528545610e+3, 2.8729085735721942674e+4,
+     3.9307895800092710610e+4, 2.1213794301586595867e+4,
+     5.3941960214247511077e+3, 6.8718700749205790830e+2,
+     4.2313330701600911252e+1, 1.0]]
+_INV_CDF_NEAR = [
+    [7.74545014278341407640e-4, 2.27238449892691845833e-2,
+     2.41780725177450611770e-1, 1.27045825245236838258e+0,
+     3.64784832476320460504e+0, 5.76949722146069140550e+0,
+     4.63033784615654529590e+0, 1.42343711074968357734e+0],
+    [1.05075007164441684324e-9, 5.47593808499534494600e-4,
+     1.51986665636164571966e-2, 1.48103976427480074590e-1,
+     6.89767334985100004550e-1, 1.67638483018380384940e+0,
+     2.05319162663775882187e+0, 1.0]]
+_INV_CDF_FAR = [
+    [2.01033439929228813265e-7, 2.71155556874348757815e-5,
+     1.24266094738807843860e-3, 2.65321895265761230930e-2,
+     2.96560571828504891230e-1, 1.78482653991729133580e+0,
+     5.46378491116411436990e+0, 6.65790464350110377720e+0],
+    [2.04426310338993978564e-15, 1.42151175831644588870e-7,
+     1.84631831751005468180e-5, 7.86869131145613259100e-4,
+     1.48753612908506148525e-2, 1.36929880922735805310e-1,
+     5.99832206555887937690e-1, 1.0]]
+
+def horner(coefficients, x):
+    """ Evaluates the polynomial with the given coefficients (highest power
+    first) at x (array).
+    """
+    y = coefficients[0] * x + coefficients[1]
+    for c in coefficients[2:]:
+        y *= x
+        y += c
+    return y
+
+def normal_inv_cdf(p):
+    """ Vectorized inverse of the CDF of the standard normal distribution
+    for probabilities p (array) in (0, 1).
     """
-    data = numpy.array(data, dtype=numpy.float64, copy=True)
-    if out is None:
-        if data.ndim == 1:
-            return math.sqrt(numpy.dot(data, data))
-        data *= data
-        out = numpy.atleast_1d(numpy.sum(data, axis=axis))
-        numpy.sqrt(out, out)
-        return out
-    else:
-        data *= data
-        numpy.sum(data, axis=axis, out=out)
-        numpy.sqrt(out, out)
-
-
-def quaternion_about_axis(angle, axis):
-    """Return quaternion for rotation about axis.
-
-    >>> q = quaternion_about_axis(0.123, [1, 0, 0])
+    p = numpy.asarray(p, dtype=numpy.float64)
+    q = p - 0.5
+    r = 0.180625 - q * q
+    x = q * horner(_INV_CDF_CENTRAL[0], r)
+    x /= horner(_INV_CDF_CENTRAL[1], r)
+
+    tail = numpy.flatnonzero(numpy.abs(q) > 0.425)
+    if len(tail) > 0:
+        r = numpy.sqrt(-numpy.log(numpy.minimum(p[tail], 1.0 - p[tail])))
+        t = horner(_INV_CDF_NEAR[0], r - 1.6) / horner(_INV_CDF_NEAR[1], r - 1.6)
+        far = numpy.flatnonzero(r > 5.0)
+        if len(far) > 0:
+            t[far] = horner(_INV_CDF_FAR[0], r[far] - 5.0) / \
+                horner(_INV_CDF_FAR[1], r[far] - 5.0)
+        x[tail] = numpy.copysign(t, q[tail])
+    return x
+
+def truncated_normal(mu, sigma, low, high, n):
+    """ Draws n samples from a normal distribution truncated to the open
+    interval (low, high) by inverting its CDF. Returns an empty array if
+    the interval is empty.
     """
-    q = numpy.array([0.0, axis[0], axis[1], axis[2]])
-    qlen = vector_norm(q)
-    if qlen > _EPS:
-        q *= math.sin(angle/2.0) / qlen
-    q[0] = math.cos(angle/2.0)
-    return q
+    if not low < high:
+        return numpy.zeros(0)
+    dist = statistics.NormalDist(mu, sigma)
+    [p_low, p_high] = [dist.cdf(low), dist.cdf(high)]
+    if p_high - p_low < _EPS:
+        # the interval is far out in a tail
+        return numpy.random.uniform(low, high, n)
+    p = numpy.clip(numpy.random.uniform(p_low, p_high, n), _EPS, 1 - _EPS)
+    return numpy.clip(mu + sigma * normal_inv_cdf(p), low, high)
+
+def ray_range(x, y, phi, bounds):
+    """ Returns the smallest and largest distances (arrays) at which rays
+    from (x, y) in the directions phi (array, 0 along y, pi/2 along x) are
+    within bounds (x_min, x_max, y_min, y_max). The smallest distance is
+    not below the largest one if a ray misses the bounds.
+    """
+    lo = numpy.full(len(phi), -numpy.inf)
+    hi = numpy.full(len(phi), numpy.inf)
+    axes = [(x, numpy.sin(phi), bounds[0], bounds[1]),
+            (y, numpy.cos(phi), bounds[2], bounds[3])]
+    for [origin, direction, b_min, b_max] in axes:
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            t1 = (b_min - origin) / direction
+            t2 = (b_max - origin) / direction
+        inside = b_min < origin < b_max
+        parallel = direction == 0
+        lo = numpy.maximum(lo, numpy.where(parallel,
+                                           -numpy.inf if inside else numpy.inf,
+                                           numpy.minimum(t1, t2)))
+        hi = numpy.minimum(hi, numpy.where(parallel,
+                                           numpy.inf if inside else -numpy.inf,
+                                           numpy.maximum(t1, t2)))
+    return [lo, hi]
+
+def calc_candidate_poses(pose, points, yaws, local_bbox):
+    """ Vectorized transform_to_obj_frame and calc_global_bbox for candidate
+    placements. points (N x 3) are given in the frame of an object with the
+    given pose, yaws (N) are rotations about the z-axis. Returns the
+    positions (N x 3), orientations (N x 4) and global bounding boxes
+    (N x 8 x 3) of the candidates.
+    """
+    positions = transform_points(pose[0], pose[1], points)
+    orientations = quaternion_about_axis(yaws, [0.0, 0.0, 1.0])
+    corners = numpy.broadcast_to(numpy.asarray(local_bbox, dtype=numpy.float64),
+                                 (len(yaws), len(local_bbox), 3))
+    bboxes = transform_points(positions, orientations, corners)
+
+    return [positions, orientations, bboxes]
 
 class BBox():
     """ Bounding box of an object with getter functions.
@@ -139,17 +237,264 @@ class BBox():
         return self.z_max
     
 
+def bbox_bounds(bbox):
+    return (bbox.get_x_min(), bbox.get_x_max(),
+            bbox.get_y_min(), bbox.get_y_max())
+
+def bounds_overlap(bounds, placed):
+    """ Tests the boxes in bounds (N x 4 array of x_min, x_max, y_min, y_max)
+    against all boxes in placed (M x 4). Returns a boolean array (N) that
+    is True for every box that overlaps any placed box.
+    """
+    if len(placed) == 0:
+        return numpy.zeros(len(bounds), dtype=bool)
+    placed = numpy.asarray(placed)
+    return ((bounds[:,None,1] >= placed[None,:,0]) &
+            (bounds[:,None,0] <= placed[None,:,1]) &
+            (bounds[:,None,3] >= placed[None,:,2]) &
+            (bounds[:,None,2] <= placed[None,:,3])).any(axis=1)
+
+class LinearIndex():
+    """ Collision test by scanning all placed bounding boxes.
+    """
+    def __init__(self):
+        self.bounds = dict()
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def insert(self, name, bbox):
+        self.bounds[name] = bbox_bounds(bbox)
+
+    def remove(self, name):
+        del self.bounds[name]
+
+    def collisions(self, bounds):
+        return bounds_overlap(bounds, list(self.bounds.values()))
+
+class GridIndex():
+    """ Uniform grid over the xy-plane for collision tests. Every placed
+    bounding box is registered in all cells it overlaps, so a candidate is
+    only tested against the boxes in its own cells instead of all boxes.
+
+    The registrations are kept as arrays sorted by cell, which are built
+    once min_objects boxes are placed and then updated when a box is
+    inserted or removed. Fewer boxes are scanned, which is faster.
+    """
+    def __init__(self, cell_size=GRID_CELL_SIZE, min_objects=GRID_MIN_OBJECTS):
+        self.cell_size = cell_size
+        self.min_objects = min_objects
+        self.bounds = dict()
+        self.ids = dict()
+        self.next_id = 0
+        # cell keys, box ids and bounds of the box of every registration,
+        # None until the grid is used
+        self.keys = None
+        self.owners = None
+        self.placed = None
+
+    def __len__(self):
+        return len(self.bounds)
+
+    def cells(self, bounds):
+        """ Returns the cells covered by boxes (N x 4 array of bounds) as
+        one row per box and cell: the index of the box and the cell key.
+        The cells of a box are in ascending order.
+        """
+        c = numpy.floor(bounds / self.cell_size).astype(numpy.int64)
+        nx = c[:,1] - c[:,0] + 1
+        ny = c[:,3] - c[:,2] + 1
+        n = nx * ny
+        box = numpy.repeat(numpy.arange(len(bounds)), n)
+        k = numpy.arange(len(box)) - numpy.repeat(numpy.cumsum(n) - n, n)
+        x = c[box,0] + k // ny[box]
+        y = c[box,2] + k % ny[box]
+        return [box, x * (1 << 32) + y]
+
+    def build(self):
+        names = list(self.bounds)
+        bounds = numpy.array([self.bounds[n] for n in names]).reshape(-1, 4)
+        [box, keys] = self.cells(bounds)
+        order = numpy.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.owners = numpy.array([self.ids[n] for n in names],
+                                  dtype=numpy.int64).reshape(-1)[box[order]]
+        self.placed = bounds[box[order]]
+
+    def insert(self, name, bbox):
+        bounds = bbox_bounds(bbox)
+        self.bounds[name] = bounds
+        self.ids[name] = self.next_id
+        self.next_id = self.next_id + 1
+        if self.keys is None:
+            return
+        # a single box covers few cells, no need for arrays
+        [x0, x1, y0, y1] = [int(math.floor(b / self.cell_size)) for b in bounds]
+        keys = [x * (1 << 32) + y for x in range(x0, x1 + 1)
+                for y in range(y0, y1 + 1)]
+        at = numpy.searchsorted(self.keys, keys)
+        self.keys = numpy.insert(self.keys, at, keys)
+        self.owners = numpy.insert(self.owners, at, self.ids[name])
+        self.placed = numpy.insert(self.placed, at, bounds, axis=0)
+
+    def remove(self, name):
+        del self.bounds[name]
+        owner = self.ids.pop(name)
+        if self.keys is None:
+            return
+        keep = self.owners != owner
+        self.keys = self.keys[keep]
+        self.owners = self.owners[keep]
+        self.placed = self.placed[keep]
+
+    def collisions(self, bounds):
+        """ Vectorized collision test for many boxes (N x 4 array of x_min,
+        x_max, y_min, y_max). Every candidate is only tested against the
+        placed boxes registered in its own cells. With fewer than
+        min_objects placed boxes all of them are scanned instead, which is
+        faster.
+        """
+        if len(self.bounds) < self.min_objects:
+            return bounds_overlap(bounds, list(self.bounds.values()))
+        if self.keys is None:
+            self.build()
+
+        # the placed boxes in the cells of the candidates, one row per
+        # candidate and registration
+        [cand, query] = self.cells(bounds)
+        first = numpy.searchsorted(self.keys, query, 'left')
+        m = numpy.searchsorted(self.keys, query, 'right') - first
+        pair = numpy.repeat(cand, m)
+        entry = numpy.arange(len(pair)) - numpy.repeat(numpy.cumsum(m) - m, m) \
+            + numpy.repeat(first, m)
+
+        b = bounds[pair]
+        p = self.placed[entry]
+        hit = ((b[:,1] >= p[:,0]) & (b[:,0] <= p[:,1]) &
+               (b[:,3] >= p[:,2]) & (b[:,2] <= p[:,3]))
+        result = numpy.zeros(len(bounds), dtype=bool)
+        result[pair[hit]] = True
+        return result
+
+class Stats():
+    """ Counters and timers of a generation run: calls of simulator services,
+    rejected candidates, samples per placed object and trials per scene.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.streamed = self.start
+        self.reset()
+
+    def reset(self):
+        self.scenes = 0
+        self.trials = 0
+        self.max_trials = 0
+        self.discarded = 0
+        self.backtracks = 0
+        self.rejected = {'within_root_bbox': 0, 'in_collision': 0}
+        # type -> relation -> [samples, placed objects]
+        self.samples = dict()
+        # service -> [calls, seconds]
+        self.rpc = dict()
+
+    def add_samples(self, obj_type, relation, num_of_samples, num_of_objects=0):
+        counts = self.samples.setdefault(obj_type, dict()).setdefault(relation,
+                                                                      [0, 0])
+        counts[0] = counts[0] + num_of_samples
+        counts[1] = counts[1] + num_of_objects
+
+    def add_scene(self, trials):
+        self.scenes = self.scenes + 1
+        self.max_trials = max(self.max_trials, trials)
+
+    def to_json(self):
+        return {'scenes': self.scenes, 'trials': self.trials,
+                'max_trials': self.max_trials, 'discarded': self.discarded,
+                'backtracks': self.backtracks, 'rejected': self.rejected,
+                'samples': self.samples, 'rpc': self.rpc}
+
+    def combine(self, snapshots):
+        """ Sets the counters to the sum of the given snapshots (to_json),
+        e.g. of the workers of a parallel run.
+        """
+        self.reset()
+        for data in snapshots:
+            self.scenes = self.scenes + data['scenes']
+            self.trials = self.trials + data['trials']
+            self.max_trials = max(self.max_trials, data['max_trials'])
+            self.discarded = self.discarded + data['discarded']
+            self.backtracks = self.backtracks + data['backtracks']
+            for r in data['rejected']:
+                self.rejected[r] = self.rejected[r] + data['rejected'][r]
+            for t in data['samples']:
+                for rel, [num_of_samples, num_of_objects] in data['samples'][t].items():
+                    self.add_samples(t, rel, num_of_samples, num_of_objects)
+            for m, [calls, seconds] in data['rpc'].items():
+                counts = self.rpc.setdefault(m, [0, 0.0])
+                counts[0] = counts[0] + calls
+                counts[1] = counts[1] + seconds
+
+    def report(self):
+        elapsed = time.time() - self.start
+        rpc = dict()
+        for m, [calls, seconds] in self.rpc.items():
+            rpc[m] = {'calls': calls, 'seconds': round(seconds, 3),
+                      'ms_per_call': round(1000 * seconds / max(calls, 1), 3)}
+        samples = dict()
+        for t in self.samples:
+            samples[t] = dict()
+            for rel, [num_of_samples, num_of_objects] in self.samples[t].items():
+                samples[t][rel] = {'samples': num_of_samples,
+                                   'objects': num_of_objects,
+                                   'samples_per_object': None}
+                if num_of_objects > 0:
+                    samples[t][rel]['samples_per_object'] = \
+                        round(num_of_samples / num_of_objects, 1)
+        return {'elapsed': round(elapsed, 3),
+                'scenes': self.scenes,
+                'scenes_per_minute': round(60 * self.scenes / max(elapsed, 1e-9), 2),
+                'trials_per_scene': round(self.trials / max(self.scenes, 1), 2),
+                'max_trials_per_scene': self.max_trials,
+                'discarded_attempts': self.discarded,
+                'backtracks': self.backtracks,
+                'rpc_seconds': round(sum(s for c, s in self.rpc.values()), 3),
+                'rpc': rpc,
+                'rejected': self.rejected,
+                'samples': samples}
+
+    def stream(self, stats_file, force=False):
+        """ Appends the report to stats_file as one JSON line, at most every
+        STATS_INTERVAL seconds unless forced.
+        """
+        now = time.time()
+        if stats_file is None or (not force and
+                                  now - self.streamed < STATS_INTERVAL):
+            return
+        self.streamed = now
+        stats_file.write(json.dumps(self.report()) + '\n')
+        stats_file.flush()
+
+def get_object_type(name):
+    """ Get the type of an object.
+    """
+    if cache is not None:
+        return cache.get_type(morse, name)
+    return json.loads(morse.rpc('simulation','get_object_type', name))
+
 class AbstractNode():
     """ An abstract node. Captures the common aspects of RootNode and ObjectNode
     """
     def __init__(self, object):
         self.name = object
-        self.local_bbox = BBox(self.get_local_bbox())
+        self.local_bbox_corners = self.get_local_bbox()
+        self.local_bbox = BBox(self.local_bbox_corners)
         self.calc_anchors()
 
     def get_local_bbox(self):
         """ Get the bounding box from the object.
         """
+        if cache is not None:
+            return cache.get_bbox(morse, self.name)
         return json.loads(morse.rpc('simulation','get_object_bbox',self.name))
 
     def calc_anchors(self):
@@ -158,8 +503,8 @@ class AbstractNode():
         x = (self.local_bbox.get_x_max() - self.local_bbox.get_x_min()) / 6 
         y = (self.local_bbox.get_y_max() - self.local_bbox.get_y_min()) / 6
 
-        self.x_sigma = (x) * (x)
-        self.y_sigma = (y) * (y)
+        self.x_sigma = x
+        self.y_sigma = y
         
         self.north      = [self.local_bbox.get_x_min() + 1*x, self.local_bbox.get_y_min() + 3*y]
         self.north_east = [self.local_bbox.get_x_min() + 1*x, self.local_bbox.get_y_min() + 5*y]
@@ -190,14 +535,30 @@ class AbstractNode():
             return self.north_west
         else: # anchor == 'center':
             return self.center
+
+    def placement_order(self):
+        """ Returns the (parent, node) pairs of the subtree in the order in
+        which the nodes are placed (depth first).
+        """
+        order = list()
+        for c in self.children:
+            order.append((self, c))
+            order.extend(c.placement_order())
+        return order
             
 class RootNode(AbstractNode):
     """ A root node must be a supporting plane, e.g. an office desk. All
     objects that are associated with the suppporting plane will be placed on
     it.
+
+    The poses, global bounding boxes and types of objects that are fetched
+    from the simulator are memoized for the scene in memo, which can be
+    shared by the trials of a scene. An entry is invalidated whenever the
+    pose of its object is set (see set_object_poses).
     """
-    def __init__(self, object):
+    def __init__(self, object, memo=None):
         super(RootNode, self).__init__(object)
+        self.memo = dict() if memo is None else memo
         self.children = []
         self.anchors = dict()
         self.objects = list()
@@ -206,6 +567,7 @@ class RootNode(AbstractNode):
         self.orientations = dict()
         self.global_bboxes = dict()
         self.global_bboxes_json = dict()
+        self.collision_index = GridIndex()
         
     def add(self,node, anchor):
         """ Appends an object sub-tree to the current node
@@ -213,97 +575,207 @@ class RootNode(AbstractNode):
         self.children.append(node)
         self.anchors[node] = anchor
 
-    def within_root_bbox(self,object,x,y):
+    def get_relation(self, node):
+        return self.anchors[node]
+
+    def memoized(self, name, key, fetch):
+        entry = self.memo.setdefault(name, dict())
+        if key not in entry:
+            entry[key] = fetch(name)
+        return entry[key]
+
+    def get_pose(self, name):
+        return self.memoized(name, 'pose', lambda n: json.loads(
+            morse.rpc('simulation','get_object_pose', n)))
+
+    def get_global_bbox(self, name):
+        return self.memoized(name, 'global_bbox', lambda n: json.loads(
+            morse.rpc('simulation','get_object_global_bbox', n)))
+
+    def get_type(self, name):
+        return self.memoized(name, 'type', get_object_type)
 
+    def set_object_poses(self, poses):
+        """ Sets the poses of several objects in the simulator and
+        invalidates what is memoized about them.
+        """
+        for [name, pos, orientation] in poses:
+            self.memo.pop(name, None)
+        set_object_poses(morse, poses)
+
+    def remove_objects(self, objs):
+        self.set_object_poses([(o, [0,0,0], [1,0,0,0]) for o in objs])
+
+    def sample_candidates(self, c, root_pose):
+        """ Samples candidate positions of child c around its anchor. The
+        normal distributions are truncated to the supporting plane.
+        """
+        [x_mu, y_mu] = self.get_anchor(self.anchors[c])
+        [x_min, x_max, y_min, y_max] = self.feasible_region(c)
+
+        x = truncated_normal(x_mu, self.x_sigma, x_min, x_max, MAX_NUM_OF_SAMPLES)
+        y = truncated_normal(y_mu, self.y_sigma, y_min, y_max, MAX_NUM_OF_SAMPLES)
+        if len(x) == 0 or len(y) == 0:
+            return [numpy.zeros(0), numpy.zeros(0)]
+        return [x, y]
+
+    def feasible_region(self, object):
+        """ Returns the bounds (x_min, x_max, y_min, y_max) of the positions
+        of object on the supporting plane, in the frame of the root.
+        """
         min_xy_dim = \
             min(object.local_bbox.get_x_max() - object.local_bbox.get_x_min(), \
                 object.local_bbox.get_y_max() - object.local_bbox.get_y_min()) \
                 * OBJECT_SCALE        
-        
-        if (self.local_bbox.get_x_min() + min_xy_dim < x and \
-            x < self.local_bbox.get_x_max() - min_xy_dim and \
-            self.local_bbox.get_y_min() + min_xy_dim < y and \
-            y < self.local_bbox.get_y_max()- min_xy_dim ):
-            return True
-        return False
-
-    def in_collision(self,bbox):
-
-        x_min = bbox.get_x_min()
-        x_max = bbox.get_x_max()
-        y_min = bbox.get_y_min()
-        y_max = bbox.get_y_max()
-        
-        for obj in self.global_bboxes.keys():
-            bbox2 = self.global_bboxes[obj]
-            if (x_max >= bbox2.get_x_min() and
-                x_min <= bbox2.get_x_max() and
-                y_max >= bbox2.get_y_min() and
-                y_min <= bbox2.get_y_max()):
-                return True
 
-        return False
+        return [self.local_bbox.get_x_min() + min_xy_dim,
+                self.local_bbox.get_x_max() - min_xy_dim,
+                self.local_bbox.get_y_min() + min_xy_dim,
+                self.local_bbox.get_y_max() - min_xy_dim]
+
+    def within_root_bbox(self,object,x,y):
+
+        [x_min, x_max, y_min, y_max] = self.feasible_region(object)
         
+        # NOTE: x and y may also be arrays of candidate positions
+        return ((x_min < x) & (x < x_max) & (y_min < y) & (y < y_max))
+
+    def valid_candidates(self, object, x, y, root_pose):
+        """ Tests the candidate positions of object (arrays x and y in the
+        frame of the root) all at once. Returns an iterator over the pose
+        and global bounding box of every valid candidate, in the order in
+        which the candidates were sampled, or None if no candidate is on
+        the supporting plane.
+        """
+        z = self.local_bbox.get_z_max() + \
+            (object.local_bbox.get_z_max() - object.local_bbox.get_z_min()) / 2 + Z_DIST
+        yaws = object.get_yaws(len(x))
+
+        # First test: is object position on table?
+        idx = numpy.flatnonzero(self.within_root_bbox(object, x, y))
+        stats.rejected['within_root_bbox'] += len(x) - len(idx)
+        if len(idx) == 0:
+            return None
+
+        points = numpy.column_stack([x[idx], y[idx], numpy.full(len(idx), z)])
+        [positions, orientations, corners] = \
+            calc_candidate_poses(root_pose, points, yaws[idx],
+                                 object.local_bbox_corners)
+
+        # Second test: is object in collision with other objects?
+        [mins, maxs] = bbox_from_corners(corners)
+        bounds = numpy.column_stack([mins[:,0], maxs[:,0],
+                                     mins[:,1], maxs[:,1]])
+        free = numpy.flatnonzero(~self.collision_index.collisions(bounds))
+        stats.rejected['in_collision'] += len(idx) - len(free)
+
+        return ((positions[i].tolist(), orientations[i].tolist(),
+                 corners[i].tolist()) for i in free)
+
+    def add_object(self, name, pos, orientation, json_bbox, global_bbox):
+        """ Adds a placed object to the data structures of the scene.
+        """
+        self.objects.append(name)
+        self.types[name] = self.get_type(name)
+        self.positions[name] = pos
+        self.orientations[name] = orientation
+        self.global_bboxes[name] = global_bbox
+        self.global_bboxes_json[name] = json_bbox
+        self.collision_index.insert(name, global_bbox)
+
+    def remove_object(self, name):
+        """ Removes a placed object from the data structures of the scene.
+        """
+        self.objects.remove(name)
+        for d in [self.types, self.positions, self.orientations,
+                  self.global_bboxes, self.global_bboxes_json]:
+            del d[name]
+        self.collision_index.remove(name)
+
     def place_objects(self, no):
         """ Places objects in the scene according to their specified
         relations.
+
+        Candidate poses are tested locally against the cached bounding
+        boxes; the accepted poses are sent to the simulator in one batch
+        once the whole scene has been placed.
+
+        Objects are placed in a fixed order (see placement_order). If none
+        of the candidates of an object is free of collisions, the previously
+        placed object is taken back and moved to its next valid candidate
+        (chronological backtracking). If an object has no candidate on the
+        supporting plane at all, its parent was placed badly: the objects
+        are taken back down to the parent, which is moved to its next
+        valid candidate. The valid candidates of each object are kept, so
+        backtracking does not draw new samples for the objects that are
+        taken back.
         """
-         
-        for c in self.children:
-            c.set_root(self)
-
-            [x_mu, y_mu] = self.get_anchor(self.anchors[c])
-
-            # sample as long as a valid position is found
-            i = 0
-            while i < MAX_NUM_OF_SAMPLES:
-                x = random.gauss(x_mu, self.x_sigma)
-                y = random.gauss(y_mu, self.y_sigma)
-                z = self.local_bbox.get_z_max() + \
-                    (c.local_bbox.get_z_max() - c.local_bbox.get_z_min()) / 2 + Z_DIST
-                
-                if self.within_root_bbox(c,x,y):
-
-                    # calc pose 
-                    pos =  morse.rpc('simulation','transform_to_obj_frame', self.name, str([x,y,z]))
-                    orientation = list(quaternion_about_axis(c.get_yaw(), [0,0,1]))
-
-                    # set pose
-                    morse.rpc('simulation','set_object_pose',
-                              c.name, str(pos), str(orientation))
-                    # get global bounding box
-                    json_bbox = json.loads(morse.rpc('simulation','get_object_global_bbox',c.name))
-                    global_bbox = BBox(json_bbox)
-
-                    # Second test: is object in collision with other objects?
-                    if not self.in_collision(global_bbox):
-                        # Hooray! Object could be placed
-                        self.objects.append(c.name)
-                        obj_type = json.loads(morse.rpc('simulation','get_object_type', c.name))
-                        self.types[c.name] = obj_type
-                        self.positions[c.name] = pos
-                        self.orientations[c.name] = orientation
-                        self.global_bboxes[c.name] = global_bbox
-                        self.global_bboxes_json[c.name] = json_bbox
-                        break
-                i = i + 1
 
-            if i >= MAX_NUM_OF_SAMPLES:
-                raise PlacementException(c.name)
-                        
-            # place children
-            c.place_children()
+        root_pose = self.get_pose(self.name)
+
+        order = self.placement_order()
+        nodes = [node for [parent, node] in order]
+        candidates = [None] * len(order)
+        backtracks = 0
+        k = 0
+        while k < len(order):
+            [parent, node] = order[k]
+            if candidates[k] is None:
+                node.set_root(self)
+                [x, y] = parent.sample_candidates(node, root_pose)
+                stats.add_samples(self.get_type(node.name),
+                                  parent.get_relation(node), len(x))
+                candidates[k] = self.valid_candidates(node, x, y, root_pose)
+                if candidates[k] is None and parent is self:
+                    # the anchor cannot be met on the supporting plane,
+                    # taking back other objects does not help
+                    raise PlacementException(node.name)
+
+            if candidates[k] is None:
+                # the relation cannot be met from where the parent is
+                # placed: take back the objects up to the parent and try
+                # the parent's next candidate
+                back = nodes.index(parent)
+                pose = None
+            else:
+                back = k - 1
+                pose = next(candidates[k], None)
+
+            if pose is not None:
+                # Hooray! Object could be placed
+                [pos, orientation, json_bbox] = pose
+                self.add_object(node.name, pos, orientation, json_bbox,
+                                BBox(json_bbox))
+                k = k + 1
+            elif k == 0 or backtracks == MAX_NUM_OF_BACKTRACKS:
+                raise PlacementException(node.name)
+            else:
+                # take back the objects down to index back and try the next
+                # candidate of the object at back; the candidates of the
+                # objects after it depend on its pose and are sampled anew
+                while k > back:
+                    candidates[k] = None
+                    k = k - 1
+                    self.remove_object(order[k][1].name)
+                backtracks = backtracks + 1
+                stats.backtracks += 1
+
+        for [parent, node] in order:
+            stats.add_samples(self.types[node.name], parent.get_relation(node),
+                              0, 1)
+
+        # Push all accepted poses to the simulator at once
+        self.set_object_poses([(o, self.positions[o], self.orientations[o])
+                               for o in self.objects])
 
         # Add root object (table) to data structures 
         
-        obj_type = json.loads(morse.rpc('simulation','get_object_type', self.name))
+        obj_type = self.get_type(self.name)
         self.types[self.name] = obj_type
 
-        root_pose = json.loads(morse.rpc('simulation','get_object_pose',
-                                         self.name))
         self.positions[self.name] = root_pose[0]
         self.orientations[self.name] = root_pose[1]
-        json_bbox = json.loads(morse.rpc('simulation','get_object_global_bbox',self.name))
+        json_bbox = self.get_global_bbox(self.name)
         self.global_bboxes_json[self.name] = json_bbox
 
         # TODO: replace the anlges 0 by the actual angle of the table!
@@ -354,6 +826,9 @@ class ObjectNode(AbstractNode):
         self.directions[node] = direction
         self.distances[node] = distance
 
+    def get_relation(self, node):
+        return self.directions[node]
+
     def init_directions(self):
         self.right       = 0 
         self.right_front = math.pi / 4
@@ -387,9 +862,7 @@ class ObjectNode(AbstractNode):
         [x,y,z] = self.get_root().positions[self.name]
         obj_bbox = self.get_root().global_bboxes[self.name]
 
-        root_bbox =  BBox(json.loads(morse.rpc('simulation',
-                                              'get_object_global_bbox',
-                                              self.get_root().name)))
+        root_bbox =  BBox(self.get_root().get_global_bbox(self.get_root().name))
 
         direction = self.directions[obj]
         
@@ -457,92 +930,56 @@ class ObjectNode(AbstractNode):
     def set_yaw(self,yaw):
         self.yaw = yaw
 
-    def get_yaw(self):
-        return random.uniform(self.yaw_range[0],self.yaw_range[1])
-
-    def place_children(self):
+    def get_yaws(self, n):
+        return numpy.random.uniform(self.yaw_range[0],self.yaw_range[1], n)
 
-        for c in self.children:
-
-            c.set_root(self.get_root())
-
-            [self_x,self_y,self_z] = self.get_root().positions[self.name]
-
-            phi_mu = self.get_direction(self.directions[c])
-
-            root_pose = json.loads(morse.rpc('simulation','get_object_pose',
-                                             self.get_root().name))
+    def sample_candidates(self, c, root_pose):
+        """ Samples candidate positions of child c (in the frame of the root)
+        in the direction and at the distance of its relation to self. The
+        distance is drawn from the part of the distance range that is on
+        the supporting plane; directions in which no such part exists are
+        redrawn and finally dropped.
+        """
+        [self_x,self_y,self_z] = self.get_root().positions[self.name]
 
-            [root_x, root_y, root_z] = root_pose[0]
+        phi_mu = self.get_direction(self.directions[c])
 
-            [min_dist, max_dist] = self.calc_distance_range(c)
+        [root_x, root_y, root_z] = root_pose[0]
 
-            i = 0
-            while i < MAX_NUM_OF_SAMPLES:
-                i = i + 1
-                phi = random.gauss(phi_mu, DIRECTION_SIGMA)
+        [min_dist, max_dist] = self.calc_distance_range(c)
 
-                if phi < 0:
-                    phi = phi + 2 * math.pi
-                if phi > (2 * math.pi):
-                    phi = phi - (2 * math.pi)
-            
-                dist = random.uniform(min_dist, max_dist)
+        x0 = self_x - root_x
+        y0 = self_y - root_y
+        region = self.get_root().feasible_region(c)
 
-                x_rel = math.sin(phi) * dist
-                y_rel = math.cos(phi) * dist  
+        phi = numpy.random.normal(phi_mu, DIRECTION_SIGMA, MAX_NUM_OF_SAMPLES)
+        for i in range(MAX_NUM_OF_REDRAWS + 1):
+            [lo, hi] = ray_range(x0, y0, phi, region)
+            lo = numpy.maximum(lo, min(min_dist, max_dist))
+            hi = numpy.minimum(hi, max(min_dist, max_dist))
+            redraw = numpy.flatnonzero(lo >= hi)
+            if len(redraw) == 0 or i == MAX_NUM_OF_REDRAWS:
+                break
+            phi[redraw] = numpy.random.normal(phi_mu, DIRECTION_SIGMA, len(redraw))
 
-                x =  self_x - root_x + x_rel
-                y =  self_y - root_y + y_rel
-                z = self.get_root().local_bbox.get_z_max() + \
-                    (c.local_bbox.get_z_max() - c.local_bbox.get_z_min()) / 2 + Z_DIST 
+        valid = lo < hi
+        phi = phi[valid]
+        dist = numpy.random.uniform(lo[valid], hi[valid])
 
-                # First sanity check: is object position on table?
-                
-                if self.get_root().within_root_bbox(c,x,y):
-            
-                    pos =  morse.rpc('simulation','transform_to_obj_frame',
-                                     self.get_root().name, str([x,y,z]))
-
-
-                    orientation = list(quaternion_about_axis(c.get_yaw(), [0,0,1]))
-                    
-                    # set pose
-                    morse.rpc('simulation','set_object_pose', c.name,
-                              str(pos),str(orientation))
-
-                    json_bbox = json.loads(morse.rpc('simulation','get_object_global_bbox',c.name))
-                    global_bbox = BBox(json_bbox)
-
-                    # Second test: is object in collision with other objects?
-                    if not self.get_root().in_collision(global_bbox):
-                        # Hooray! Object could be placed
-                        self.get_root().objects.append(c.name)
-
-                        obj_type = json.loads(morse.rpc('simulation','get_object_type', c.name))
-                        self.get_root().types[c.name] = obj_type
-                        self.get_root().positions[c.name] = pos
-                        self.get_root().orientations[c.name] = orientation
-                        self.get_root().global_bboxes[c.name] = global_bbox
-                        self.get_root().global_bboxes_json[c.name] = json_bbox
-                        break
-                #else:
-                    #print('not on table: ', c.name, min_dist, max_dist)
+        x =  x0 + numpy.sin(phi) * dist
+        y =  y0 + numpy.cos(phi) * dist
+        return [x, y]
 
-            if i >= MAX_NUM_OF_SAMPLES:
-                raise PlacementException(c.name)
-            
-            c.place_children()
-
-def remove_objects(objs):
-    for o in objs:
-        morse.rpc('simulation','set_object_pose', o, str([0,0,0]),str([1,0,0,0]))
-            
 # Main
 
 class PlacementException(Exception):
     def __init__(self, msg):
         self.msg = msg
+
+class RejectionException(Exception):
+    def __init__(self, no):
+        self.no = no
+        self.msg = 'scene %i was rejected %i times' % (no, MAX_NUM_OF_REJECTIONS)
     
 class Usage(Exception):
     def __init__(self, msg):
@@ -550,22 +987,592 @@ class Usage(Exception):
 
 def help_msg():
     return """
-  Usage: scene_generator.py [-h] <qsrmodel> <outfile> <num_of_scenes> 
+  Usage: scene_generator.py [-h] [--batch] [--seed=<seed>] [--worker=<worker> ...] [--stats=<file>] [--converge=<threshold>] [--diversity=<d>] [--model=<name>] [--cache=<file>] [--clear-cache] <qsrmodel> <outfile> <num_of_scenes> 
 
     qsrmodel        file including the QSR model for generationg the scenes 
     outfile         name of the output file
     num_of_scenes   number of scenes to be generated 
 
+    --batch         run without prompts and append every scene to outfile
+                    (one JSON list per line) as soon as it is generated.
+                    An existing outfile is resumed after its last scene.
+    --seed=<seed>   seed for the random number generators; every scene is
+                    generated with its own seed derived from it
+                    (default in batch mode: 0)
+    --worker=<worker>
+                    generate scenes in parallel, one process per worker
+                    (implies --batch). A worker is given as
+                    [host:]port:table:set, i.e. the simulator instance,
+                    the supporting plane and the offset of the object set
+                    it uses (e.g. set 1 uses cup.007, cup.008, ...).
+                    Scenes of all workers are given in the world frame of
+                    the table of the first worker, as if they had been
+                    generated on it.
+    --stats=<file>  append a report of the run (simulator calls, rejected
+                    candidates, samples per object, trials and scenes per
+                    minute) to file as one JSON line every %i seconds and
+                    at the end. The final report is always printed.
+    --converge=<threshold>
+                    stop as soon as the generated scenes follow the QSR
+                    model: the presence counts and the left/right,
+                    front/back and close/distant relations of the scenes
+                    differ from the model by less than threshold (mean
+                    total variation distance per kind, e.g. 0.05).
+                    num_of_scenes is the upper bound. Distributions that
+                    are under-sampled or still differ are reported.
+    --diversity=<d> reject scenes whose qualitative layout repeats an
+                    earlier scene: the Jaccard similarity of the sets of
+                    (type1, type2, relation) triples of their QSR labels
+                    must stay below 1 - d, 0 <= d < 1 (0: reject exact
+                    duplicates only). The generation stops once %i
+                    candidates of a scene have been rejected.
+
+    --model=<name>  name of the simulated environment, e.g. tum_kitchen.
+                    The bounding boxes and types of its objects are kept
+                    in the cache file across runs. Without a name they are
+                    only cached for the run
+    --cache=<file>  cache of object bounding boxes and types
+                    (default: %s)
+    --clear-cache   clear the cached objects of the model, e.g. after a
+                    blend asset has changed
+
     -h, --help for seeing this msg
-"""
+""" % (STATS_INTERVAL, MAX_NUM_OF_REJECTIONS, CACHE_FILE)
 
 morse = None
+cache = None
+stats = Stats()
+
+def label_scenes(scns):
+    """ Calculates the QSR labels between all pairs of objects in each of the
+    given scenes. All pairs of all scenes are labeled in one batch.
+    """
+    pairs = list()
+    cam_pos = list()
+    pos1 = list()
+    pos2 = list()
+    for scn in scns:
+        for o1 in scn['objects']:
+            for o2 in scn['objects']:
+                if o1 != o2:
+                    pairs.append([o1, o2])
+                    cam_pos.append(scn['camera_position'])
+                    pos1.append(scn['position'][o1])
+                    pos2.append(scn['position'][o2])
+
+    [part, close] = qsr.calc_QSR_batch(numpy.reshape(cam_pos, (-1, 3)),
+                                       numpy.reshape(pos1, (-1, 3)),
+                                       numpy.reshape(pos2, (-1, 3)))
+
+    scns_qsr = list()
+    k = 0
+    for scn in scns:
+        scn_qsr = dict()
+        for o1 in scn['objects']:
+            obj_qsr = dict()
+            for o2 in scn['objects']:
+                if o1 != o2:
+                    obj_qsr[o2] = qsr.qsr_list(part[k], close[k])
+                    k = k + 1
+            scn_qsr[o1] = obj_qsr
+        scns_qsr.append(scn_qsr)
+    return scns_qsr
+
+def label_scene(scn):
+    """ Calculates the QSR labels between all pairs of objects in a scene.
+    """
+    return label_scenes([scn])[0]
+
+def seed_scene(seed, no, attempt):
+    """ Seeds the random number generators for an attempt to generate scene
+    no, so that every scene can be reproduced independently of the scenes
+    before it.
+    """
+    random.seed('%s-%i-%i' % (seed, no, attempt))
+    numpy.random.seed(random.getrandbits(32))
+
+def parse_scene(line):
+    """ Returns the number of a scene ["sceneN", {...}] given as a line of
+    JSON, or None if the line is not a scene. Raises a ValueError if the
+    line is not JSON.
+    """
+    scene = json.loads(line.decode())
+    if not (isinstance(scene, list) and len(scene) == 2 and
+            isinstance(scene[0], str) and scene[0].startswith('scene') and
+            scene[0][len('scene'):].isdigit() and isinstance(scene[1], dict)):
+        return None
+    return int(scene[0][len('scene'):])
+
+def resume_batch(filename):
+    """ Returns the number of the last scene in a JSON-lines output file, or
+    0 if there is none. A last line without newline that is cut off, e.g.
+    from a crash while writing, is truncated. Raises a ValueError if the
+    file holds anything else than scenes, e.g. a pretty printed JSON list.
+    """
+    last = 0
+    size = 0
+    with ignored(FileNotFoundError):
+        with open(filename, 'rb+') as scn_file:
+            for n, line in enumerate(scn_file, 1):
+                try:
+                    no = parse_scene(line)
+                except ValueError:
+                    if line.endswith(b'\n') or not line.startswith(b'["scene'):
+                        no = None
+                    else:
+                        # cut off while writing
+                        scn_file.truncate(size)
+                        break
+                if no is None:
+                    raise ValueError('%s:%i is not a scene ["sceneN", {...}] '
+                                     'of a --batch output' % (filename, n))
+                last = no
+                size += len(line)
+                if not line.endswith(b'\n'):
+                    # complete, only the newline is missing
+                    scn_file.write(b'\n')
+    return last
+
+def write_scene(scn_file, scene):
+    """ Appends a scene to a JSON-lines output file and flushes it to disk.
+    """
+    scn_file.write(json.dumps(scene) + '\n')
+    scn_file.flush()
+    os.fsync(scn_file.fileno())
+
+def rename_scene(scene, names):
+    """ Renames the objects of a scene; names maps old to new names.
+    """
+    scn = scene[1]
+    scn['supporting_object'] = names.get(scn['supporting_object'],
+                                         scn['supporting_object'])
+    scn['objects'] = [names.get(o, o) for o in scn['objects']]
+    for key in ['type', 'position', 'orientation', 'bbox']:
+        scn[key] = dict((names.get(o, o), v) for o, v in scn[key].items())
+    return scene
+
+def move_scene(scene, pose):
+    """ Moves a scene rigidly so that its table gets the given pose
+    ([position, orientation]). Positions, orientations, bounding boxes and
+    the camera keep their poses relative to the table, so the scene is
+    given as if it had been generated on a table with that pose.
+    """
+    scn = scene[1]
+    table = [scn['position']['table'], scn['orientation']['table']]
+    if table == pose:
+        return scene
+    rotation = quaternion_multiply(pose[1], quaternion_conjugate(table[1]))
+
+    def move(points):
+        points = numpy.asarray(points, dtype=numpy.float64) - table[0]
+        return transform_points(pose[0], rotation, points).tolist()
+
+    objs = list(scn['position'])
+    scn['position'] = dict(zip(objs, move([scn['position'][o] for o in objs])))
+    scn['orientation'] = dict(zip(objs, quaternion_multiply(
+        rotation, [scn['orientation'][o] for o in objs]).tolist()))
+    objs = list(scn['bbox'])
+    scn['bbox'] = dict(zip(objs, move([scn['bbox'][o] for o in objs])))
+    scn['camera_position'] = move(scn['camera_position'])
+    return scene
+
+class SceneGenerator():
+    """ Generates scenes on one supporting plane of a simulator instance.
+    Several generators can run in parallel on different tables, each with
+    its own set of objects (see obj_name), or on different simulator
+    instances. Generated scenes always refer to the supporting plane as
+    'table' and to the objects by their names in the first set.
+    """
+    def __init__(self, model, table='table', offset=0, host='localhost',
+                 port=4000, seed=None, num_of_trials=20, connection=None):
+        self.model = model
+        self.table = table
+        self.offset = offset
+        self.host = host
+        self.port = port
+        self.seed = seed
+        self.num_of_trials = num_of_trials
+        self.connection = connection
+        if connection is None:
+            self.connection = Connection(host, port, stats.rpc)
+
+    def sample_objects(self):
+        """ Samples the objects of a scene from the presence model. Returns a
+        dict from object names to types.
+        """
+        objs_of_type = dict()
+        for t in self.model.types:
+            objs_of_type[t] = self.model.presence[t].sample()
+            print(t,objs_of_type[t])
+
+        objs = dict()
+        for t in objs_of_type:
+            for j in range(objs_of_type[t]):
+                if j == 0:
+                    objs[t.lower()] = t
+                else:
+                    objs[t.lower() + ".00" + str(j)] = t
+        return objs
+
+    def build_tree(self, objs, memo=None):
+        """ Creates the object tree of a scene with the given objects and
+        samples their relations. Returns the root node, or None if the
+        scene has no landmark.
+        """
+        # Create a root note
+        table = RootNode(self.table, memo)
+
+        node = dict()
+        for o in objs:
+            # Create an object node 
+            node[o] = ObjectNode(obj_name(o, self.offset))
+
+            # Background knowledge: some objects do only vary very little in orientation
+            if objs[o] in ['Monitor']:
+                node[o].set_yaw_range([0.0,math.pi/32])
+            elif objs[o] in ['Telephone','Mouse','Keyboard','PC','Laptop']:
+                node[o].set_yaw_range([0,math.pi/16])
+            else:
+                node[o].set_yaw_range([0,2*math.pi])
+
+        landmark_added = False
+        landmark = None
+        for o in objs:
+            if objs[o] == 'Monitor':
+                table.add(node[o],self.model.anchors[objs[o]].sample())
+                landmark_added = True
+                landmark = o
+                break
+
+        if not landmark_added:
+            for o in objs:
+                if objs[o] == 'Laptop':
+                    table.add(node[o],self.model.anchors[objs[o]].sample())
+                    landmark_added = True
+                    landmark = o
+                    break
+
+        if not landmark_added:
+            return None
+
+        print("Landmark:", landmark)
+
+        for o in objs:
+            if objs[o] in ['Monitor'] and o != landmark:
+                direction = "center_center"
+                while direction == "center_center":
+                    lrc = self.model.lrc[objs[landmark]][objs[o]].sample()
+                    fbc = self.model.fbc[objs[landmark]][objs[o]].sample()
+                    direction = lrc + "_" + fbc
+
+                cd = self.model.cd[objs[landmark]][objs[o]].sample()
+                node[landmark].add(node[o],direction,cd)
+                print("QSR:",o,landmark,direction,cd)
+
+        for o in objs:
+            if objs[o] in ['PC'] and o != landmark:
+                direction = "center_center"
+                while direction == "center_center":
+                    lrc = self.model.lrc[objs[landmark]][objs[o]].sample()
+                    fbc = self.model.fbc[objs[landmark]][objs[o]].sample()
+                    direction = lrc + "_" + fbc
+
+                cd = self.model.cd[objs[landmark]][objs[o]].sample()
+                node[landmark].add(node[o],direction,cd)
+                print("QSR:",o,landmark,direction,cd)
+
+        for o in objs:
+            if objs[o] in ['Laptop'] and o != landmark:
+                direction = "center_center"
+                while direction == "center_center":
+                    lrc = self.model.lrc[objs[landmark]][objs[o]].sample()
+                    fbc = self.model.fbc[objs[landmark]][objs[o]].sample()
+                    direction = lrc + "_" + fbc
+
+                cd = self.model.cd[objs[landmark]][objs[o]].sample()
+                node[landmark].add(node[o],direction,cd)
+                print("QSR:",o,landmark,direction,cd)
+
+        for o in objs:
+            if objs[o] in ['Lamp'] and o != landmark:
+                direction = "center_center"
+                while direction == "center_center":
+                    lrc = self.model.lrc[objs[landmark]][objs[o]].sample()
+                    fbc = self.model.fbc[objs[landmark]][objs[o]].sample()
+                    direction = lrc + "_" + fbc
+
+                cd = self.model.cd[objs[landmark]][objs[o]].sample()
+                node[landmark].add(node[o],direction,cd)
+                print("QSR:",o,landmark,direction,cd)
+
+        keyboard_added = False
+        keyboard_landmark = None
+        for o in objs:
+            if objs[o] in ['Keyboard']: 
+                if objs[o] == 'Keyboard':
+                    keyboard_landmark = o
+                    keyboard_added = True
+
+
+                direction = "center_center"
+                while direction == "center_center":
+                    lrc = self.model.lrc[objs[landmark]][objs[o]].sample()
+                    fbc = self.model.fbc[objs[landmark]][objs[o]].sample()
+                    direction = lrc + "_" + fbc
+
+                cd = self.model.cd[objs[landmark]][objs[o]].sample()
+                node[landmark].add(node[o],direction,cd)
+                print("QSR:",o,landmark,direction,cd)
+                break
+
+        for o in objs:
+            if objs[o] in ['Keyboard'] and o != keyboard_landmark and o != landmark: 
+                l = landmark
+                if keyboard_added == True:
+                    l = keyboard_landmark
+
+                direction = "center_center"
+                while direction == "center_center":
+                    lrc = self.model.lrc[objs[l]][objs[o]].sample()
+                    fbc = self.model.fbc[objs[l]][objs[o]].sample()
+                    direction = lrc + "_" + fbc
+
+                cd = self.model.cd[objs[l]][objs[o]].sample()
+                node[l].add(node[o],direction,cd)
+                print("QSR:",o,l,direction,cd)
+    
+        
+        for o in objs:
+            if o != landmark and objs[o] not in ['Lamp','Laptop','Monitor','Keyboard','PC']:
+                l = landmark
+                if keyboard_added:
+                    l = keyboard_landmark
+
+                direction = "center_center"
+                while direction == "center_center":
+                    lrc = self.model.lrc[objs[l]][objs[o]].sample()
+                    fbc = self.model.fbc[objs[l]][objs[o]].sample()
+                    direction = lrc + "_" + fbc
+            
+                cd = self.model.cd[objs[l]][objs[o]].sample()
+                node[l].add(node[o],direction,cd)
+                print("QSR:",o,l,direction,cd)
+
+        return table
+
+    def generate(self, no, accept=None, attempt=0, check=None):
+        """ Generates scene no, starting with the given attempt. If given,
+        check is called with every placed scene and the scene is discarded
+        unless it returns True, and accept is called with the scene while
+        its objects are still placed in the simulator. The attempt of the
+        generated scene is kept in self.attempt.
+
+        Raises a RejectionException once check has rejected
+        MAX_NUM_OF_REJECTIONS candidates of the scene, and the IOError if
+        the connection is still lost after NUM_OF_RECONNECTS reconnects.
+        """
+        trials = stats.trials
+        rejections = 0
+        reconnects = 0
+
+        def counted(scene):
+            nonlocal rejections
+            if check(scene):
+                return True
+            rejections = rejections + 1
+            return False
 
-def anchor_name(i):
-    anchor_name = ['north_west','north','north_east',
-                   'west','center','east',
-                   'south_west','south','south_east']
-    return anchor_name[i]
+        while True:
+            # a discarded scene is retried with the next seed
+            if self.seed is not None:
+                seed_scene(self.seed, no, attempt)
+
+            objs = self.sample_objects()
+            print(objs)
+
+            try:
+                scene = self.place(no, objs, accept,
+                                   None if check is None else counted)
+            except IOError:
+                if reconnects == NUM_OF_RECONNECTS:
+                    raise
+                # the same attempt is repeated once reconnected
+                reconnects = reconnects + 1
+                self.connection.reset()
+                continue
+
+            self.attempt = attempt
+            attempt = attempt + 1
+            if scene is not None:
+                stats.add_scene(stats.trials - trials)
+                return scene
+            stats.discarded += 1
+            if rejections == MAX_NUM_OF_REJECTIONS:
+                raise RejectionException(no)
+
+    def place(self, no, objs, accept=None, check=None):
+        """ Places the given objects in up to num_of_trials trials. Returns
+        the scene, or None if the scene has to be discarded.
+        """
+        global morse
+        morse = self.connection
+
+        names = dict((obj_name(o, self.offset), o) for o in objs)
+
+        # Please note: all objects need to exist in the simulation beforehand!
+        cache.prefetch(morse, [self.table] + list(names))
+
+        # what is fetched from the simulator during the scene
+        memo = dict()
+        for ii in range(self.num_of_trials):
+            stats.trials += 1
+            table = self.build_tree(objs, memo)
+            if table is None:
+                print('Warning: No landmark -> Discard scene')
+                return None
+
+            try:
+                scene = table.place_objects(no)
+            except PlacementException as e:
+                # nothing has been moved yet, the poses are only set once
+                # the whole scene is placed
+                print('Warning:',e.msg,'could not be placed -> retry generation')
+                continue
+
+            names[self.table] = 'table'
+            scene = rename_scene(scene, names)
+            if check is not None and not check(scene):
+                print('Warning: Scene rejected -> Discard scene')
+                table.remove_objects([n for n in names if n != self.table])
+                return None
+            if accept is not None:
+                accept(scene)
+            with ignored(IOError):
+                table.remove_objects([n for n in names if n != self.table])
+            return scene
+
+        return None
+
+def parse_worker(spec):
+    """ Parses a worker specification [host:]port:table:set
+    """
+    part = spec.split(':')
+    if len(part) == 3:
+        part = ['localhost'] + part
+    if len(part) != 4:
+        raise Usage('invalid worker: ' + spec)
+    return {'host': part[0], 'port': int(part[1]), 'table': part[2],
+            'offset': int(part[3])}
+
+def run_worker(index, worker, model_file, cache_file, cache_model, seed,
+               frame, tasks, results):
+    """ Generates and labels the scenes whose numbers (and first attempts)
+    are read from the task queue and puts them in the result queue, along
+    with their attempts and the statistics of the worker. The scenes are
+    moved onto a table with the pose frame (see move_scene).
+
+    If the worker has a 'factory', it is called instead of pymorse.Morse to
+    connect to the simulator (see Connection).
+    """
+    global cache
+    cache = ModelCache(cache_file, cache_model)
+    model = compiled_model.load(model_file)
+    connection = Connection(worker['host'], worker['port'], stats.rpc,
+                            worker.get('factory'))
+    generator = SceneGenerator(model, worker['table'], worker['offset'],
+                               worker['host'], worker['port'], seed,
+                               connection=connection)
+    for [no, attempt] in iter(tasks.get, None):
+        scene = move_scene(generator.generate(no, attempt=attempt), frame)
+        scene[1]['qsr'] = label_scene(scene[1])
+        results.put((index, scene, generator.attempt, stats.to_json()))
+    generator.connection.close()
+
+def generate_parallel(workers, model_file, cache_file, cache_model, seed,
+                      first, last, outfile, stats_file=None, done=None,
+                      check=None):
+    """ Generates the scenes first..last with one process per worker and
+    writes them to outfile in order. The statistics of all workers are
+    combined in stats. If given, done is called with every written scene;
+    the generation stops early once it returns True.
+
+    If given, check is called with the scenes in order before they are
+    written. A rejected scene is generated anew with its next attempt, as
+    in a serial run, so the result does not depend on the workers. After
+    MAX_NUM_OF_REJECTIONS rejections of a scene a RejectionException is
+    raised.
+
+    The scenes are given in the frame of the table of the first worker:
+    scenes generated on other tables are moved onto it (see move_scene).
+
+    If a worker stops before all scenes are written, e.g. because its
+    simulator went away, the other workers are stopped and a RuntimeError
+    is raised. The scenes written so far are kept, so a --batch run can be
+    resumed (see resume_batch).
+    """
+    with Connection(workers[0]['host'], workers[0]['port'],
+                    factory=workers[0].get('factory')) as connection:
+        frame = json.loads(connection.rpc('simulation', 'get_object_pose',
+                                          workers[0]['table']))
+
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    for no in range(first, last + 1):
+        tasks.put((no, 0))
+
+    procs = list()
+    for i, w in enumerate(workers):
+        procs.append(multiprocessing.Process(target=run_worker,
+                                             args=(i, w, model_file, cache_file,
+                                                   cache_model, seed, frame,
+                                                   tasks, results)))
+        procs[-1].start()
+
+    snapshots = dict()
+    pending = dict()
+    rejections = dict()
+    no = first
+    while no <= last:
+        try:
+            [i, scene, attempt, snapshot] = results.get(timeout=1)
+        except queue.Empty:
+            # the workers only return after the loop, so any exit is a
+            # failure and the scene the worker had taken would never arrive
+            for i, p in enumerate(procs):
+                if p.exitcode is not None:
+                    for q in procs:
+                        q.terminate()
+                    raise RuntimeError('worker %i stopped (exit code %s) '
+                                       'before scene %i' % (i, p.exitcode, no))
+            continue
+        snapshots[i] = snapshot
+        stats.combine(snapshots.values())
+        stats.stream(stats_file)
+        pending[int(scene[0][len('scene'):])] = [scene, attempt]
+        while no in pending:
+            [scene, attempt] = pending.pop(no)
+            if check is not None and not check(scene):
+                rejections[no] = rejections.get(no, 0) + 1
+                if rejections[no] == MAX_NUM_OF_REJECTIONS:
+                    for p in procs:
+                        p.terminate()
+                    raise RejectionException(no)
+                tasks.put((no, attempt + 1))
+                break
+            write_scene(outfile, scene)
+            print("=========================================")
+            print(no," scene generated")
+            print("=========================================")
+            no = no + 1
+            if done is not None and done(scene):
+                for p in procs:
+                    p.terminate()
+                return
+
+    for w in workers:
+        tasks.put(None)
+    for p in procs:
+        p.join()
 
 if __name__ == "__main__":
     #sys.exit(main())
@@ -576,299 +1583,162 @@ if __name__ == "__main__":
         argv = sys.argv
     try:
         try:
-            opts, args = getopt.getopt(argv[1:], "h", ["help"])
+            opts, args = getopt.getopt(argv[1:], "h", ["help", "batch", "seed=",
+                                                       "worker=", "stats=",
+                                                       "converge=", "diversity=",
+                                                       "cache=", "model=",
+                                                       "clear-cache"])
         except getopt.error as msg:
             raise Usage(msg)
 
         if ('-h','') in opts or ('--help', '') in opts or len(args) != 3:
             raise Usage(help_msg())
 
-        #print('Parsing QSR model')
-
-
-        
-        presence_total = dict()
-        presence_pop= dict()
-        anchor_pop = dict()
-        lrc_pop = dict()
-        fbc_pop = dict()
-        cd_pop = dict()
-        
-        with open(args[0]) as qsr_file:    
-            qsr_model = json.load(qsr_file)
-
-            print('PRESENCE')
-            for t in qsr_model['types']:
-                # total number of seen type instaces
-                presence_total[t] = sum(qsr_model['presence'][t][1:])
-                #print(t, presence_total[t])
-                # generate the population for each type
-                presence_pop[t] = list()
-                for i in range(len(qsr_model['presence'][t])):
-                    for j in range(qsr_model['presence'][t][i]):
-                        presence_pop[t].append(i)
-
-                print(t,presence_pop[t])
-
-            print('ANCHORS')
-            for t in qsr_model['landmarks']:
-                anchor_pop[t] = list()
-                for i in range(len(qsr_model['anchors'][t])):
-                    for j in range(qsr_model['anchors'][t][i]):
-                        anchor_pop[t].append(anchor_name(i))
-                print(t, anchor_pop[t])
-
-            print('QSR')
-            landmarks = list()
-            for t1 in qsr_model['landmarks']:
-                lrc_pop[t1] = dict()
-                fbc_pop[t1] = dict()
-                cd_pop[t1]  = dict()
-                landmarks.append(t1)
-                for t2 in qsr_model['types']:
-                    qsr_val = qsr_model['qsr'][t1][t2]
-
-                    lr_center = max((qsr_val[4] + qsr_val [5]) - (qsr_val[0] + qsr_val[1]),0)
-                    lrc_pop[t1][t2] = list()
-                    lrc_pop[t1][t2] += ['left' for i in range(qsr_val[0])]
-                    lrc_pop[t1][t2] += ['right' for i in range(qsr_val[1])]
-                    lrc_pop[t1][t2] += ['center' for i in range(lr_center)]
-
-                    fb_center =  max((qsr_val[4] + qsr_val [5]) - (qsr_val[2] + qsr_val[3]),0)
-                    fbc_pop[t1][t2] = list()
-                    fbc_pop[t1][t2] += ['front' for i in range(qsr_val[2])]
-                    fbc_pop[t1][t2] += ['back' for i in range(qsr_val[3])]
-                    fbc_pop[t1][t2] += ['center' for i in range(fb_center)]
-
-                    cd_pop[t1][t2] = list()
-                    cd_pop[t1][t2] += ['close' for i in range(qsr_val[4])]
-                    cd_pop[t1][t2] += ['distant' for i in range(qsr_val[5])]
-
-                        
-                print(t1,lrc_pop[t1])
-                print("----------------------------")
-                print(t1,fbc_pop[t1])
-                print("----------------------------")
-                print(t1,cd_pop[t1])
-                print("============================")
-
-            
+        cache = ModelCache(dict(opts).get('--cache', CACHE_FILE),
+                           dict(opts).get('--model'))
+        if ('--clear-cache', '') in opts:
+            if cache.model is None:
+                raise Usage('--clear-cache needs the name of a model (--model)')
+            cache.clear()
+
+        workers = [parse_worker(v) for (o, v) in opts if o == '--worker']
+        batch = ('--batch', '') in opts or len(workers) > 0
+        seed = dict(opts).get('--seed')
+        if batch and seed is None:
+            seed = 0
+
+        stats_file = None
+        if '--stats' in dict(opts):
+            stats_file = open(dict(opts)['--stats'], 'a')
+
+        model = compiled_model.load(args[0])
+
+        convergence = None
+        if '--converge' in dict(opts):
+            threshold = float(dict(opts)['--converge'])
+            convergence = Convergence(model)
+
+        index = None
+        if '--diversity' in dict(opts):
+            diversity = float(dict(opts)['--diversity'])
+            if not 0.0 <= diversity < 1.0:
+                raise Usage('diversity must be at least 0 and below 1')
+            index = SignatureIndex(diversity)
+
+        print('PRESENCE')
+        for t in model.types:
+            print(t, model.presence[t])
+
+        print('ANCHORS')
+        for t in model.landmarks:
+            print(t, model.anchors[t])
+
+        print('QSR')
+        for t1 in model.landmarks:
+            print(t1, model.lrc[t1])
+            print("----------------------------")
+            print(t1, model.fbc[t1])
+            print("----------------------------")
+            print(t1, model.cd[t1])
+            print("============================")
 
         #print('Starting scene generation')
         #sys.exit()
         scenes = list()
         num_of_scenes = int(args[2])
 
-        num_of_trials_per_scene = 20
-        
         if num_of_scenes < 0:
             num_of_scenes = 0
         i = 0
-        while i < num_of_scenes:
-            
-            objs_of_type = dict()
-            for t in presence_pop:
-                objs_of_type[t] = random.sample(presence_pop[t],1)[0]
-                print(t,objs_of_type[t])
-                
-                objs = dict()
-                for t in objs_of_type:
-                    for j in range(objs_of_type[t]):
-                        if j == 0:
-                            objs[t.lower()] = t
-                        else:
-                            objs[t.lower() + ".00" + str(j)] = t
-                            
-            print(objs)
-            ii = 0
-            while ii < num_of_trials_per_scene:
-                
-                with ignored(IOError):
-                    
-                    with pymorse.Morse() as morse:
-                        # Please note: all objects need to exist in the simulation beforehand!
-                        # Create a root note
-                        table = RootNode('table')
-
-                        node = dict()
-                        for o in objs:
-                            # Create an object node 
-                            node[o] = ObjectNode(o)
-
-                            # Background knowledge: some objects do only vary very little in orientation
-                            if objs[o] in ['Monitor']:
-                                node[o].set_yaw_range([0.0,math.pi/32])
-                            elif objs[o] in ['Telephone','Mouse','Keyboard','PC','Laptop']:
-                                node[o].set_yaw_range([0,math.pi/16])
-                            else:
-                                node[o].set_yaw_range([0,2*math.pi])
-
-                        landmark_added = False
-                        landmark = None
-                        for o in objs:
-                            if objs[o] == 'Monitor':
-                                table.add(node[o],random.sample(anchor_pop[objs[o]],1)[0])
-                                landmark_added = True
-                                landmark = o
-                                break
-
-                        if not landmark_added:
-                            for o in objs:
-                                if objs[o] == 'Laptop':
-                                    table.add(node[o],random.sample(anchor_pop[objs[o]],1)[0])
-                                    landmark_added = True
-                                    landmark = o
-                                    break
-                    
-                        try:
-                            if not landmark_added:
-                                ii =  num_of_trials_per_scene
-                                raise PlacementException('No landmark -> Discard scene')
-
-                            print("Landmark:", landmark)
-                            
-                            for o in objs:
-                                if objs[o] in ['Monitor'] and o != landmark:
-                                    direction = "center_center"
-                                    while direction == "center_center":
-                                        lrc = random.sample(lrc_pop[objs[landmark]][objs[o]],1)[0]
-                                        fbc = random.sample(fbc_pop[objs[landmark]][objs[o]],1)[0]
-                                        direction = lrc + "_" + fbc
-
-                                    cd = random.sample(cd_pop[objs[landmark]][objs[o]],1)[0]
-                                    node[landmark].add(node[o],direction,cd)
-                                    print("QSR:",o,landmark,direction,cd)
-
-                            for o in objs:
-                                if objs[o] in ['PC'] and o != landmark:
-                                    direction = "center_center"
-                                    while direction == "center_center":
-                                        lrc = random.sample(lrc_pop[objs[landmark]][objs[o]],1)[0]
-                                        fbc = random.sample(fbc_pop[objs[landmark]][objs[o]],1)[0]
-                                        direction = lrc + "_" + fbc
-
-                                    cd = random.sample(cd_pop[objs[landmark]][objs[o]],1)[0]
-                                    node[landmark].add(node[o],direction,cd)
-                                    print("QSR:",o,landmark,direction,cd)
-
-                            for o in objs:
-                                if objs[o] in ['Laptop'] and o != landmark:
-                                    direction = "center_center"
-                                    while direction == "center_center":
-                                        lrc = random.sample(lrc_pop[objs[landmark]][objs[o]],1)[0]
-                                        fbc = random.sample(fbc_pop[objs[landmark]][objs[o]],1)[0]
-                                        direction = lrc + "_" + fbc
-
-                                    cd = random.sample(cd_pop[objs[landmark]][objs[o]],1)[0]
-                                    node[landmark].add(node[o],direction,cd)
-                                    print("QSR:",o,landmark,direction,cd)
-
-                            for o in objs:
-                                if objs[o] in ['Lamp'] and o != landmark:
-                                    direction = "center_center"
-                                    while direction == "center_center":
-                                        lrc = random.sample(lrc_pop[objs[landmark]][objs[o]],1)[0]
-                                        fbc = random.sample(fbc_pop[objs[landmark]][objs[o]],1)[0]
-                                        direction = lrc + "_" + fbc
-
-                                    cd = random.sample(cd_pop[objs[landmark]][objs[o]],1)[0]
-                                    node[landmark].add(node[o],direction,cd)
-                                    print("QSR:",o,landmark,direction,cd)
-                            
-                            keyboard_added = False
-                            keyboard_landmark = None
-                            for o in objs:
-                                if objs[o] in ['Keyboard']: 
-                                    if objs[o] == 'Keyboard':
-                                        keyboard_landmark = o
-                                        keyboard_added = True
-
-
-                                    direction = "center_center"
-                                    while direction == "center_center":
-                                        lrc = random.sample(lrc_pop[objs[landmark]][objs[o]],1)[0]
-                                        fbc = random.sample(fbc_pop[objs[landmark]][objs[o]],1)[0]
-                                        direction = lrc + "_" + fbc
-
-                                    cd = random.sample(cd_pop[objs[landmark]][objs[o]],1)[0]
-                                    node[landmark].add(node[o],direction,cd)
-                                    print("QSR:",o,landmark,direction,cd)
-                                    break
-
-                            for o in objs:
-                                if objs[o] in ['Keyboard'] and o != keyboard_landmark and o != landmark: 
-                                    l = landmark
-                                    if keyboard_added == True:
-                                        l = keyboard_landmark
-
-                                    direction = "center_center"
-                                    while direction == "center_center":
-                                        lrc = random.sample(lrc_pop[objs[l]][objs[o]],1)[0]
-                                        fbc = random.sample(fbc_pop[objs[l]][objs[o]],1)[0]
-                                        direction = lrc + "_" + fbc
-
-                                    cd = random.sample(cd_pop[objs[l]][objs[o]],1)[0]
-                                    node[l].add(node[o],direction,cd)
-                                    print("QSR:",o,l,direction,cd)
-                                
-                                    
-                            for o in objs:
-                                if o != landmark and objs[o] not in ['Lamp','Laptop','Monitor','Keyboard','PC']:
-                                    l = landmark
-                                    if keyboard_added:
-                                        l = keyboard_landmark
-
-                                    direction = "center_center"
-                                    while direction == "center_center":
-                                        lrc = random.sample(lrc_pop[objs[l]][objs[o]],1)[0]
-                                        fbc = random.sample(fbc_pop[objs[l]][objs[o]],1)[0]
-                                        direction = lrc + "_" + fbc
-                                        
-                                    cd = random.sample(cd_pop[objs[l]][objs[o]],1)[0]
-                                    node[l].add(node[o],direction,cd)
-                                    print("QSR:",o,l,direction,cd)
-
-                            ii = ii + 1
-                            scene = table.place_objects(i+1)
-                            scenes.append(scene)
-                            i = i + 1
-                            ii = num_of_trials_per_scene
-
-                            print("=========================================")
-                            print(i," scene generated")
-                            print("=========================================")
-                            
-                            print("Press 'Enter' to continue")
-                            input()
-                            remove_objects(objs)
-                        except PlacementException as e:
-                            remove_objects(objs)
-                            print('Warning:',e.msg,'could not be placed -> retry generation')
-                            pass
-                        except:
-                            print("Unexpected error:", sys.exc_info()[0])
-                            raise
-
-
-        # Generate QSR labelszzzzzz
-        for s in scenes:
-            scn = s[1]
-            cam_pos = scn['camera_position']
-            scn_qsr = dict()
-            for o1 in scn['objects']:
-                obj_qsr = dict()
-                for o2 in scn['objects']:
-                    if o1 != o2:
-                        pos1 = scn['position'][o1]
-                        pos2 = scn['position'][o2]
-                        #print(o1,o2)
-                        obj_qsr[o2] = qsr.calc_QSR(cam_pos,pos1,pos2)
-                        
-                scn_qsr[o1] = obj_qsr
-            scn['qsr']  = scn_qsr 
-        
-        with open(args[1], "w") as outfile:
-            outfile.write(json.dumps(scenes, outfile, indent=2))
+        if batch:
+            try:
+                i = resume_batch(args[1])
+            except ValueError as err:
+                raise Usage(str(err))
+            if i > 0:
+                print('Resuming after scene', i)
+                with open(args[1]) as scn_file:
+                    for line in scn_file:
+                        scn = json.loads(line)[1]
+                        if convergence is not None:
+                            convergence.add_scene(scn)
+                        if index is not None:
+                            index.add(qsr_signature(scn))
+            outfile = open(args[1], 'a')
+
+        def converged(scene):
+            convergence.add_scene(scene[1])
+            return convergence.converged(threshold)
+
+        def distinct(scene):
+            if 'qsr' not in scene[1]:
+                scene[1]['qsr'] = label_scene(scene[1])
+            return index.add_if_distinct(qsr_signature(scene[1]))
+
+        check = None
+        if index is not None:
+            check = distinct
+
+        def accept(scene):
+            if (batch or convergence is not None) and 'qsr' not in scene[1]:
+                scene[1]['qsr'] = label_scene(scene[1])
+            if batch:
+                write_scene(outfile, scene)
+            else:
+                scenes.append(scene)
+
+            print("=========================================")
+            print(scene[0][len('scene'):]," scene generated")
+            print("=========================================")
+            stats.stream(stats_file)
+
+            if not batch:
+                print("Press 'Enter' to continue")
+                input()
+
+        try:
+            if convergence is not None and convergence.converged(threshold):
+                pass
+            elif workers:
+                generate_parallel(workers, args[0], cache.path, cache.model,
+                                  seed, i+1, num_of_scenes, outfile, stats_file,
+                                  converged if convergence is not None else None,
+                                  check)
+            else:
+                generator = SceneGenerator(model, seed=seed)
+                with generator.connection:
+                    while i < num_of_scenes:
+                        scene = generator.generate(i+1, accept, check=check)
+                        i = i + 1
+                        if convergence is not None and converged(scene):
+                            break
+        except RejectionException as e:
+            print('Warning:', e.msg, '-> the diversity cannot be met, stop')
+
+        if batch:
+            outfile.close()
+        else:
+            # Generate QSR labels (unless done already, e.g. for --converge)
+            unlabeled = [s[1] for s in scenes if 'qsr' not in s[1]]
+            if unlabeled:
+                for scn, scn_qsr in zip(unlabeled, label_scenes(unlabeled)):
+                    scn['qsr'] = scn_qsr
+
+            with open(args[1], "w") as outfile:
+                outfile.write(json.dumps(scenes, indent=2))
+
+        print('STATISTICS')
+        print(json.dumps(stats.report(), indent=2, sort_keys=True))
+        if index is not None:
+            print('DIVERSITY')
+            print(json.dumps(index.report(), indent=2, sort_keys=True))
+        if convergence is not None:
+            print('CONVERGENCE')
+            print(json.dumps(convergence.report(threshold), indent=2,
+                             sort_keys=True))
+        if stats_file is not None:
+            stats.stream(stats_file, True)
+            stats_file.close()
 
     except Usage as err:
         print(err.msg)
@@ -3,7 +3,6 @@
 Simple API for placing objects on tables according to directional spatial
 relations.
 """
-import pymorse
 import sys
 import random
 import json
@@ -14,6 +13,9 @@ import getopt
 from operator import itemgetter
 import qsr
 import os
+from simulation import set_object_poses, Connection, obj_name
+from geometry import transform_points, quaternion_multiply
+from scene_archive import open_scenes
 
 
 from contextlib import contextmanager
@@ -28,20 +30,19 @@ def ignored(*exceptions):
 
             
 def remove_objects(objs):
-    for o in objs:
-        morse.rpc('simulation','set_object_pose', o, str([0,0,0]),str([1,0,0,0]))
+    set_object_poses(morse, [(o, [0,0,0], [1,0,0,0]) for o in objs])
 
-def quaternion_multiply(q1, q2):
-    return [q1[0]*q2[0] - q1[1]*q2[1] - q1[2]*q2[2] - q1[3]*q2[3],
-            q1[0]*q2[1] + q1[1]*q2[0] + q1[2]*q2[3] - q1[3]*q2[2],
-            q1[0]*q2[2] - q1[1]*q2[3] + q1[2]*q2[0] + q1[3]*q2[1],
-            q1[0]*q2[3] + q1[1]*q2[2] - q1[2]*q2[1] + q1[3]*q2[0]] 
+# Objects whose positions (and orientations) differ by less than this in two
+# scenes are not moved when switching between them
+POSE_TOLERANCE = 1e-4
 
-        
-def load_scene(scn, target, offset=0):
+def get_target_pose(target):
+    return json.loads(morse.rpc('simulation','get_object_pose', target))
 
-    target_pose = json.loads(morse.rpc('simulation','get_object_pose',
-                                       target))
+def scene_poses(scn, target_pose, offset=0):
+    """ Returns the poses (name, position, orientation) of the objects of a
+    scene placed on an object with the given pose.
+    """
     target_pos = target_pose[0]
     target_ori =  target_pose[1]
 
@@ -49,32 +50,69 @@ def load_scene(scn, target, offset=0):
     table_pos = scn['position']['table']
     #table_ori = scn['orientation']['table'] 
 
-    for o in scn['objects']:
-
-        obj_pos = scn['position'][o]
+    # positions relative to the table in the frame of the target, all at once
+    objs = scn['objects']
+    points = numpy.reshape([scn['position'][o] for o in objs], (-1, 3))
+    positions = transform_points(target_pos, target_ori, points - table_pos)
+    orientations = quaternion_multiply(
+        target_ori, numpy.reshape([scn['orientation'][o] for o in objs], (-1, 4)))
 
-        x = float(obj_pos[0]) - float(table_pos[0])
-        y = float(obj_pos[1]) - float(table_pos[1])
-        z = float(obj_pos[2]) - float(table_pos[2])
+    return [(obj_name(o,offset), pos, new_orientation)
+            for o, pos, new_orientation in zip(objs, positions.tolist(),
+                                               orientations.tolist())]
 
-        pos =  morse.rpc('simulation','transform_to_obj_frame', target, str([x,y,z]))
-
-        orientation = scn['orientation'][o]
-
-        new_orientation = quaternion_multiply(target_ori,orientation)
+def set_landmark_pose(scn, poses, offset=0):
+    """ Sets the pose of the monitor of a scene on the parameter server.
+    """
+    for o, [name, pos, new_orientation] in zip(scn['objects'], poses):
 
         if (o == 'monitor'):
             cmd = 'rosparam set /qsr_landmark/id%i/pose "[%f, %f, %f, %f, %f, %f, %f]"' % (offset+1, float(pos[0] + 1.35), float(pos[1]) - 0.65, float(pos[2]), float(new_orientation[0]), float(new_orientation[1]), float(new_orientation[2]), float(new_orientation[3]))
             print('Run:', cmd)
             os.system(cmd)
 
-        
-        # set pose
-        morse.rpc('simulation','set_object_pose',obj_name(o,offset), str(pos), str(new_orientation))
+def load_scene(scn, target, offset=0):
+
+    poses = scene_poses(scn, get_target_pose(target), offset)
+    set_landmark_pose(scn, poses, offset)
 
+    # set all poses at once
+    set_object_poses(morse, poses)
 
     return scn['objects']
 
+def pose_changes(current, poses):
+    """ Returns the poses that differ from the current poses (name ->
+    (position, orientation)) and the parking poses of the current objects
+    that are not in poses.
+    """
+    changes = list()
+    for [name, pos, ori] in poses:
+        if name in current and \
+           numpy.allclose(current[name][0], pos, rtol=0, atol=POSE_TOLERANCE) and \
+           numpy.allclose(current[name][1], ori, rtol=0, atol=POSE_TOLERANCE):
+            continue
+        changes.append((name, pos, ori))
+    names = set(name for [name, pos, ori] in poses)
+    changes.extend((name, [0,0,0], [1,0,0,0]) for name in current
+                   if name not in names)
+    return changes
+
+def switch_scene(current, scn, target, offset=0):
+    """ Replaces the loaded scene current by scn. Only the objects that
+    move are set, in one batch. Returns the number of moved objects.
+    """
+    target_pose = get_target_pose(target)
+    current_poses = dict((name, (pos, ori)) for [name, pos, ori]
+                         in scene_poses(current, target_pose, offset))
+    poses = scene_poses(scn, target_pose, offset)
+    changes = pose_changes(current_poses, poses)
+
+    set_landmark_pose(scn, poses, offset)
+    set_object_poses(morse, changes)
+
+    return len(changes)
+
 def delete_scene(scn,offset):
 
     objs = list()
@@ -86,27 +124,6 @@ def delete_scene(scn,offset):
 
     
 
-def obj_name(obj, offset):
-
-    SET_SIZE = 7
-    
-    part = obj.split('.')
-
-    if len(part)==1:
-        postfix = SET_SIZE * offset
-        if postfix == 0:
-            return part[0]
-        
-    else:
-        postfix = SET_SIZE * offset + int(part[1])
-
-    if (postfix < 10):
-        return part[0] + '.00' + str(postfix) 
-    else:
-        return part[0] + '.0' + str(postfix)
-    
-            
-    
 class Usage(Exception):
     def __init__(self, msg):
         self.msg = msg
@@ -114,10 +131,13 @@ class Usage(Exception):
 def help_msg():
     return """
   Usage: scene_loader.py [-h] add|del <scences_file> <scene_number> <set_of_obj_models> <target_plane>
+         scene_loader.py [-h] switch <scences_file> <scene_number> <target_plane> <next_scene_number>
 
     add|del            add or delete a scene
-    scenes_file        file that contains all scenes
-    scene_number       scene that is added or deleted
+    switch             replace the loaded scene by the next one, only the
+                       objects that move are set
+    scenes_file        file, archive or store with all scenes
+    scene_number       scene that is added or deleted (or loaded)
     sef_of_obj_models  set of blender object models
     target_plane       object on which the scene is generated
 
@@ -139,38 +159,41 @@ if __name__ == "__main__":
         if ('-h','') in opts or ('--help', '') in opts:
             raise Usage(help_msg())
 
-        with open(args[1]) as scn_file:    
-            scenes = json.load(scn_file)
+        scenes = open_scenes(args[1])
 
-            with ignored(IOError):
-                    
-                with pymorse.Morse() as morse:
+        with ignored(IOError):
+                
+            with Connection() as morse:
 
-                    if args[0] == 'add':
-                        
-                        
-                        load_scene(scenes[int(args[2])][1], args[3], int(0))
-                        #load_scene(scenes[int(args[4])][1], args[5], int(1))
-                        #load_scene(scenes[int(args[6])][1], args[7], int(2))
+                if args[0] == 'add':
+                    
+                    
+                    load_scene(scenes[int(args[2])][1], args[3], int(0))
+                    #load_scene(scenes[int(args[4])][1], args[5], int(1))
+                    #load_scene(scenes[int(args[6])][1], args[7], int(2))
 
-                        input('Please press any key to continue.')
+                    input('Please press any key to continue.')
 
-                        #delete from parameter server
-                        for i in range(1,4):
-                            cmd = 'rosparam delete /qsr_landmark/id%i/pose' % (i)
-                            print('Run:', cmd)
-                            os.system(cmd)
-                        
-                        delete_scene(scenes[int(args[2])][1],int(0))
-                        #delete_scene(scenes[int(args[4])][1],int(1))
-                        #delete_scene(scenes[int(args[6])][1],int(2))
+                    #delete from parameter server
+                    for i in range(1,4):
+                        cmd = 'rosparam delete /qsr_landmark/id%i/pose' % (i)
+                        print('Run:', cmd)
+                        os.system(cmd)
+                    
+                    delete_scene(scenes[int(args[2])][1],int(0))
+                    #delete_scene(scenes[int(args[4])][1],int(1))
+                    #delete_scene(scenes[int(args[6])][1],int(2))
+                    
+                elif args[0] == 'del':
+                    delete_scene(scenes[int(args[2])][1],int(args[3]))
+                elif args[0] == 'switch':
+                    n = switch_scene(scenes[int(args[2])][1],
+                                     scenes[int(args[4])][1], args[3], int(0))
+                    print('Moved', n, 'object(s).')
+                else:
+                    raise Usage('use either add, del or switch')
+                #remove_objects(objs)
                         
-                    elif args[0] == 'del':
-                        delete_scene(scenes[int(args[2])][1],int(args[3]))
-                    else:
-                        raise Usage('use either add or del')
-                    #remove_objects(objs)
-                            
     except Usage as err:
         print(err.msg)
         print("for help use --help")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Inverted index for querying scene data sets by qualitative relation.
+
+Every QSR label between a landmark and an object, e.g. a cup that is
+['front', 'left', 'close'] of a monitor, is indexed under its types and
+every combination of its relations (Monitor:Cup:front, Monitor:Cup:left,
+Monitor:Cup:close_left, ...). A term lists the relations that must hold
+together for one pair of objects; a query is a conjunction of terms, e.g.
+
+  scene_query.py query scenes.index Monitor:Cup:close_left Monitor:Mouse:right
+
+returns the scenes with a cup left of and close to a monitor and a mouse
+right of a monitor.
+"""
+import sys
+import time
+import getopt
+import itertools
+import numpy
+
+from scene_archive import open_scenes
+
+# Scenes without labels that are labeled in one batch (see scene_labels)
+LABEL_BATCH_SIZE = 10000
+
+
+def relation_keys(type1, type2, rel):
+    """ Returns the index keys of a QSR label rel between an object of type1
+    and one of type2.
+    """
+    keys = list()
+    for n in range(1, len(rel) + 1):
+        for comb in itertools.combinations(sorted(rel), n):
+            keys.append('%s:%s:%s' % (type1, type2, '_'.join(comb)))
+    return keys
+
+def parse_term(term):
+    """ Normalizes a term <landmark type>:<object type>:<relation>[_...],
+    e.g. Monitor:Cup:left_close -> Monitor:Cup:close_left.
+    """
+    part = term.split(':')
+    if len(part) != 3 or not part[2]:
+        raise ValueError('malformed term: ' + term)
+    return '%s:%s:%s' % (part[0], part[1], '_'.join(sorted(part[2].split('_'))))
+
+def scene_labels(scenes):
+    """ Yields the scene ids with the (type1, type2, QSR label) triples of
+    each scene. Scenes without labels, e.g. of a store, are labeled in
+    batches of LABEL_BATCH_SIZE scenes.
+    """
+    if hasattr(scenes, 'calc_QSR'):
+        # columnar store: label all pairs at once
+        import qsr
+        [obj1, obj2, scns] = scenes.pairs()
+        [part, close] = scenes.calc_QSR()
+        triples = [list() for s in range(len(scenes))]
+        for k in range(len(scns)):
+            triples[scns[k]].append((str(scenes.types[obj1[k]]),
+                                     str(scenes.types[obj2[k]]),
+                                     qsr.qsr_list(part[k], close[k])))
+        for s in range(len(scenes)):
+            yield [str(scenes.scenes[s]), triples[s]]
+        return
+
+    from scene_generator import label_scenes
+    scenes = iter(scenes)
+    while True:
+        chunk = list(itertools.islice(scenes, LABEL_BATCH_SIZE))
+        if not chunk:
+            return
+        unlabeled = [scn for [scene_id, scn] in chunk if 'qsr' not in scn]
+        for scn, scn_qsr in zip(unlabeled, label_scenes(unlabeled)):
+            scn['qsr'] = scn_qsr
+        for [scene_id, scn] in chunk:
+            yield [scene_id, [(scn['type'][o1], scn['type'][o2], rel)
+                              for o1 in scn['qsr']
+                              for o2, rel in scn['qsr'][o1].items()]]
+
+
+class RelationIndex():
+    """ Posting lists (sorted arrays of scene numbers) per relation key.
+    """
+    def __init__(self, ids, postings):
+        self.ids = ids
+        self.postings = postings
+
+    @classmethod
+    def build(cls, scenes):
+        ids = list()
+        postings = dict()
+        for [scene_id, triples] in scene_labels(scenes):
+            keys = set()
+            for [type1, type2, rel] in triples:
+                keys.update(relation_keys(type1, type2, rel))
+            for key in keys:
+                postings.setdefault(key, list()).append(len(ids))
+            ids.append(scene_id)
+        return cls(numpy.array(ids, dtype=str),
+                   dict((k, numpy.array(v, dtype=numpy.int32))
+                        for k, v in postings.items()))
+
+    def save(self, filename):
+        with open(filename, 'wb') as index_file:
+            numpy.savez(index_file, __ids__=self.ids, **self.postings)
+
+    @classmethod
+    def load(cls, filename):
+        """ Reads a saved index.
+        """
+        with numpy.load(filename) as data:
+            return cls(data['__ids__'],
+                       dict((k, data[k]) for k in data.files if k != '__ids__'))
+
+    def lookup(self, term):
+        key = parse_term(term)
+        if key not in self.postings:
+            return numpy.zeros(0, dtype=numpy.int32)
+        return self.postings[key]
+
+    def query(self, terms):
+        """ Returns the ids of the scenes that match all terms (an array).
+        """
+        lists = sorted([self.lookup(t) for t in terms], key=len)
+        if not lists:
+            return self.ids[:0]
+        result = lists[0]
+        for l in lists[1:]:
+            result = numpy.intersect1d(result, l, assume_unique=True)
+        return self.ids[result]
+
+    def keys(self):
+        return list(self.postings)
+
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def help_msg():
+    return """
+  Usage: scene_query.py [-h] [--count] build|query|keys <file> ...
+
+    build <scenes_file> <index_file>
+                       indexes the scenes of a file, archive or store
+    query <index_file> <term> [<term> ...]
+                       prints the ids of the scenes that match all terms
+    keys <index_file>  prints the indexed keys and their number of scenes
+
+    term               <landmark type>:<object type>:<relation>[_<relation>...]
+                       e.g. Monitor:Cup:left_close, relations are one of
+                       front, behind, left, right, close, distant
+
+    --count            only print the number of matching scenes
+
+    -h, --help for seeing this msg
+"""
+
+if __name__ == "__main__":
+    argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "h", ["help", "count"])
+        except getopt.error as msg:
+            raise Usage(msg)
+
+        if ('-h','') in opts or ('--help', '') in opts or len(args) < 2:
+            raise Usage(help_msg())
+
+        if args[0] == 'build' and len(args) == 3:
+            start = time.perf_counter()
+            index = RelationIndex.build(open_scenes(args[1]))
+            index.save(args[2])
+            print("Done. Indexed", len(index.ids), "scene(s) under",
+                  len(index.postings), "keys in %.1f s." %
+                  (time.perf_counter() - start))
+        elif args[0] == 'query' and len(args) > 2:
+            index = RelationIndex.load(args[1])
+            start = time.perf_counter()
+            try:
+                ids = index.query(args[2:])
+            except ValueError as err:
+                raise Usage(str(err))
+            elapsed = time.perf_counter() - start
+            if ('--count', '') not in opts:
+                for i in ids:
+                    print(i)
+            print(len(ids), "scene(s) in %.2f ms" % (elapsed * 1000),
+                  file=sys.stderr)
+        elif args[0] == 'keys':
+            index = RelationIndex.load(args[1])
+            for key in sorted(index.keys()):
+                print(key, len(index.postings[key]))
+        else:
+            raise Usage(help_msg())
+
+    except Usage as err:
+        print(err.msg)
+        print("for help use --help")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Columnar scene store for analysing data sets with NumPy.
+
+A store is a directory of .npy files that can be opened memory-mapped. The
+objects of all scenes are stored row by row, the rows of scene i are
+offsets[i]:offsets[i+1]:
+
+  positions.npy       N x 3     positions of the objects
+  orientations.npy    N x 4     orientations (quaternions w, x, y, z)
+  bboxes.npy          N x 8 x 3 corners of the global bounding boxes
+  objects.npy         N         object names
+  types.npy           N         object types
+  listed.npy          N         whether an object is in the scene's 'objects'
+                                (False for the supporting object)
+  offsets.npy         S + 1     first row of each scene
+  scenes.npy          S         scene ids
+  cameras.npy         S x 3     camera positions
+  supports.npy        S         supporting objects
+
+The script converts scenes files and archives into stores.
+"""
+import os
+import sys
+import json
+import getopt
+import operator
+import numpy
+
+import qsr
+
+# Version of the store format, bump when it changes
+VERSION = 1
+
+VERSION_FILE = 'version.json'
+
+OBJECT_COLUMNS = ['positions', 'orientations', 'bboxes', 'objects', 'types',
+                  'listed']
+SCENE_COLUMNS = ['offsets', 'scenes', 'cameras', 'supports']
+
+
+def is_store(filename):
+    return os.path.isfile(os.path.join(filename, VERSION_FILE))
+
+def write_store(scenes, path):
+    """ Writes scenes ["sceneN", {...}] to a new store. QSR labels are not
+    stored, see calc_QSR(). Returns the number of scenes.
+    """
+    cols = dict((c, list()) for c in OBJECT_COLUMNS + SCENE_COLUMNS)
+    cols['offsets'].append(0)
+    for [scene_id, scn] in scenes:
+        objs = list(scn['objects'])
+        objs += [o for o in scn['position'] if o not in scn['objects']]
+        for o in objs:
+            cols['positions'].append(scn['position'][o])
+            cols['orientations'].append(scn['orientation'][o])
+            cols['bboxes'].append(scn['bbox'][o])
+            cols['objects'].append(o)
+            cols['types'].append(scn['type'][o])
+            cols['listed'].append(o in scn['objects'])
+        cols['offsets'].append(cols['offsets'][-1] + len(objs))
+        cols['scenes'].append(scene_id)
+        cols['cameras'].append(scn.get('camera_position',
+                                       [numpy.nan, numpy.nan, numpy.nan]))
+        cols['supports'].append(scn.get('supporting_object', ''))
+
+    shapes = {'positions': (-1, 3), 'orientations': (-1, 4),
+              'bboxes': (-1, 8, 3), 'cameras': (-1, 3)}
+    os.makedirs(path, exist_ok=True)
+    for c, values in cols.items():
+        if c in shapes:
+            data = numpy.reshape(numpy.array(values, dtype=float), shapes[c])
+        elif c == 'listed':
+            data = numpy.array(values, dtype=bool)
+        elif c == 'offsets':
+            data = numpy.array(values, dtype=numpy.int64)
+        else:
+            data = numpy.array(values, dtype=str)
+        numpy.save(os.path.join(path, c + '.npy'), data)
+    # written last, a store without it is incomplete
+    with open(os.path.join(path, VERSION_FILE), 'w') as version_file:
+        json.dump({'version': VERSION}, version_file)
+    return len(cols['scenes'])
+
+
+class SceneStore():
+    """ The columns of a store as (memory-mapped) arrays, e.g.
+    store.positions[store.rows(i)] are the positions of the objects of
+    scene i without a copy. Like a list of scenes, store[i] (or
+    store['sceneN']) returns a scene ["sceneN", {...}].
+    """
+    def __init__(self, path, mmap_mode='r'):
+        with open(os.path.join(path, VERSION_FILE)) as version_file:
+            version = json.load(version_file)['version']
+        if version != VERSION:
+            raise ValueError('unsupported store version: %s' % version)
+        for c in OBJECT_COLUMNS + SCENE_COLUMNS:
+            setattr(self, c, numpy.load(os.path.join(path, c + '.npy'),
+                                        mmap_mode=mmap_mode))
+        self.ids = None
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def rows(self, i):
+        """ Returns the slice of the rows of scene i.
+        """
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def index(self, scene_id):
+        if self.ids is None:
+            self.ids = dict((str(s), i) for i, s in enumerate(self.scenes))
+        return self.ids[scene_id]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            i = self.index(key)
+        else:
+            i = operator.index(key)
+            if i < 0:
+                i = i + len(self)
+            if not 0 <= i < len(self):
+                raise IndexError('scene index out of range')
+        rows = self.rows(i)
+        objs = [str(o) for o in self.objects[rows]]
+        scn = {'supporting_object': str(self.supports[i]),
+               'camera_position': self.cameras[i].tolist(),
+               'objects': [o for o, l in zip(objs, self.listed[rows]) if l]}
+        for [key, col] in [['type', self.types], ['position', self.positions],
+                           ['orientation', self.orientations],
+                           ['bbox', self.bboxes]]:
+            values = col[rows].tolist()
+            scn[key] = dict(zip(objs, values))
+        return [str(self.scenes[i]), scn]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def pairs(self):
+        """ Returns the rows (obj1, obj2) of all ordered pairs of different
+        listed objects of the same scene, and the scenes of the pairs.
+        """
+        counts = numpy.diff(self.offsets)
+        scns = numpy.repeat(numpy.arange(len(counts)), counts * counts)
+        # position of every pair within its scene's counts x counts block
+        start = numpy.repeat(numpy.cumsum(counts * counts) - counts * counts,
+                             counts * counts)
+        k = numpy.arange(len(scns)) - start
+        obj1 = self.offsets[scns] + k // counts[scns]
+        obj2 = self.offsets[scns] + k % counts[scns]
+        keep = (obj1 != obj2) & self.listed[obj1] & self.listed[obj2]
+        return [obj1[keep], obj2[keep], scns[keep]]
+
+    def calc_QSR(self):
+        """ Calculates the QSR labels of all pairs() in one batch, see
+        qsr.calc_QSR_batch().
+        """
+        [obj1, obj2, scns] = self.pairs()
+        return qsr.calc_QSR_batch(self.cameras[scns], self.positions[obj1],
+                                  self.positions[obj2])
+
+
+class Usage(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+
+def help_msg():
+    return """
+  Usage: scene_store.py [-h] <scenes_file> <store>
+
+    scenes_file        scenes (file or archive) to be converted
+    store              directory of the store to be written
+
+    -h, --help for seeing this msg
+"""
+
+if __name__ == "__main__":
+    argv = sys.argv
+    try:
+        try:
+            opts, args = getopt.getopt(argv[1:], "h", ["help"])
+        except getopt.error as msg:
+            raise Usage(msg)
+
+        if ('-h','') in opts or ('--help', '') in opts or len(args) != 2:
+            raise Usage(help_msg())
+
+        from scene_archive import open_scenes
+        n = write_store(open_scenes(args[0]), args[1])
+        print("Done. Stored", n, "scene(s).")
+
+    except Usage as err:
+        print(err.msg)
+        print("for help use --help")
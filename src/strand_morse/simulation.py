@@ -0,0 +1,278 @@
+"""
+A long-lived connection to MORSE, helpers for calling services of the
+'simulation' component for many objects at once, and a persistent cache of
+object bounding boxes and types.
+"""
+import os
+import json
+import time
+import fcntl
+
+try:
+    import pymorse
+except ImportError:
+    # only needed to connect to a simulator, e.g. not for the benchmarks
+    pymorse = None
+
+from contextlib import contextmanager
+
+@contextmanager
+def ignored(*exceptions):
+    try:
+        yield
+    except exceptions:
+        pass
+
+
+# Number of reconnects before a lost connection is reported to the caller
+NUM_OF_RECONNECTS = 3
+
+# Seconds to wait before reconnecting
+RECONNECT_DELAY = 1.0
+
+class Connection():
+    """ A long-lived connection to a MORSE simulator that can be used in
+    place of a pymorse.Morse client. The connection is opened on the first
+    call and kept open across calls, as setting up a pymorse client (socket,
+    handshake and its asyncore thread) costs far more than a service call.
+    If the connection is lost, the call is retried on a new connection.
+
+    Only use it for services that can safely be called twice, e.g. the
+    getters and set_object_pose of the 'simulation' component.
+
+    The number of calls and the seconds spent per service are accumulated
+    in calls (service -> [calls, seconds]). If given, factory is called
+    instead of pymorse.Morse to open a connection, e.g. to use a stand-in
+    for the simulator.
+    """
+    def __init__(self, host='localhost', port=4000, calls=None, factory=None):
+        self.host = host
+        self.port = port
+        self.morse = None
+        self.calls = dict() if calls is None else calls
+        self.factory = factory
+
+    def connect(self):
+        if self.morse is None:
+            if self.factory is not None:
+                self.morse = self.factory()
+            elif pymorse is None:
+                raise ImportError('pymorse is needed to connect to MORSE')
+            else:
+                self.morse = pymorse.Morse(self.host, self.port)
+        return self.morse
+
+    def reset(self):
+        """ Closes the connection, the next call opens a new one.
+        """
+        if self.morse is not None:
+            with ignored(Exception):
+                self.morse.close()
+            self.morse = None
+
+    close = reset
+
+    def retry(self, call):
+        """ Returns call(client), retried on a new connection if the
+        connection is lost.
+        """
+        for i in range(NUM_OF_RECONNECTS):
+            try:
+                return call(self.connect())
+            except IOError:
+                print('Warning: lost connection to %s:%i -> reconnect'
+                      % (self.host, self.port))
+                self.reset()
+                time.sleep(RECONNECT_DELAY)
+        return call(self.connect())
+
+    def record(self, method, num_of_calls, seconds):
+        counts = self.calls.setdefault(method, [0, 0.0])
+        counts[0] = counts[0] + num_of_calls
+        counts[1] = counts[1] + seconds
+
+    def rpc(self, *args):
+        start = time.perf_counter()
+        result = self.retry(lambda morse: morse.rpc(*args))
+        self.record(args[1], 1, time.perf_counter() - start)
+        return result
+
+    def rpc_many(self, method, args_list):
+        """ See rpc_many(). A lost connection repeats the whole batch.
+        """
+        start = time.perf_counter()
+        results = self.retry(lambda morse: rpc_many(morse, method, args_list))
+        self.record(method, len(args_list), time.perf_counter() - start)
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def obj_name(obj, offset):
+    """ Returns the name of an object in the object set with the given
+    offset. Every set holds SET_SIZE instances of each object, e.g. with
+    offset 1 'cup' becomes 'cup.007' and 'cup.002' becomes 'cup.009'.
+    """
+    SET_SIZE = 7
+    
+    part = obj.split('.')
+
+    if len(part)==1:
+        postfix = SET_SIZE * offset
+        if postfix == 0:
+            return part[0]
+        
+    else:
+        postfix = SET_SIZE * offset + int(part[1])
+
+    if (postfix < 10):
+        return part[0] + '.00' + str(postfix) 
+    else:
+        return part[0] + '.0' + str(postfix)
+
+def pipelined(morse):
+    """ Returns whether a client can have several requests in flight, as
+    pymorse.Morse with its executor.
+    """
+    return all(hasattr(morse, a) for a in ['executor', '_rpc_request',
+                                           '_rpc_process'])
+
+def rpc_many(morse, method, args_list):
+    """ Calls a service of the 'simulation' component once for every entry of
+    args_list and returns the results in the same order.
+
+    With a pymorse client all requests are sent before the first reply is
+    awaited, as pymorse' component services do. The batch then costs a
+    single round trip instead of one per request. Other clients are called
+    one request at a time with rpc.
+    """
+    if hasattr(morse, 'rpc_many'):
+        return morse.rpc_many(method, args_list)
+    if pipelined(morse):
+        futures = [morse.executor.submit(morse._rpc_process,
+                                         morse._rpc_request('simulation',
+                                                            method, *args))
+                   for args in args_list]
+        return [f.result() for f in futures]
+    return [morse.rpc('simulation', method, *args) for args in args_list]
+
+def set_object_poses(morse, poses):
+    """ Sets the poses of several objects. poses is a list of
+    (name, position, orientation) tuples.
+    """
+    rpc_many(morse, 'set_object_pose',
+             [(name, str([float(v) for v in pos]), str([float(v) for v in ori]))
+              for name, pos, ori in poses])
+
+def get_object_bboxes(morse, names):
+    """ Returns a dict with the local bounding boxes of the given objects.
+    """
+    bboxes = rpc_many(morse, 'get_object_bbox', [(n,) for n in names])
+    return dict(zip(names, [json.loads(b) for b in bboxes]))
+
+
+# Default location of the on-disk model cache
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'strands_morse',
+                          'models.json')
+
+class ModelCache():
+    """ Persistent cache of the local bounding boxes and types of objects.
+    Neither value changes for a given blend asset and object name, so each
+    object is only queried once from MORSE; after that it is read from the
+    cache file.
+
+    Objects are stored per model, i.e. per blend asset or environment the
+    simulation is started with. Nothing in the simulation identifies it, so
+    the model has to be named by the caller; without a model the objects
+    are only cached in memory. The cache has to be invalidated explicitly
+    (invalidate or clear) when an asset changes.
+    """
+    def __init__(self, path=CACHE_FILE, model=None):
+        self.path = path
+        self.model = model
+        self.models = dict()
+        if model is not None:
+            with ignored(IOError, ValueError):
+                with open(self.path) as cache_file:
+                    self.models = json.load(cache_file)
+        self.objects = self.models.setdefault(model, dict())
+        # removed since the last save, see save()
+        self.removed = set()
+        self.cleared = False
+
+    def save(self):
+        """ Writes the cached objects to the cache file. Several processes
+        may share the file (e.g. the workers of a parallel generation), so
+        the file is read again under a lock and the objects of the other
+        processes are kept.
+        """
+        if self.model is None:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        with open(self.path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            models = dict()
+            with ignored(IOError, ValueError):
+                with open(self.path) as cache_file:
+                    models = json.load(cache_file)
+            objects = models.setdefault(self.model, dict())
+            if self.cleared:
+                objects.clear()
+            for n in self.removed:
+                objects.pop(n, None)
+            objects.update(self.objects)
+            tmp_path = '%s.%i.tmp' % (self.path, os.getpid())
+            with open(tmp_path, 'w') as cache_file:
+                json.dump(models, cache_file)
+            os.replace(tmp_path, self.path)
+        self.removed = set()
+        self.cleared = False
+        self.objects.update(objects)
+        models[self.model] = self.objects
+        self.models = models
+
+    def invalidate(self, names):
+        """ Removes the given objects from the cache.
+        """
+        for n in names:
+            self.objects.pop(n, None)
+            self.removed.add(n)
+        self.save()
+
+    def clear(self):
+        """ Removes all objects of the model from the cache.
+        """
+        self.objects.clear()
+        self.cleared = True
+        self.save()
+
+    def prefetch(self, morse, names):
+        """ Fetches the bounding boxes and types of all objects that are not
+        cached yet in one batch.
+        """
+        missing = [n for n in set(names) if n not in self.objects]
+        if not missing:
+            return
+        bboxes = get_object_bboxes(morse, missing)
+        types = rpc_many(morse, 'get_object_type', [(n,) for n in missing])
+        for n, t in zip(missing, types):
+            self.objects[n] = {'bbox': bboxes[n], 'type': json.loads(t)}
+        self.save()
+
+    def get_bbox(self, morse, name):
+        """ Returns the local bounding box of an object.
+        """
+        self.prefetch(morse, [name])
+        return self.objects[name]['bbox']
+
+    def get_type(self, morse, name):
+        """ Returns the type of an object.
+        """
+        self.prefetch(morse, [name])
+        return self.objects[name]['type']
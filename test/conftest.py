@@ -0,0 +1,81 @@
+import os
+import sys
+
+# the scripts in src/strand_morse import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src', 'strand_morse'))
+
+import random
+import pytest
+
+import scene_generator
+from compiled_model import CompiledModel
+from benchmark import FakeSimulation, fake_world, synthetic_model, box
+from simulation import Connection, ModelCache
+
+
+def random_scene(rnd, no, num_of_objects):
+    """ Returns a scene ["sceneN", {...}] with random poses of up to
+    num_of_objects objects on a table, as written by scene_generator.
+    """
+    types = ['Monitor', 'Keyboard', 'Mouse', 'Cup', 'PC', 'Laptop']
+    objs = dict()
+    for i in range(rnd.randint(0, num_of_objects)):
+        t = rnd.choice(types)
+        objs['%s.%03i' % (t.lower(), i)] = t
+    objs['table'] = 'Table'
+    scn = {'supporting_object': 'table',
+           'camera_position': [rnd.uniform(-1, 0), rnd.uniform(0, 2), 1.5],
+           'objects': [o for o in objs if o != 'table'],
+           'type': objs, 'position': dict(), 'orientation': dict(),
+           'bbox': dict()}
+    for o in objs:
+        [x, y] = [rnd.uniform(0, 1), rnd.uniform(0, 2)]
+        scn['position'][o] = [x, y, 0.8]
+        scn['orientation'][o] = [1.0, 0.0, 0.0, 0.0]
+        scn['bbox'][o] = [[x + dx, y + dy, z] for dx in [-0.05, 0.05]
+                          for dy in [-0.05, 0.05] for z in [0.75, 0.85]]
+    return ['scene%i' % no, scn]
+
+@pytest.fixture
+def scenes():
+    rnd = random.Random(0)
+    return [random_scene(rnd, no, 6) for no in range(1, 41)]
+
+@pytest.fixture
+def scene_world(scenes):
+    """ Returns a function that creates the objects of a fake simulation
+    (see benchmark.FakeSimulation) with a table at table_pose and all
+    objects of scenes parked at the origin.
+    """
+    def make(table_pose=None):
+        if table_pose is None:
+            table_pose = [[2.0, 1.0, 0.0], [1.0, 0.0, 0.0, 0.0]]
+        objects = {'table': {'type': 'Table', 'bbox': box([0.8, 1.6, 0.75]),
+                             'pose': table_pose}}
+        for [scene_id, scn] in scenes:
+            for o in scn['objects']:
+                objects[o] = {'type': scn['type'][o], 'bbox': box([0.1] * 3),
+                              'pose': [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0, 0.0]]}
+        return objects
+    return make
+
+@pytest.fixture
+def make_generator(monkeypatch):
+    """ Returns a function that creates a SceneGenerator with a synthetic
+    model against a fake simulation, or against a simulation opened by
+    factory.
+    """
+    def make(max_objects=2, seed=0, factory=None):
+        monkeypatch.setattr(scene_generator, 'cache', ModelCache())
+        monkeypatch.setattr(scene_generator, 'stats', scene_generator.Stats())
+        monkeypatch.setattr(scene_generator, 'morse', None)
+        if factory is None:
+            sim = FakeSimulation(fake_world(max_objects))
+            factory = lambda: sim
+        connection = Connection(calls=scene_generator.stats.rpc,
+                                factory=factory)
+        model = CompiledModel(synthetic_model(max_objects))
+        return scene_generator.SceneGenerator(model, seed=seed,
+                                              connection=connection)
+    return make
@@ -0,0 +1,57 @@
+import json
+import pytest
+
+from scene_generator import resume_batch, write_scene
+
+
+def scene(no):
+    return ['scene%i' % no, {'objects': ['cup'], 'type': {'cup': 'Cup'}}]
+
+def write(path, scenes, tail=''):
+    with open(path, 'w') as scn_file:
+        for s in scenes:
+            write_scene(scn_file, s)
+        scn_file.write(tail)
+
+
+def test_missing_file(tmp_path):
+    assert resume_batch(str(tmp_path / 'none.jsonl')) == 0
+
+def test_last_scene(tmp_path):
+    path = tmp_path / 'out.jsonl'
+    write(path, [scene(1), scene(2), scene(3)])
+    size = path.stat().st_size
+    assert resume_batch(str(path)) == 3
+    assert path.stat().st_size == size
+
+def test_truncates_cut_off_line(tmp_path):
+    path = tmp_path / 'out.jsonl'
+    write(path, [scene(1), scene(2)])
+    size = path.stat().st_size
+    write(path, [scene(1), scene(2)], json.dumps(scene(3))[:20])
+    assert resume_batch(str(path)) == 2
+    assert path.stat().st_size == size
+
+def test_completes_missing_newline(tmp_path):
+    path = tmp_path / 'out.jsonl'
+    write(path, [scene(1)], json.dumps(scene(2)))
+    assert resume_batch(str(path)) == 2
+    assert path.read_text().splitlines() == [json.dumps(scene(1)),
+                                             json.dumps(scene(2))]
+
+@pytest.mark.parametrize('content', [
+    # pretty printed list of scenes, the output without --batch
+    json.dumps([scene(1), scene(2)], indent=2),
+    # the same in one line
+    json.dumps([scene(1), scene(2)]) + '\n',
+    # lines that are JSON but no scenes
+    json.dumps(scene(1)) + '\n' + json.dumps({'scene': 2}) + '\n',
+    json.dumps(scene(1)) + '\n' + json.dumps(['table', {}]) + '\n',
+    json.dumps(scene(1)) + '\n\n',
+    'not json\n'])
+def test_keeps_other_files(tmp_path, content):
+    path = tmp_path / 'out.json'
+    path.write_text(content)
+    with pytest.raises(ValueError):
+        resume_batch(str(path))
+    assert path.read_text() == content
@@ -0,0 +1,58 @@
+import random
+import numpy
+import pytest
+
+from scene_generator import BBox, LinearIndex, GridIndex, bbox_bounds
+
+
+def random_bbox(rnd, size):
+    dx = rnd.uniform(0.02, 0.3)
+    dy = rnd.uniform(0.02, 0.3)
+    x = rnd.uniform(-size, size)
+    y = rnd.uniform(-size, size)
+    return BBox([[x + sx * dx, y + sy * dy, z]
+                 for sx in [-1, 1] for sy in [-1, 1] for z in [0.0, 0.1]])
+
+def random_bounds(rnd, size, n):
+    return numpy.array([bbox_bounds(random_bbox(rnd, size)) for i in range(n)])
+
+
+@pytest.mark.parametrize('min_objects', [0, 5, 1000])
+@pytest.mark.parametrize('seed', range(5))
+def test_grid_matches_linear_scan(min_objects, seed):
+    rnd = random.Random(seed)
+    linear = LinearIndex()
+    grid = GridIndex(min_objects=min_objects)
+    names = list()
+    for step in range(60):
+        if names and rnd.random() < 0.3:
+            name = names.pop(rnd.randrange(len(names)))
+            linear.remove(name)
+            grid.remove(name)
+        else:
+            name = 'obj%i' % step
+            bbox = random_bbox(rnd, 1.0)
+            linear.insert(name, bbox)
+            grid.insert(name, bbox)
+            names.append(name)
+        bounds = random_bounds(rnd, 1.2, 100)
+        assert len(grid) == len(linear) == len(names)
+        assert numpy.array_equal(grid.collisions(bounds),
+                                 linear.collisions(bounds))
+
+def test_touching_boxes_collide():
+    grid = GridIndex(min_objects=0)
+    grid.insert('a', BBox([[x, y, z] for x in [0.0, 0.1] for y in [0.0, 0.1]
+                           for z in [0.0, 0.1]]))
+    bounds = numpy.array([[0.1, 0.2, 0.05, 0.15],
+                          [0.1000001, 0.2, 0.05, 0.15],
+                          [-0.2, -0.05, -0.2, -0.05]])
+    assert grid.collisions(bounds).tolist() == [True, False, False]
+
+def test_empty():
+    grid = GridIndex(min_objects=0)
+    assert grid.collisions(numpy.zeros((0, 4))).tolist() == []
+    grid.insert('a', random_bbox(random.Random(0), 1.0))
+    grid.collisions(random_bounds(random.Random(1), 1.0, 3))
+    grid.remove('a')
+    assert not grid.collisions(random_bounds(random.Random(1), 1.0, 3)).any()
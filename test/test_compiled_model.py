@@ -0,0 +1,77 @@
+import json
+import random
+import pytest
+
+import compiled_model
+from compiled_model import AliasSampler, CompiledModel
+
+
+def distribution(sampler):
+    """ The exact probabilities of the values drawn by an alias sampler.
+    """
+    n = len(sampler.values)
+    probs = dict((v, 0.0) for v in sampler.values)
+    for i in range(n):
+        probs[sampler.values[i]] += sampler.prob[i] / n
+        probs[sampler.values[sampler.alias[i]]] += (1.0 - sampler.prob[i]) / n
+    return probs
+
+@pytest.mark.parametrize('weights', [
+    [1], [1, 1], [3, 2, 4, 1, 3, 4], [0, 5, 0, 1], [1, 6, 1, 1, 3, 1, 0, 1, 0],
+    [1000, 1, 1, 1], [0.1, 0.2, 0.7]])
+def test_alias_table(weights):
+    sampler = AliasSampler(range(len(weights)), weights)
+    probs = distribution(sampler)
+    for v, w in enumerate(weights):
+        assert probs[v] == pytest.approx(w / sum(weights))
+
+def test_frequencies():
+    weights = [3, 0, 1, 6]
+    sampler = AliasSampler('abcd', weights)
+    random.seed(0)
+    draws = [sampler.sample() for i in range(100000)]
+    for v, w in zip('abcd', weights):
+        assert draws.count(v) / len(draws) == pytest.approx(w / 10, abs=0.01)
+    assert 'b' not in draws
+
+def test_empty():
+    for sampler in [AliasSampler([], []), AliasSampler(['a', 'b'], [0, 0])]:
+        with pytest.raises(ValueError):
+            sampler.sample()
+
+def test_json():
+    sampler = AliasSampler(['close', 'distant'], [4, 1])
+    copy = AliasSampler.from_json(json.loads(json.dumps(sampler.to_json())))
+    random.seed(1)
+    draws = [sampler.sample() for i in range(100)]
+    random.seed(1)
+    assert [copy.sample() for i in range(100)] == draws
+
+
+MODEL = {'types': ['Monitor', 'Cup'],
+         'landmarks': ['Monitor'],
+         'presence': {'Monitor': [0, 1], 'Cup': [1, 2, 1]},
+         'anchors': {'Monitor': [1, 6, 1, 1, 3, 1, 0, 1, 0]},
+         'qsr': {'Monitor': {'Monitor': [0, 0, 0, 0, 0, 0],
+                             'Cup': [3, 2, 4, 1, 3, 4]}}}
+
+def test_compiled_model():
+    model = CompiledModel(MODEL)
+    assert distribution(model.presence['Cup']) == \
+        pytest.approx({0: 0.25, 1: 0.5, 2: 0.25})
+    # center is the rest of the close and distant counts
+    assert distribution(model.lrc['Monitor']['Cup']) == \
+        pytest.approx({'left': 3 / 7, 'right': 2 / 7, 'center': 2 / 7})
+    assert distribution(model.fbc['Monitor']['Cup']) == \
+        pytest.approx({'front': 4 / 7, 'back': 1 / 7, 'center': 2 / 7})
+    assert distribution(model.cd['Monitor']['Cup']) == \
+        pytest.approx({'close': 3 / 7, 'distant': 4 / 7})
+
+def test_load(tmp_path):
+    path = tmp_path / 'model.json'
+    path.write_text(json.dumps(MODEL))
+    model = compiled_model.load(str(path))
+    assert (tmp_path / 'model.compiled.json').exists()
+    cached = compiled_model.load(str(path))
+    assert cached.to_json() == model.to_json()
+    assert cached.to_json() == CompiledModel(MODEL).to_json()
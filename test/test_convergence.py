@@ -0,0 +1,84 @@
+import random
+import pytest
+
+from compiled_model import CompiledModel
+from benchmark import synthetic_model
+from convergence import Convergence, MIN_OBSERVATIONS, relation_values
+
+
+def replayed_scene(model, lrc=None):
+    """ Returns a labeled scene drawn from the distributions of the model.
+    If given, lrc replaces the left/right/center relations.
+    """
+    types = dict()
+    for t in model.types:
+        for j in range(model.presence[t].sample()):
+            types['%s.%03i' % (t.lower(), j)] = t
+    objs = list(types)
+    scn_qsr = dict()
+    for o1 in objs:
+        scn_qsr[o1] = dict()
+        if types[o1] not in model.landmarks:
+            continue
+        for o2 in objs:
+            if o1 == o2:
+                continue
+            [t1, t2] = [types[o1], types[o2]]
+            rel = list()
+            lr = lrc or model.lrc[t1][t2].sample()
+            fb = model.fbc[t1][t2].sample()
+            if fb != 'center':
+                rel.append('front' if fb == 'front' else 'behind')
+            if lr != 'center':
+                rel.append(lr)
+            rel.append(model.cd[t1][t2].sample())
+            scn_qsr[o1][o2] = rel
+    return {'objects': objs, 'type': types, 'qsr': scn_qsr}
+
+def test_relation_values():
+    assert relation_values(['behind', 'left', 'close']) == \
+        {'lrc': 'left', 'fbc': 'back', 'cd': 'close'}
+    assert relation_values(['front', 'distant']) == \
+        {'lrc': 'center', 'fbc': 'front', 'cd': 'distant'}
+
+@pytest.mark.parametrize('max_objects', [1, 2])
+def test_replayed_model_converges(max_objects):
+    random.seed(0)
+    model = CompiledModel(synthetic_model(max_objects))
+    convergence = Convergence(model)
+    for no in range(1, 5001):
+        convergence.add_scene(replayed_scene(model))
+        if convergence.converged(0.05):
+            break
+    assert convergence.converged(0.05)
+    # every family is observed often enough, but not much more
+    assert no >= MIN_OBSERVATIONS
+    assert no < 1000
+    report = convergence.report(0.05)
+    assert report['converged']
+    assert all(d <= 0.05 for d in report['divergence'].values())
+
+def test_diverging_scenes():
+    random.seed(0)
+    model = CompiledModel(synthetic_model(2))
+    convergence = Convergence(model)
+    for no in range(1000):
+        convergence.add_scene(replayed_scene(model, lrc='left'))
+    assert not convergence.converged(0.05)
+    report = convergence.report(0.05)
+    assert report['divergence']['lrc'] > 0.05
+    assert report['divergence']['cd'] < 0.05
+    assert {'lrc'} == set(d['distribution'].split()[0]
+                          for d in report['under_sampled'])
+
+def test_under_sampled():
+    random.seed(0)
+    model = CompiledModel(synthetic_model(1))
+    convergence = Convergence(model)
+    assert not convergence.converged(1.0)
+    # the presence of every type is observed once per scene
+    for no in range((MIN_OBSERVATIONS - 1) // len(model.types)):
+        convergence.add_scene(replayed_scene(model))
+    assert not convergence.converged(1.0)
+    convergence.add_scene(replayed_scene(model))
+    assert convergence.divergence()['presence'][1] >= MIN_OBSERVATIONS
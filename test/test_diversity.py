@@ -0,0 +1,78 @@
+import random
+import pytest
+
+from diversity import SignatureIndex, qsr_signature
+from scene_generator import label_scene
+
+
+def signature(n, offset=0):
+    return tuple(sorted(('Monitor', 'Cup', 'rel%i' % i)
+                        for i in range(offset, offset + n)))
+
+def jaccard(a, b):
+    if not a and not b:
+        return 1.0
+    return float(len(set(a) & set(b))) / len(set(a) | set(b))
+
+
+def test_qsr_signature(scenes):
+    scn = scenes[0][1]
+    scn['qsr'] = label_scene(scn)
+    sig = qsr_signature(scn)
+    assert list(sig) == sorted(set(sig))
+    assert len(sig) <= len(scn['objects']) * (len(scn['objects']) - 1)
+    for [type1, type2, rel] in sig:
+        assert rel.endswith('close') or rel.endswith('distant')
+
+def test_exact_duplicates():
+    index = SignatureIndex(0.0)
+    assert index.add_if_distinct(signature(10))
+    assert not index.add_if_distinct(signature(10))
+    # 9 of 11 triples shared, similar but not the same
+    assert index.add_if_distinct(signature(10, 1))
+    assert index.add_if_distinct(())
+    assert not index.add_if_distinct(())
+    assert index.report() == {'diversity': 0.0, 'distinct_scenes': 3,
+                              'rejected_scenes': 2}
+
+def test_near_duplicates():
+    index = SignatureIndex(0.3)
+    assert index.add_if_distinct(signature(10))
+    # similarity 9 / 11
+    assert not index.add_if_distinct(signature(10, 1))
+    # similarity 5 / 15
+    assert index.add_if_distinct(signature(10, 5))
+    # a subset with 7 of the 10 triples, similarity 0.7
+    assert not index.add_if_distinct(signature(7, 5))
+    assert index.rejected == 2
+
+@pytest.mark.parametrize('seed', range(5))
+def test_similarity(seed):
+    rnd = random.Random(seed)
+    triples = [('Monitor', t, r) for t in ['Cup', 'Mouse', 'PC']
+               for r in ['left_close', 'right_close', 'front_distant']]
+    index = SignatureIndex(0.25)
+    added = list()
+    for i in range(200):
+        sig = tuple(sorted(rnd.sample(triples, rnd.randint(0, 6))))
+        best = max([jaccard(sig, a) for a in added] + [0.0])
+        assert index.similarity(sig) == pytest.approx(best)
+        assert index.add_if_distinct(sig) == (best < 0.75)
+        if best < 0.75:
+            added.append(sig)
+    assert index.signatures == added
+
+def test_generate_rejects_duplicates(make_generator, capsys):
+    index = SignatureIndex(0.0)
+
+    def distinct(scene):
+        scene[1]['qsr'] = label_scene(scene[1])
+        return index.add_if_distinct(qsr_signature(scene[1]))
+
+    first = make_generator(seed=0).generate(1, check=distinct)
+    # the same seed repeats the scene, it is generated with its next attempt
+    generator = make_generator(seed=0)
+    second = generator.generate(1, check=distinct)
+    assert generator.attempt > 0
+    assert index.rejected >= 1
+    assert qsr_signature(second[1]) != qsr_signature(first[1])
@@ -0,0 +1,353 @@
+import json
+import math
+import itertools
+import numpy
+import pytest
+
+import simulation
+import scene_generator
+from benchmark import FakeSimulation, fake_world, box, synthetic_model
+from geometry import quaternion_about_axis, calc_global_bbox
+from scene_generator import RootNode, ObjectNode, PlacementException, \
+    MAX_NUM_OF_BACKTRACKS, BBox, Stats, move_scene, generate_parallel
+from simulation import ModelCache
+
+
+def test_dead_simulator(monkeypatch, make_generator, capsys):
+    monkeypatch.setattr(simulation, 'RECONNECT_DELAY', 0.0)
+    connects = list()
+
+    def factory():
+        connects.append(None)
+        raise ConnectionRefusedError()
+
+    generator = make_generator(factory=factory)
+    with pytest.raises(IOError):
+        generator.generate(1)
+    assert len(connects) == (simulation.NUM_OF_RECONNECTS + 1) ** 2
+
+def xy_bounds(corners):
+    return [min(c[0] for c in corners), max(c[0] for c in corners),
+            min(c[1] for c in corners), max(c[1] for c in corners)]
+
+@pytest.mark.parametrize('max_objects', [1, 2])
+def test_no_overlaps(make_generator, capsys, max_objects):
+    generator = make_generator(max_objects)
+    for no in range(1, 11):
+        scn = generator.generate(no)[1]
+        table = xy_bounds(scn['bbox']['table'])
+        bounds = [xy_bounds(scn['bbox'][o]) for o in scn['objects']]
+        for o in scn['objects']:
+            [x, y, z] = scn['position'][o]
+            assert table[0] < x < table[1] and table[2] < y < table[3]
+        for [a, b] in itertools.combinations(bounds, 2):
+            assert a[1] < b[0] or b[1] < a[0] or a[3] < b[2] or b[3] < a[2]
+
+
+def candidate(x):
+    """ A valid candidate (position, orientation, global bbox) at x.
+    """
+    corners = [[x + c[0], c[1], 0.75 + c[2]] for c in box([0.1, 0.1, 0.1])]
+    return ([x, 0.0, 0.8], [1.0, 0.0, 0.0, 0.0], corners)
+
+@pytest.fixture
+def scene_tree(monkeypatch):
+    """ A keyboard on the table and a mouse next to it, on a fake
+    simulation.
+    """
+    monkeypatch.setattr(scene_generator, 'cache', ModelCache())
+    monkeypatch.setattr(scene_generator, 'stats', scene_generator.Stats())
+    monkeypatch.setattr(scene_generator, 'morse',
+                        FakeSimulation(fake_world(1)))
+    table = RootNode('table')
+    keyboard = ObjectNode('keyboard')
+    mouse = ObjectNode('mouse')
+    table.add(keyboard, 'center')
+    keyboard.add(mouse, 'right_center', 'close')
+    return table
+
+def script_candidates(monkeypatch, keyboard, mouse):
+    """ Replaces the candidates of the keyboard by the positions keyboard
+    and those of the mouse by mouse(keyboard position).
+    """
+    def valid_candidates(self, node, x, y, root_pose):
+        if node.name == 'keyboard':
+            return iter([candidate(x) for x in keyboard])
+        xs = mouse(self.positions['keyboard'][0])
+        if xs is None:
+            # no candidate on the supporting plane
+            return None
+        return iter([candidate(x) for x in xs])
+    monkeypatch.setattr(RootNode, 'valid_candidates', valid_candidates)
+
+def test_backtracking(monkeypatch, scene_tree):
+    # the first position of the keyboard leaves no room for the mouse
+    script_candidates(monkeypatch, [0.0, 0.3],
+                      lambda x: [] if x == 0.0 else [0.1])
+    scn = scene_tree.place_objects(1)[1]
+    assert scn['objects'] == ['keyboard', 'mouse']
+    assert scn['position']['keyboard'][0] == 0.3
+    assert scn['position']['mouse'][0] == 0.1
+    assert scene_generator.stats.backtracks == 1
+    assert len(scene_tree.collision_index) == 2
+    assert scene_generator.morse.objects['keyboard']['pose'][0][0] == 0.3
+
+def test_infeasible_child(monkeypatch, scene_tree):
+    # from the first position of the keyboard the mouse is off the table
+    script_candidates(monkeypatch, [0.0, 0.3],
+                      lambda x: None if x == 0.0 else [0.1])
+    scn = scene_tree.place_objects(1)[1]
+    assert scn['position']['keyboard'][0] == 0.3
+    assert scn['position']['mouse'][0] == 0.1
+    assert scene_generator.stats.backtracks == 1
+
+def test_infeasible_sibling(monkeypatch, scene_tree):
+    keyboard = scene_tree.children[0]
+    keyboard.add(ObjectNode('cup'), 'left_center', 'close')
+
+    def valid_candidates(self, node, x, y, root_pose):
+        if node.name == 'keyboard':
+            return iter([candidate(0.0), candidate(0.3)])
+        if node.name == 'mouse':
+            return iter([candidate(0.6)])
+        if self.positions['keyboard'][0] == 0.0:
+            return None
+        return iter([candidate(-0.3)])
+    monkeypatch.setattr(RootNode, 'valid_candidates', valid_candidates)
+
+    scn = scene_tree.place_objects(1)[1]
+    assert scn['objects'] == ['keyboard', 'mouse', 'cup']
+    assert scn['position']['keyboard'][0] == 0.3
+    # the mouse is taken back with the keyboard and placed anew
+    assert scn['position']['mouse'][0] == 0.6
+    assert scene_generator.stats.backtracks == 1
+    assert len(scene_tree.collision_index) == 3
+
+def test_infeasible_anchor(monkeypatch, scene_tree):
+    def valid_candidates(self, node, x, y, root_pose):
+        return None
+    monkeypatch.setattr(RootNode, 'valid_candidates', valid_candidates)
+    with pytest.raises(PlacementException) as e:
+        scene_tree.place_objects(1)
+    assert e.value.msg == 'keyboard'
+    assert scene_generator.stats.backtracks == 0
+
+def test_dead_end(monkeypatch, scene_tree):
+    script_candidates(monkeypatch, [0.0, 0.3], lambda x: [])
+    with pytest.raises(PlacementException) as e:
+        scene_tree.place_objects(1)
+    assert e.value.msg == 'keyboard'
+    assert scene_tree.objects == []
+    assert len(scene_tree.collision_index) == 0
+
+def test_max_backtracks(monkeypatch, scene_tree):
+    script_candidates(monkeypatch, [0.01 * i for i in range(100)],
+                      lambda x: [])
+    with pytest.raises(PlacementException) as e:
+        scene_tree.place_objects(1)
+    assert e.value.msg == 'mouse'
+    assert scene_generator.stats.backtracks == MAX_NUM_OF_BACKTRACKS
+    # nothing is moved before the whole scene is placed
+    assert scene_generator.morse.objects['keyboard']['pose'][0] == \
+        [0.0, 0.0, 0.0]
+
+def test_memo(monkeypatch):
+    sim = FakeSimulation(fake_world(1))
+    calls = dict()
+    monkeypatch.setattr(scene_generator, 'morse',
+                        simulation.Connection(calls=calls,
+                                              factory=lambda: sim))
+    memo = dict()
+    table = RootNode('table', memo)
+    bbox = table.get_global_bbox('cup')
+    assert table.get_pose('cup') == [[0.0, 0.0, 0.0], [1.0, 0.0, 0.0, 0.0]]
+    # later lookups, also of the next trial of the scene, are memoized
+    assert RootNode('table', memo).get_global_bbox('cup') == bbox
+    assert calls['get_object_global_bbox'][0] == 1
+
+    pose = [[1.5, 0.5, 0.8], [1.0, 0.0, 0.0, 0.0]]
+    table.set_object_poses([('cup', pose[0], pose[1])])
+    assert 'cup' not in memo
+    assert numpy.allclose(table.get_global_bbox('cup'),
+                          calc_global_bbox(pose, sim.objects['cup']['bbox']))
+    assert table.get_pose('cup') == pose
+    assert calls['get_object_global_bbox'][0] == 2
+
+    # adding and removing a placed object leaves the simulator untouched
+    json_bbox = table.get_global_bbox('cup')
+    table.add_object('cup', pose[0], pose[1], json_bbox, BBox(json_bbox))
+    table.remove_object('cup')
+    assert memo['cup']['pose'] == pose
+    # taking it off the table does not
+    table.remove_objects(['cup'])
+    assert 'cup' not in memo
+    assert numpy.allclose(table.get_global_bbox('cup'), bbox)
+    assert calls['get_object_global_bbox'][0] == 3
+
+class CountingSimulation(FakeSimulation):
+    """ A fake simulation that counts the calls of every service.
+    """
+    def __init__(self, objects):
+        FakeSimulation.__init__(self, objects)
+        self.counts = dict()
+
+    def rpc(self, component, method, *args):
+        self.counts[method] = self.counts.get(method, 0) + 1
+        return FakeSimulation.rpc(self, component, method, *args)
+
+def test_stats(make_generator, capsys):
+    sim = CountingSimulation(fake_world(1))
+    generator = make_generator(1, factory=lambda: sim)
+    scenes = [generator.generate(no) for no in range(1, 4)]
+    stats = scene_generator.stats
+
+    # every simulator call is counted once, under its service
+    assert dict((m, c) for m, [c, s] in stats.rpc.items()) == sim.counts
+    assert stats.rpc['set_object_pose'][0] >= \
+        sum(len(scn['objects']) for [i, scn] in scenes)
+    assert stats.scenes == 3
+    assert stats.trials >= 3
+
+    # the placed objects of every type are counted under their relations,
+    # along with the samples drawn for them
+    report = stats.report()
+    assert report['scenes'] == 3
+    assert report['rpc']['set_object_pose']['calls'] == \
+        sim.counts['set_object_pose']
+    for t in set(scn['type'][o] for [i, scn] in scenes
+                 for o in scn['objects']):
+        rates = report['samples'][t].values()
+        assert sum(r['objects'] for r in rates) == \
+            sum(1 for [i, scn] in scenes for o in scn['objects']
+                if scn['type'][o] == t)
+        for r in rates:
+            assert r['samples'] >= r['objects']
+            if r['objects'] > 0:
+                assert r['samples_per_object'] == \
+                    round(r['samples'] / r['objects'], 1)
+            else:
+                assert r['samples_per_object'] is None
+
+def test_candidates_on_table(make_generator, capsys):
+    generator = make_generator(2)
+    for no in range(1, 6):
+        generator.generate(no)
+    stats = scene_generator.stats
+    assert sum(n for t in stats.samples.values()
+               for [n, placed] in t.values()) > 0
+    # the sampled candidates are all on the supporting plane
+    assert stats.rejected['within_root_bbox'] == 0
+
+
+# the table of a second simulator instance, moved and turned by 90 degrees
+YAWED_TABLE = [[-1.0, 3.0, 0.0],
+               quaternion_about_axis(math.pi / 2, [0, 0, 1]).tolist()]
+
+def yawed_simulation(max_objects=1):
+    world = fake_world(max_objects)
+    world['table']['pose'] = YAWED_TABLE
+    return FakeSimulation(world)
+
+def test_move_scene(make_generator, capsys):
+    frame = fake_world(1)['table']['pose']
+    sim = yawed_simulation()
+    scene = make_generator(1, factory=lambda: sim).generate(1)
+    scn = json.loads(json.dumps(scene[1]))
+    moved = move_scene(scene, frame)[1]
+
+    assert moved['position']['table'] == pytest.approx(frame[0])
+    assert moved['orientation']['table'] == pytest.approx(frame[1])
+    assert numpy.allclose(moved['bbox']['table'],
+                          calc_global_bbox(frame, sim.objects['table']['bbox']))
+    # the camera is 2.5m in front of the table in x of the world, seen from
+    # the table turned by 90 degrees it is 2.5m in -y
+    [x, y, z] = scn['camera_position']
+    assert [x - YAWED_TABLE[0][0], y - YAWED_TABLE[0][1]] == \
+        pytest.approx([2.5, 0.0])
+    assert moved['camera_position'] == pytest.approx([frame[0][0],
+                                                      frame[0][1] - 2.5, z])
+    for o in scn['objects']:
+        [dx, dy, dz] = numpy.subtract(scn['position'][o], YAWED_TABLE[0])
+        assert numpy.allclose(moved['position'][o],
+                              numpy.add(frame[0], [dy, -dx, dz]))
+
+    # moving it back gives the scene as generated
+    back = move_scene(['scene1', moved], YAWED_TABLE)[1]
+    for key in ['position', 'orientation', 'bbox']:
+        for o in scn[key]:
+            assert numpy.allclose(back[key][o], scn[key][o])
+    assert numpy.allclose(back['camera_position'], scn['camera_position'])
+
+def test_stats_combine():
+    snapshots = list()
+    for [scenes, trials, calls] in [[2, 5, 10], [3, 4, 7]]:
+        stats = Stats()
+        stats.add_scene(trials)
+        stats.scenes = scenes
+        stats.trials = trials
+        stats.backtracks = calls
+        stats.rejected['in_collision'] = calls
+        stats.add_samples('Cup', 'left', calls, scenes)
+        stats.rpc['get_object_bbox'] = [calls, 0.5]
+        snapshots.append(json.loads(json.dumps(stats.to_json())))
+
+    stats = Stats()
+    stats.add_scene(100)
+    stats.combine(snapshots)
+    assert [stats.scenes, stats.trials, stats.max_trials, stats.backtracks] == \
+        [5, 9, 5, 17]
+    assert stats.rejected == {'within_root_bbox': 0, 'in_collision': 17}
+    assert stats.samples == {'Cup': {'left': [17, 5]}}
+    assert stats.rpc == {'get_object_bbox': [17, 1.0]}
+
+def workers(*factories):
+    return [{'host': 'localhost', 'port': 4000 + i, 'table': 'table',
+             'offset': 0, 'factory': f} for i, f in enumerate(factories)]
+
+def test_parallel(monkeypatch, tmp_path, capsys):
+    monkeypatch.setattr(scene_generator, 'stats', Stats())
+    model_file = str(tmp_path / 'model.json')
+    with open(model_file, 'w') as qsr_file:
+        json.dump(synthetic_model(1), qsr_file)
+    frame = fake_world(1)['table']['pose']
+    cameras = [[frame[0][0] + 2.5, frame[0][1], 1.698],
+               [frame[0][0], frame[0][1] - 2.5, 1.698]]
+
+    with open(str(tmp_path / 'scenes.jsonl'), 'w') as outfile:
+        generate_parallel(workers(lambda: FakeSimulation(fake_world(1)),
+                                  yawed_simulation),
+                          model_file, None, None, 0, 1, 4, outfile)
+    with open(str(tmp_path / 'scenes.jsonl')) as scn_file:
+        scenes = [json.loads(line) for line in scn_file]
+
+    # the scenes of both workers are given on the table of the first one
+    assert [s[0] for s in scenes] == ['scene1', 'scene2', 'scene3', 'scene4']
+    for [scene_id, scn] in scenes:
+        assert scn['position']['table'] == pytest.approx(frame[0])
+        assert scn['orientation']['table'] == pytest.approx(frame[1])
+        assert any(numpy.allclose(scn['camera_position'], c) for c in cameras)
+        assert sorted(scn['qsr']) == sorted(scn['objects'])
+
+    # the statistics are those of both workers together
+    stats = scene_generator.stats
+    assert stats.scenes == 4
+    assert stats.trials >= 4
+    assert stats.rpc['set_object_pose'][0] >= \
+        sum(len(s[1]['objects']) for s in scenes)
+
+def test_parallel_worker_failure(monkeypatch, tmp_path, capfd):
+    monkeypatch.setattr(simulation, 'RECONNECT_DELAY', 0.0)
+    monkeypatch.setattr(scene_generator, 'stats', Stats())
+    model_file = str(tmp_path / 'model.json')
+    with open(model_file, 'w') as qsr_file:
+        json.dump(synthetic_model(1), qsr_file)
+
+    def factory():
+        raise ConnectionRefusedError()
+
+    with open(str(tmp_path / 'scenes.jsonl'), 'w') as outfile:
+        with pytest.raises(RuntimeError) as e:
+            generate_parallel(workers(lambda: FakeSimulation(fake_world(1)),
+                                      factory),
+                              model_file, None, None, 0, 1, 6, outfile)
+    assert 'worker 1 stopped' in str(e.value)
@@ -0,0 +1,75 @@
+import math
+import numpy
+import pytest
+
+from benchmark import box
+from geometry import quaternion_about_axis, quaternion_multiply, \
+    transform_points, transform_to_obj_frame, calc_global_bbox, \
+    bbox_from_corners
+from scene_generator import calc_candidate_poses
+
+
+def yaw(angle):
+    return quaternion_about_axis(angle, [0, 0, 1]).tolist()
+
+# a table at (2, 1) turned by 90 degrees, x of the table is y of the world
+YAWED_TABLE = [[2.0, 1.0, 0.0], yaw(math.pi / 2)]
+
+@pytest.mark.parametrize('pose,point,expected', [
+    [[[0, 0, 0], [1, 0, 0, 0]], [0.5, 0.2, 0.8], [0.5, 0.2, 0.8]],
+    [[[2, 1, 0], [1, 0, 0, 0]], [0.5, 0.2, 0.8], [2.5, 1.2, 0.8]],
+    [YAWED_TABLE, [0.5, 0.2, 0.8], [1.8, 1.5, 0.8]],
+    [[[0, 0, 0], yaw(math.pi)], [1, 2, 3], [-1, -2, 3]],
+    [[[1, 1, 1], quaternion_about_axis(math.pi / 2, [1, 0, 0]).tolist()],
+     [0, 1, 0], [1, 1, 2]],
+])
+def test_transform_to_obj_frame(pose, point, expected):
+    assert numpy.allclose(transform_to_obj_frame(pose, point), expected)
+
+def test_global_bbox():
+    local = box([1.0, 0.5, 0.8])
+    corners = calc_global_bbox(YAWED_TABLE, local)
+    assert len(corners) == 8
+    # the corners keep their order
+    assert numpy.allclose(corners[0], [2.25, 0.5, 0.0])
+    assert numpy.allclose(corners, [transform_to_obj_frame(YAWED_TABLE, c)
+                                    for c in local])
+    [mins, maxs] = bbox_from_corners(corners)
+    assert numpy.allclose(mins, [1.75, 0.5, 0.0])
+    assert numpy.allclose(maxs, [2.25, 1.5, 0.8])
+
+    # turned by 45 degrees, the square footprint reaches out to the diagonal
+    [mins, maxs] = bbox_from_corners(calc_global_bbox(
+        [[0, 0, 0], yaw(math.pi / 4)], box([1.0, 1.0, 1.0])))
+    assert numpy.allclose(mins, [-math.sqrt(0.5), -math.sqrt(0.5), 0.0])
+    assert numpy.allclose(maxs, [math.sqrt(0.5), math.sqrt(0.5), 1.0])
+
+def test_transform_points_batch():
+    rnd = numpy.random.RandomState(0)
+    positions = rnd.uniform(-2, 2, (5, 3))
+    orientations = quaternion_multiply(
+        quaternion_about_axis(rnd.uniform(-3, 3, 5), [0, 0, 1]),
+        quaternion_about_axis(rnd.uniform(-3, 3, 5), [1, 0, 0]))
+    points = rnd.uniform(-1, 1, (5, 8, 3))
+    expected = [calc_global_bbox([p, q], c)
+                for p, q, c in zip(positions, orientations, points)]
+    assert numpy.allclose(transform_points(positions, orientations, points),
+                          expected)
+    assert numpy.allclose(transform_points(positions, orientations,
+                                           points[:,0]),
+                          [e[0] for e in expected])
+
+def test_candidate_poses():
+    # candidates in the frame of the yawed table, as in valid_candidates
+    points = [[0.5, 0.2, 0.8], [-0.3, 0.0, 0.8], [0.0, -0.4, 0.8]]
+    yaws = [0.0, math.pi / 2, -0.3]
+    local = box([0.2, 0.1, 0.1])
+    [positions, orientations, bboxes] = \
+        calc_candidate_poses(YAWED_TABLE, numpy.array(points),
+                             numpy.array(yaws), local)
+    assert numpy.allclose(positions[0], [1.8, 1.5, 0.8])
+    for p, q, b, point, a in zip(positions, orientations, bboxes, points,
+                                 yaws):
+        assert numpy.allclose(p, transform_to_obj_frame(YAWED_TABLE, point))
+        assert numpy.allclose(q, yaw(a))
+        assert numpy.allclose(b, calc_global_bbox([p, q], local))
@@ -0,0 +1,118 @@
+import json
+import threading
+import pytest
+
+import scene_loader
+from benchmark import FakeSimulation
+from simulation import Connection
+from loader_service import LoaderService, LoaderServer, LoaderClient, \
+    RequestHandler
+from scene_archive import SceneArchive, convert
+
+
+class FailingSimulation(FakeSimulation):
+    """ Loses the connection after the given number of set_object_pose
+    calls.
+    """
+    def __init__(self, objects, fail_after=None):
+        FakeSimulation.__init__(self, objects)
+        self.fail_after = fail_after
+
+    def rpc(self, component, method, *args):
+        if method == 'set_object_pose' and self.fail_after is not None:
+            if self.fail_after == 0:
+                raise IOError('connection lost')
+            self.fail_after = self.fail_after - 1
+        return FakeSimulation.rpc(self, component, method, *args)
+
+def placed(sim):
+    """ The objects that are not parked.
+    """
+    return dict((o, obj['pose']) for o, obj in sim.objects.items()
+                if o != 'table' and obj['pose'][0] != [0.0, 0.0, 0.0])
+
+def expected(sim, scn):
+    return dict((name, [pos, ori]) for [name, pos, ori] in
+                scene_loader.scene_poses(scn, sim.objects['table']['pose']))
+
+def assert_placed(sim, scn):
+    current = placed(sim)
+    assert sorted(current) == sorted(scn['objects'])
+    for name, [pos, ori] in expected(sim, scn).items():
+        assert current[name][0] == pytest.approx(pos)
+        assert current[name][1] == pytest.approx(ori)
+
+
+@pytest.fixture
+def service(tmp_path, scenes, scene_world, monkeypatch):
+    with open(tmp_path / 'scenes.json', 'w') as scn_file:
+        json.dump(scenes, scn_file)
+    convert(str(tmp_path / 'scenes.json'), str(tmp_path / 'scenes.archive'))
+    sim = FailingSimulation(scene_world())
+    # called without reconnects, a lost connection fails the request
+    monkeypatch.setattr(scene_loader, 'morse', sim)
+    service = LoaderService({'list': str(tmp_path / 'scenes.json'),
+                             'archive': str(tmp_path / 'scenes.archive')},
+                            Connection(factory=lambda: sim))
+    service.sim = sim
+    yield service
+    service.close()
+
+def test_datasets(service, scenes):
+    assert isinstance(service.datasets['archive'], SceneArchive)
+    for key in [4, 'scene5']:
+        for dataset in ['list', 'archive']:
+            scn = service.get_scene(dataset, key)
+            assert scn == scenes[4][1]
+            # decoded once
+            assert service.get_scene(dataset, key) is scn
+
+def test_load_and_switch(service, scenes):
+    for no in [3, 7, 7, 12, 0]:
+        response = service.handle({'cmd': 'load', 'dataset': 'archive',
+                                   'scene': no, 'target': 'table'})
+        assert response['ok']
+        assert_placed(service.sim, scenes[no][1])
+    assert service.handle({'cmd': 'clear', 'target': 'table'})['ok']
+    assert placed(service.sim) == {}
+
+@pytest.mark.parametrize('fail_after', [0, 1, 2, 3])
+def test_failed_switch(service, scenes, fail_after):
+    [first, second, third] = [scn for [i, scn] in scenes
+                              if len(scn['objects']) >= 4][:3]
+    service.datasets['test'] = [['a', first], ['b', second], ['c', third]]
+    service.load('test', 0, 'table')
+    service.sim.fail_after = fail_after
+    response = service.handle({'cmd': 'load', 'dataset': 'test', 'scene': 1,
+                               'target': 'table'})
+    assert not response['ok']
+    service.sim.fail_after = None
+    service.load('test', 2, 'table')
+    assert_placed(service.sim, third)
+
+def test_invalid_requests(service):
+    for request in [[], 3, 'load', None]:
+        response = service.handle(request)
+        assert not response['ok'] and 'invalid request' in response['error']
+    assert not service.handle({'cmd': 'fly'})['ok']
+    assert service.handle({'cmd': 'status'})['ok']
+
+def test_server_keeps_connection(service):
+    server = LoaderServer(('localhost', 0), RequestHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        with LoaderClient(port=server.server_address[1]) as client:
+            client.file.write(b'[]\n3\n"load"\nnot json\n')
+            client.file.flush()
+            for i in range(4):
+                response = json.loads(client.file.readline().decode())
+                assert not response['ok']
+            assert client.load('archive', 3, 'table')['objects'] == \
+                service.get_scene('archive', 3)['objects']
+            assert client.status()['loaded'][0]['scene'] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
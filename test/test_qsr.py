@@ -0,0 +1,67 @@
+import math
+import numpy
+import pytest
+
+import qsr
+
+
+def angles(partitions):
+    """ Random angles and the critical ones: the means, the midpoints
+    between them and their neighbouring floats, the ends of [0, 2*pi]
+    and angles outside of it.
+    """
+    rnd = numpy.random.RandomState(partitions)
+    critical = [0.0, 2 * math.pi, -0.1, 2 * math.pi + 0.1, -1e-12,
+                math.nan, 100.0, -100.0]
+    for p in range(partitions + 1):
+        for a in [qsr.mean(p, partitions), qsr.mean(p + 0.5, partitions)]:
+            critical += [a, numpy.nextafter(a, -1.0), numpy.nextafter(a, 7.0),
+                         a - 1e-10, a + 1e-10, a - 1e-8, a + 1e-8]
+    return numpy.concatenate([rnd.uniform(0, 2 * math.pi, 20000), critical])
+
+@pytest.mark.parametrize('partitions', [1, 2, 3, 4, 8, 16])
+def test_bin_lookup(partitions):
+    a = angles(partitions)
+    exact = qsr.argmax_partition_exact_batch(a, partitions)
+    assert (qsr.argmax_partition_batch(a, partitions) == exact).all()
+    assert [qsr.argmax_partition_exact(x, partitions) for x in a.tolist()] \
+        == exact.tolist()
+    assert [qsr.argmax_partition(x, partitions) for x in a.tolist()] \
+        == exact.tolist()
+
+@pytest.mark.parametrize('partitions', [1, 8])
+def test_no_partition(partitions):
+    for a in [math.nan, 1000.0]:
+        assert qsr.argmax_partition_exact(a, partitions) == -1
+        assert qsr.argmax_partition(a, partitions) == -1
+    assert qsr.argmax_partition_batch([math.nan, 1000.0, 1.0],
+                                      partitions).tolist() == \
+        [-1, -1, qsr.argmax_partition(1.0, partitions)]
+
+def test_partition_names():
+    assert [qsr.partition_name(p) for p in range(8)] == qsr.PARTITION_NAMES
+    assert [qsr.partition_name(p, 4) for p in range(4)] == \
+        [['behind'], ['left'], ['front'], ['right']]
+    assert qsr.partition_name(2, 16) == ['behind', 'left']
+    with pytest.raises(ValueError):
+        qsr.partition_name(3, 16)
+    # the names are copies
+    qsr.partition_name(0).append('close')
+    assert qsr.partition_name(0) == ['behind']
+
+def test_calc_QSR_batch():
+    rnd = numpy.random.RandomState(0)
+    [camera, landmark, obj] = rnd.uniform(-3, 3, (3, 1000, 3))
+    for partitions in [None, 4]:
+        [part, close] = qsr.calc_QSR_batch(camera, landmark, obj, partitions)
+        for k in range(len(part)):
+            assert qsr.qsr_list(part[k], close[k], partitions) == \
+                qsr.calc_QSR(camera[k], landmark[k], obj[k], partitions)
+
+def test_default_at_call_time(monkeypatch):
+    monkeypatch.setattr(qsr, 'NUMBER_OF_PARTITIONS', 4)
+    a = angles(4)
+    assert (qsr.argmax_partition_batch(a) ==
+            qsr.argmax_partition_exact_batch(a, 4)).all()
+    assert qsr.partition_bins() == qsr.partition_bins(4)
+    assert qsr.partition_name(1) == ['left']
@@ -0,0 +1,72 @@
+import random
+import pytest
+
+import qsr
+from qsr_stream import QSRStream
+
+
+def full_labels(stream):
+    """ The labels of all pairs recomputed from the positions of the stream.
+    """
+    return dict(((o1, o2), qsr.calc_QSR(stream.camera, stream.positions[o1],
+                                        stream.positions[o2]))
+                for o1 in stream.positions for o2 in stream.positions
+                if o1 != o2)
+
+def position(rnd):
+    return [rnd.uniform(0, 2), rnd.uniform(0, 2), 0.8]
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('tolerance', [0.0, 0.05])
+def test_incremental_labels(seed, tolerance):
+    rnd = random.Random(seed)
+    names = ['obj%i' % i for i in range(8)]
+    stream = QSRStream(tolerance=tolerance)
+    # the labels as seen by a subscriber of the events
+    seen = dict()
+    for step in range(200):
+        present = list(stream.positions)
+        poses = dict((o, position(rnd))
+                     for o in rnd.sample(names, rnd.randint(0, 3)))
+        # small moves, some of them within the tolerance
+        for o in rnd.sample(present, min(len(present), 2)):
+            poses[o] = [x + rnd.uniform(-0.06, 0.06)
+                        for x in stream.positions[o]]
+        removed = rnd.sample(present, min(len(present), rnd.randint(0, 1)))
+        camera = None
+        if step == 0 or rnd.random() < 0.1:
+            camera = [rnd.uniform(-1, 3), rnd.uniform(-1, 3), 1.5]
+
+        for o in removed:
+            poses.pop(o, None)
+        for event in stream.update(poses, camera, removed):
+            pair = (event['landmark'], event['object'])
+            assert seen.get(pair) == event['previous']
+            assert event['qsr'] != event['previous']
+            if event['qsr'] is None:
+                del seen[pair]
+            else:
+                seen[pair] = event['qsr']
+
+        labels = full_labels(stream)
+        assert stream.labels == labels
+        assert seen == labels
+        for o in names:
+            assert stream.pairs.get(o, set()) == \
+                set(p for p in labels if o in p)
+
+def test_no_labels_without_camera():
+    stream = QSRStream()
+    assert stream.update({'cup': [1, 1, 0.8], 'monitor': [1, 2, 0.8]}) == []
+    assert stream.labels == {}
+    events = stream.update(camera=[0, 0, 1.5])
+    assert len(events) == 2
+    assert stream.labels == full_labels(stream)
+
+def test_tolerance():
+    stream = QSRStream(camera=[0, 0, 1.5], tolerance=0.1)
+    stream.update({'cup': [1, 1, 0.8], 'monitor': [1, 2, 0.8]})
+    stream.update({'cup': [1.05, 1, 0.8]})
+    assert stream.positions['cup'].tolist() == [1, 1, 0.8]
+    stream.update({'cup': [1.2, 1, 0.8]})
+    assert stream.positions['cup'].tolist() == [1.2, 1, 0.8]
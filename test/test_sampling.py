@@ -0,0 +1,70 @@
+import math
+import statistics
+import numpy
+import pytest
+
+from scene_generator import truncated_normal, normal_inv_cdf, ray_range
+
+
+def test_normal_inv_cdf():
+    # all three branches: the center, the tails and the far tails
+    p = numpy.concatenate([numpy.linspace(1e-6, 1 - 1e-6, 1001),
+                           [1e-300, 1e-20, 1e-12, 0.075, 0.925, 1 - 1e-12]])
+    expected = [statistics.NormalDist().inv_cdf(v) for v in p]
+    assert normal_inv_cdf(p) == pytest.approx(expected, rel=1e-12, abs=1e-14)
+    assert normal_inv_cdf(numpy.zeros(0)).shape == (0,)
+
+@pytest.mark.parametrize('mu', [0.0, 0.5, -3.0, 40.0])
+def test_truncated_normal(mu):
+    numpy.random.seed(0)
+    x = truncated_normal(mu, 0.2, -0.5, 1.0, 1000)
+    assert len(x) == 1000
+    assert ((-0.5 < x) & (x < 1.0)).all()
+
+def test_truncated_normal_distribution():
+    numpy.random.seed(0)
+    # barely truncated, the samples follow the normal distribution
+    x = truncated_normal(0.2, 0.1, -1.0, 1.0, 10000)
+    assert x.mean() == pytest.approx(0.2, abs=0.01)
+    assert x.std() == pytest.approx(0.1, abs=0.01)
+    # truncated at the mean, half of a normal distribution
+    x = truncated_normal(0.0, 0.1, 0.0, 1.0, 10000)
+    assert x.mean() == pytest.approx(0.1 * math.sqrt(2 / math.pi), abs=0.01)
+
+def test_truncated_normal_empty():
+    assert len(truncated_normal(0.0, 1.0, 1.0, 1.0, 10)) == 0
+    assert len(truncated_normal(0.0, 1.0, 2.0, -2.0, 10)) == 0
+
+@pytest.mark.parametrize('seed', range(5))
+def test_ray_range(seed):
+    rnd = numpy.random.RandomState(seed)
+    bounds = [-0.4, 0.4, -0.8, 0.8]
+    phi = rnd.uniform(0, 2 * math.pi, 200)
+    for [x, y] in [[0.0, 0.0], [0.3, -0.7], [1.0, 0.0], [-1.0, 2.0]]:
+        [lo, hi] = ray_range(x, y, phi, bounds)
+        hit = lo < hi
+        if -0.4 < x < 0.4 and -0.8 < y < 0.8:
+            # from inside, every ray leaves the bounds
+            assert hit.all() and (lo < 0).all() and (hi > 0).all()
+        # the points of a ray between lo and hi are within the bounds
+        for t in numpy.linspace(0.001, 0.999, 11):
+            dist = lo[hit] + t * (hi[hit] - lo[hit])
+            px = x + numpy.sin(phi[hit]) * dist
+            py = y + numpy.cos(phi[hit]) * dist
+            assert ((bounds[0] < px) & (px < bounds[1]) &
+                    (bounds[2] < py) & (py < bounds[3])).all()
+        # and those just outside are not
+        for dist in [lo[hit] - 1e-6, hi[hit] + 1e-6]:
+            px = x + numpy.sin(phi[hit]) * dist
+            py = y + numpy.cos(phi[hit]) * dist
+            assert not ((bounds[0] < px) & (px < bounds[1]) &
+                        (bounds[2] < py) & (py < bounds[3])).any()
+
+def test_ray_range_axis_parallel():
+    bounds = [-0.4, 0.4, -0.8, 0.8]
+    [lo, hi] = ray_range(0.0, 0.0, numpy.array([0.0, math.pi / 2]), bounds)
+    assert lo == pytest.approx([-0.8, -0.4])
+    assert hi == pytest.approx([0.8, 0.4])
+    # parallel to an axis outside of the bounds
+    [lo, hi] = ray_range(1.0, 0.0, numpy.array([0.0]), bounds)
+    assert not lo[0] < hi[0]
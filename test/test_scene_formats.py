@@ -0,0 +1,143 @@
+import json
+import numpy
+import pytest
+
+import qsr
+from scene_archive import ArchiveWriter, SceneArchive, open_scenes, convert
+from scene_store import SceneStore, write_store
+import scene_query
+from scene_query import RelationIndex, relation_keys, parse_term
+from scene_generator import label_scenes, write_scene
+
+
+def write_lines(path, scenes):
+    with open(path, 'w') as scn_file:
+        for s in scenes:
+            write_scene(scn_file, s)
+
+
+@pytest.mark.parametrize('pretty', [False, True])
+def test_read_scenes_file(tmp_path, scenes, pretty):
+    path = tmp_path / 'scenes.json'
+    with open(path, 'w') as scn_file:
+        json.dump(scenes, scn_file, indent=2 if pretty else None)
+    assert open_scenes(str(path)) == scenes
+
+@pytest.mark.parametrize('shard_size', [1, 7, 1000])
+def test_archive_round_trip(tmp_path, scenes, shard_size):
+    write_lines(tmp_path / 'scenes.jsonl', scenes)
+    path = str(tmp_path / 'scenes.archive')
+    assert convert(str(tmp_path / 'scenes.jsonl'), path, shard_size) == \
+        len(scenes)
+    with open_scenes(path) as archive:
+        assert isinstance(archive, SceneArchive)
+        assert len(archive) == len(scenes)
+        assert list(archive) == scenes
+        # random access, by id and by position
+        for i in [17, 3, 39, 0]:
+            assert archive[scenes[i][0]] == scenes[i]
+            assert archive[i] == scenes[i]
+        assert archive[numpy.int64(2)] == scenes[2]
+        assert archive[-1] == scenes[-1]
+        assert archive[-len(scenes)] == scenes[0]
+        for key in [len(scenes), -len(scenes) - 1]:
+            with pytest.raises(IndexError):
+                archive[key]
+        assert 'scene1' in archive
+        assert 'scene0' not in archive
+
+def test_archive_duplicate_id(tmp_path, scenes):
+    with ArchiveWriter(str(tmp_path / 'scenes.archive')) as writer:
+        writer.add(scenes[0])
+        with pytest.raises(ValueError):
+            writer.add(scenes[0])
+
+def test_store_round_trip(tmp_path, scenes):
+    path = str(tmp_path / 'scenes.store')
+    assert write_store(scenes, path) == len(scenes)
+    store = open_scenes(path)
+    assert isinstance(store, SceneStore)
+    assert len(store) == len(scenes)
+    assert list(store) == scenes
+    assert store['scene12'] == scenes[11]
+    assert store[numpy.int64(2)] == scenes[2]
+    assert store[-1] == scenes[-1]
+    assert store[-len(scenes)] == scenes[0]
+    for key in [len(scenes), -len(scenes) - 1]:
+        with pytest.raises(IndexError):
+            store[key]
+    assert store.positions[store.rows(5)].tolist() == \
+        [scenes[5][1]['position'][o] for o in scenes[5][1]['objects']] + \
+        [scenes[5][1]['position']['table']]
+
+def test_store_labels(tmp_path, scenes):
+    path = str(tmp_path / 'scenes.store')
+    write_store(scenes, path)
+    store = SceneStore(path)
+    [obj1, obj2, scns] = store.pairs()
+    [part, close] = store.calc_QSR()
+    labels = [(store.scenes[s], store.objects[o1], store.objects[o2],
+               qsr.qsr_list(p, c))
+              for s, o1, o2, p, c in zip(scns, obj1, obj2, part, close)]
+    expected = [(scene_id, o1, o2, rel)
+                for [scene_id, scn], scn_qsr in
+                zip(scenes, label_scenes([s for [i, s] in scenes]))
+                for o1 in scn['objects'] for o2 in scn['objects'] if o1 != o2
+                for rel in [scn_qsr[o1][o2]]]
+    assert labels == expected
+
+def test_parse_term():
+    assert parse_term('Monitor:Cup:left_close') == 'Monitor:Cup:close_left'
+    assert parse_term('Monitor:Cup:close') in \
+        relation_keys('Monitor', 'Cup', ['left', 'close'])
+    for term in ['Monitor:Cup', 'Monitor:Cup:', 'a:b:c:d']:
+        with pytest.raises(ValueError):
+            parse_term(term)
+
+def test_query(tmp_path, scenes):
+    index = RelationIndex.build([[i, dict(s)] for [i, s] in scenes])
+    scns_qsr = label_scenes([s for [i, s] in scenes])
+
+    def matches(scn, scn_qsr, term):
+        [type1, type2, rel] = parse_term(term).split(':')
+        return any(scn['type'][o1] == type1 and scn['type'][o2] == type2 and
+                   set(rel.split('_')) <= set(scn_qsr[o1][o2])
+                   for o1 in scn_qsr for o2 in scn_qsr[o1])
+
+    for terms in [['Monitor:Cup:left'], ['Cup:Mouse:close_front'],
+                  ['Keyboard:PC:distant', 'Laptop:Cup:right'], [],
+                  ['Chair:Cup:left']]:
+        expected = [scene_id for [scene_id, scn], scn_qsr in
+                    zip(scenes, scns_qsr)
+                    if terms and all(matches(scn, scn_qsr, t) for t in terms)]
+        assert index.query(terms).tolist() == expected
+
+    # the index of a store is the same, also after saving and loading it
+    path = str(tmp_path / 'scenes.store')
+    write_store(scenes, path)
+    index.save(str(tmp_path / 'index.npz'))
+    loaded = RelationIndex.load(str(tmp_path / 'index.npz'))
+    stored = RelationIndex.build(SceneStore(path))
+    assert sorted(loaded.keys()) == sorted(index.keys())
+    assert sorted(stored.keys()) == sorted(index.keys())
+    for key in index.keys():
+        assert numpy.array_equal(loaded.lookup(key), index.lookup(key))
+        assert numpy.array_equal(stored.lookup(key), index.lookup(key))
+    # the loaded index is read completely, the file is closed
+    assert isinstance(loaded.postings, dict)
+    assert numpy.array_equal(loaded.ids, index.ids)
+
+def test_index_batches(monkeypatch, scenes):
+    index = RelationIndex.build([[i, dict(s)] for [i, s] in scenes])
+    # labeled in several batches, some of the scenes are labeled already
+    monkeypatch.setattr(scene_query, 'LABEL_BATCH_SIZE', 7)
+    labeled = [[i, dict(s)] for [i, s] in scenes]
+    for [scn, scn_qsr] in zip([s for [i, s] in labeled[::3]],
+                              label_scenes([s for [i, s] in labeled[::3]])):
+        scn['qsr'] = scn_qsr
+    batched = RelationIndex.build(labeled)
+    assert all('qsr' in s for [i, s] in labeled)
+    assert numpy.array_equal(batched.ids, index.ids)
+    assert sorted(batched.keys()) == sorted(index.keys())
+    for key in index.keys():
+        assert numpy.array_equal(batched.lookup(key), index.lookup(key))
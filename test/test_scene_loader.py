@@ -0,0 +1,84 @@
+import copy
+import pytest
+
+import scene_loader
+from benchmark import FakeSimulation
+from scene_loader import load_scene, switch_scene, delete_scene, \
+    pose_changes, POSE_TOLERANCE
+
+
+class RecordingSimulation(FakeSimulation):
+    """ Records the objects whose poses are set.
+    """
+    def __init__(self, objects):
+        FakeSimulation.__init__(self, objects)
+        self.moved = list()
+
+    def rpc(self, component, method, *args):
+        if method == 'set_object_pose':
+            self.moved.append(args[0])
+        return FakeSimulation.rpc(self, component, method, *args)
+
+# a table turned by 180 degrees
+TABLE_POSE = [[2.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]]
+
+def assert_same_poses(sim1, sim2):
+    assert sorted(sim1.objects) == sorted(sim2.objects)
+    for o in sim1.objects:
+        assert sim1.objects[o]['pose'][0] == pytest.approx(
+            sim2.objects[o]['pose'][0])
+        assert sim1.objects[o]['pose'][1] == pytest.approx(
+            sim2.objects[o]['pose'][1])
+
+
+def test_pose_changes():
+    current = {'cup': ([1, 2, 3], [1, 0, 0, 0]),
+               'mouse': ([1, 1, 1], [1, 0, 0, 0]),
+               'pc': ([0, 1, 0], [1, 0, 0, 0])}
+    poses = [('cup', [1, 2, 3 + POSE_TOLERANCE / 2], [1, 0, 0, 0]),
+             ('mouse', [1, 1, 1], [0, 0, 0, 1]),
+             ('monitor', [2, 2, 2], [1, 0, 0, 0])]
+    assert pose_changes(current, poses) == [
+        ('mouse', [1, 1, 1], [0, 0, 0, 1]),
+        ('monitor', [2, 2, 2], [1, 0, 0, 0]),
+        ('pc', [0, 0, 0], [1, 0, 0, 0])]
+
+@pytest.mark.parametrize('pair', [(0, 1), (3, 4), (5, 5), (10, 30)])
+def test_switch_like_reload(monkeypatch, scenes, scene_world, pair):
+    [scn1, scn2] = [scenes[i][1] for i in pair]
+    switched = RecordingSimulation(scene_world(TABLE_POSE))
+    monkeypatch.setattr(scene_loader, 'morse', switched)
+    load_scene(scn1, 'table')
+    switch_scene(scn1, scn2, 'table')
+
+    reloaded = RecordingSimulation(scene_world(TABLE_POSE))
+    monkeypatch.setattr(scene_loader, 'morse', reloaded)
+    load_scene(scn1, 'table')
+    delete_scene(scn1, 0)
+    load_scene(scn2, 'table')
+    assert_same_poses(switched, reloaded)
+
+def test_switch_moves_changes(monkeypatch, scenes, scene_world):
+    scn1 = [s for [i, s] in scenes if len(s['objects']) >= 3][0]
+    [moved, removed] = scn1['objects'][:2]
+    added = [o for [i, s] in scenes for o in s['objects']
+             if o not in scn1['objects']][0]
+    scn2 = copy.deepcopy(scn1)
+    scn2['position'][moved][0] += 0.1
+    scn2['objects'].remove(removed)
+    scn2['objects'].append(added)
+    scn2['position'][added] = [0.5, 0.5, 0.8]
+    scn2['orientation'][added] = [1.0, 0.0, 0.0, 0.0]
+
+    sim = RecordingSimulation(scene_world(TABLE_POSE))
+    monkeypatch.setattr(scene_loader, 'morse', sim)
+    load_scene(scn1, 'table')
+    sim.moved = list()
+    assert switch_scene(scn1, scn2, 'table') == 3
+    assert sorted(sim.moved) == sorted([moved, removed, added])
+    assert sim.objects[removed]['pose'][0] == [0, 0, 0]
+
+    # switching to the loaded scene moves nothing
+    sim.moved = list()
+    assert switch_scene(scn2, scn2, 'table') == 0
+    assert sim.moved == []
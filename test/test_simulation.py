@@ -0,0 +1,154 @@
+import json
+import threading
+import multiprocessing
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+import simulation
+from simulation import rpc_many, pipelined, set_object_poses, \
+    get_object_bboxes, Connection, ModelCache
+
+
+class RpcClient():
+    """ A client with only the synchronous calls of pymorse.Morse.
+    """
+    def __init__(self):
+        self.poses = dict()
+        self.requests = list()
+
+    def call(self, method, args):
+        self.requests.append((method,) + tuple(args))
+        if method == 'set_object_pose':
+            self.poses[args[0]] = [json.loads(args[1]), json.loads(args[2])]
+            return None
+        if method == 'get_object_bbox':
+            return json.dumps([[len(args[0]), 0.0, 0.0]])
+        if method == 'get_object_type':
+            return json.dumps(args[0].split('.')[0].capitalize())
+        raise ValueError('unknown service: ' + method)
+
+    def rpc(self, component, method, *args):
+        assert component == 'simulation'
+        return self.call(method, args)
+
+    def close(self):
+        pass
+
+class LostClient(RpcClient):
+    """ A client whose connection is lost.
+    """
+    def rpc(self, component, method, *args):
+        raise IOError('connection lost')
+
+class PipelinedClient(RpcClient):
+    """ A client with the executor of pymorse.Morse. A reply is only sent
+    once all requests of a batch of the given size are in flight.
+    """
+    def __init__(self, batch_size):
+        RpcClient.__init__(self)
+        self.executor = ThreadPoolExecutor(max_workers=batch_size)
+        self.barrier = threading.Barrier(batch_size, timeout=5)
+
+    def _rpc_request(self, component, method, *args):
+        return {'component': component, 'service': method, 'args': args}
+
+    def _rpc_process(self, req):
+        self.barrier.wait()
+        return self.call(req['service'], req['args'])
+
+    def rpc(self, component, method, *args):
+        raise AssertionError('a batch is sent with _rpc_process')
+
+
+def test_rpc_only():
+    client = RpcClient()
+    assert not pipelined(client)
+    set_object_poses(client, [('cup', [1, 2, 3], [1, 0, 0, 0]),
+                              ('mouse', [4, 5, 6], [0, 1, 0, 0])])
+    assert client.poses == {'cup': [[1.0, 2.0, 3.0], [1.0, 0.0, 0.0, 0.0]],
+                            'mouse': [[4.0, 5.0, 6.0], [0.0, 1.0, 0.0, 0.0]]}
+    assert get_object_bboxes(client, ['cup', 'mouse.001']) == \
+        {'cup': [[3, 0.0, 0.0]], 'mouse.001': [[9, 0.0, 0.0]]}
+
+def test_pipelined():
+    names = ['obj%i' % i for i in range(8)]
+    client = PipelinedClient(len(names))
+    assert pipelined(client)
+    # deadlocks (and times out) unless all requests are in flight at once
+    results = rpc_many(client, 'get_object_bbox', [(n,) for n in names])
+    assert results == [json.dumps([[len(n), 0.0, 0.0]]) for n in names]
+    assert sorted(client.requests) == [('get_object_bbox', n) for n in names]
+    client.executor.shutdown()
+
+def test_connection():
+    client = RpcClient()
+    calls = dict()
+    with Connection(calls=calls, factory=lambda: client) as connection:
+        set_object_poses(connection, [('cup', [1, 2, 3], [1, 0, 0, 0])])
+        cache = ModelCache()
+        cache.prefetch(connection, ['cup', 'mouse'])
+        assert cache.objects['mouse'] == {'bbox': [[5, 0.0, 0.0]],
+                                          'type': 'Mouse'}
+    assert calls['set_object_pose'][0] == 1
+    assert calls['get_object_bbox'][0] == 2
+
+def test_reconnect(monkeypatch):
+    monkeypatch.setattr(simulation, 'RECONNECT_DELAY', 0.0)
+    clients = list()
+
+    def factory():
+        clients.append(LostClient() if len(clients) < 2 else RpcClient())
+        return clients[-1]
+
+    connection = Connection(factory=factory)
+    set_object_poses(connection, [('cup', [1, 2, 3], [1, 0, 0, 0]),
+                                  ('mouse', [4, 5, 6], [1, 0, 0, 0])])
+    assert len(clients) == 3
+    assert sorted(clients[-1].poses) == ['cup', 'mouse']
+
+def test_lost_connection(monkeypatch):
+    monkeypatch.setattr(simulation, 'RECONNECT_DELAY', 0.0)
+
+    def factory():
+        raise ConnectionRefusedError()
+
+    with pytest.raises(IOError):
+        set_object_poses(Connection(factory=factory),
+                         [('cup', [1, 2, 3], [1, 0, 0, 0])])
+
+def test_cache_merge(tmp_path):
+    path = str(tmp_path / 'models.json')
+    cache1 = ModelCache(path, 'office')
+    cache2 = ModelCache(path, 'office')
+    cache1.prefetch(RpcClient(), ['cup'])
+    cache2.prefetch(RpcClient(), ['mouse'])
+    assert sorted(ModelCache(path, 'office').objects) == ['cup', 'mouse']
+    # the objects of the other cache are picked up when saving
+    assert sorted(cache2.objects) == ['cup', 'mouse']
+
+    cache2.invalidate(['cup'])
+    assert sorted(ModelCache(path, 'office').objects) == ['mouse']
+    cache2.prefetch(RpcClient(), ['pc'])
+    assert sorted(ModelCache(path, 'office').objects) == ['mouse', 'pc']
+    ModelCache(path, 'kitchen').prefetch(RpcClient(), ['cup'])
+    cache1.clear()
+    assert ModelCache(path, 'office').objects == dict()
+    assert sorted(ModelCache(path, 'kitchen').objects) == ['cup']
+
+def fill_cache(path, names):
+    cache = ModelCache(path, 'office')
+    for n in names:
+        cache.prefetch(RpcClient(), [n])
+
+def test_cache_processes(tmp_path):
+    path = str(tmp_path / 'models.json')
+    context = multiprocessing.get_context('fork')
+    names = [['obj%i.%03i' % (p, i) for i in range(20)] for p in range(4)]
+    procs = [context.Process(target=fill_cache, args=(path, n))
+             for n in names]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert sorted(ModelCache(path, 'office').objects) == \
+        sorted(n for l in names for n in l)